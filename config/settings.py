@@ -46,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'portfolio_tracker.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware', # <--- Add this
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -142,7 +143,123 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'America/Los_Angeles' # 建議設定為您常用的時區
 FINNHUB_API_TOKEN = os.environ.get('FINNHUB_API_TOKEN')
+# Finnhub quotas, enforced cluster-wide by portfolio_tracker.rate_limiter
+FINNHUB_RATE_LIMIT_PER_SECOND = int(os.getenv('FINNHUB_RATE_LIMIT_PER_SECOND', '30'))
+FINNHUB_RATE_LIMIT_PER_MINUTE = int(os.getenv('FINNHUB_RATE_LIMIT_PER_MINUTE', '60'))
+# Longest a worker blocks waiting for a token before re-queueing itself
+FINNHUB_RATE_LIMIT_MAX_WAIT = float(os.getenv('FINNHUB_RATE_LIMIT_MAX_WAIT', '10'))
 ALPHA_VANTAGE_API_KEY = os.environ.get('ALPHA_VANTAGE_API_KEY')
+# Shared quote cache (portfolio_tracker.quote_cache), in seconds
+QUOTE_CACHE_MAX_AGE = float(os.getenv('QUOTE_CACHE_MAX_AGE', '15'))
+QUOTE_CACHE_TTL = int(os.getenv('QUOTE_CACHE_TTL', '300'))
+QUOTE_CACHE_LOCK_TIMEOUT = float(os.getenv('QUOTE_CACHE_LOCK_TIMEOUT', '30'))
+# Callers waiting on another worker's fetch give up (tasks re-queue) after this long
+QUOTE_CACHE_FOLLOWER_WAIT = float(os.getenv('QUOTE_CACHE_FOLLOWER_WAIT', '2'))
+QUOTE_CACHE_POLL_INTERVAL = float(os.getenv('QUOTE_CACHE_POLL_INTERVAL', '0.05'))
+# Price changes are coalesced for this many seconds into one WebSocket "price.batch" message
+PRICE_BROADCAST_WINDOW = float(os.getenv('PRICE_BROADCAST_WINDOW', '0.25'))
+# Symbols are hashed into this many channel groups; clients join the shards of the symbols they watch
+PRICE_BROADCAST_SHARDS = int(os.getenv('PRICE_BROADCAST_SHARDS', '64'))
+# Each web process reports its WebSocket clients and watched symbols under keys that expire after this many
+# seconds and are refreshed three times per TTL, so a process that dies without disconnecting stops counting
+WEBSOCKET_PRESENCE_TTL = int(os.getenv('WEBSOCKET_PRESENCE_TTL', '90'))
+# Most symbols one WebSocket connection may watch; each one costs a shard group membership and a presence entry
+WEBSOCKET_MAX_SYMBOLS = int(os.getenv('WEBSOCKET_MAX_SYMBOLS', '500'))
+# Base URLs are overridable so the fetchers can be pointed at a local stub server
+FINNHUB_BASE_URL = os.getenv('FINNHUB_BASE_URL', 'https://finnhub.io/api/v1')
+ALPHA_VANTAGE_BASE_URL = os.getenv('ALPHA_VANTAGE_BASE_URL', 'https://www.alphavantage.co')
+# Outbound HTTP client (portfolio_tracker.http_client)
+HTTP_CLIENT_CONNECT_TIMEOUT = float(os.getenv('HTTP_CLIENT_CONNECT_TIMEOUT', '3.05'))
+HTTP_CLIENT_READ_TIMEOUT = float(os.getenv('HTTP_CLIENT_READ_TIMEOUT', '10'))
+HTTP_CLIENT_MAX_RETRIES = int(os.getenv('HTTP_CLIENT_MAX_RETRIES', '3'))
+HTTP_CLIENT_BACKOFF_FACTOR = float(os.getenv('HTTP_CLIENT_BACKOFF_FACTOR', '0.5'))
+HTTP_CLIENT_BACKOFF_JITTER = float(os.getenv('HTTP_CLIENT_BACKOFF_JITTER', '0.25'))
+# Longest single wait between retries, including a provider's Retry-After, in seconds
+HTTP_CLIENT_BACKOFF_MAX = float(os.getenv('HTTP_CLIENT_BACKOFF_MAX', '5'))
+HTTP_CLIENT_POOL_CONNECTIONS = int(os.getenv('HTTP_CLIENT_POOL_CONNECTIONS', '4'))
+HTTP_CLIENT_POOL_MAXSIZE = int(os.getenv('HTTP_CLIENT_POOL_MAXSIZE', '10'))
+# Bytes read per chunk when a large response (the option chain) is parsed as it streams in
+HTTP_CLIENT_STREAM_CHUNK_SIZE = int(os.getenv('HTTP_CLIENT_STREAM_CHUNK_SIZE', '65536'))
+# Transactions folded between saved checkpoints when replaying the transaction log
+REPLAY_CHECKPOINT_INTERVAL = int(os.getenv('REPLAY_CHECKPOINT_INTERVAL', '5000'))
+# Raw PriceBar rows older than this are rolled up into daily bars; daily bars are kept for the second window
+PRICE_BAR_RAW_RETENTION_DAYS = int(os.getenv('PRICE_BAR_RAW_RETENTION_DAYS', '30'))
+PRICE_BAR_DAILY_RETENTION_DAYS = int(os.getenv('PRICE_BAR_DAILY_RETENTION_DAYS', '3650'))
+# Benchmarks whose daily candles are stored by sync_benchmark_candles; the first is the default
+BENCHMARK_SYMBOLS = os.getenv('BENCHMARK_SYMBOLS', 'VOO').split(',')
+# Rows per UPDATE when rolling last_price into previous_close on large tables
+PREVIOUS_CLOSE_ROLLOVER_CHUNK_SIZE = int(os.getenv('PREVIOUS_CLOSE_ROLLOVER_CHUNK_SIZE', '50000'))
+# Opt-in keyset pagination (?page_size=/?cursor=) and ?stream=1 exports of large lists (portfolio_tracker.pagination)
+KEYSET_PAGE_SIZE = int(os.getenv('KEYSET_PAGE_SIZE', '100'))
+KEYSET_MAX_PAGE_SIZE = int(os.getenv('KEYSET_MAX_PAGE_SIZE', '1000'))
+STREAMING_CHUNK_SIZE = int(os.getenv('STREAMING_CHUNK_SIZE', '2000'))
+# Adaptive price polling (portfolio_tracker.polling), driven by the schedule_price_polls beat entry
+# Extra full-day market closures, e.g. "2025-01-09" (national day of mourning)
+MARKET_EXTRA_CLOSURES = [day for day in os.getenv('MARKET_EXTRA_CLOSURES', '').split(',') if day]
+# Share of the Finnhub per-minute quota scheduled polling may spend; the rest stays free for on-demand quotes
+POLL_QUOTA_SHARE = float(os.getenv('POLL_QUOTA_SHARE', '0.8'))
+# Pre-market and after-hours quotes move less, so only this fraction of that budget is spent then
+POLL_EXTENDED_HOURS_QUOTA_SHARE = float(os.getenv('POLL_EXTENDED_HOURS_QUOTA_SHARE', '0.25'))
+# Fraction of the regular-session budget given to option chains (options do not trade outside it)
+POLL_OPTION_QUOTA_SHARE = float(os.getenv('POLL_OPTION_QUOTA_SHARE', '0.3'))
+# No instrument is polled more often than this, in seconds
+POLL_MIN_INTERVAL = float(os.getenv('POLL_MIN_INTERVAL', '15'))
+# How strongly position size, recent volatility and live WebSocket viewers raise an instrument's priority
+POLL_POSITION_WEIGHT = float(os.getenv('POLL_POSITION_WEIGHT', '1.0'))
+POLL_VOLATILITY_WEIGHT = float(os.getenv('POLL_VOLATILITY_WEIGHT', '1.0'))
+POLL_SUBSCRIBER_WEIGHT = float(os.getenv('POLL_SUBSCRIBER_WEIGHT', '2.0'))
+POLL_VOLATILITY_WINDOW_MINUTES = int(os.getenv('POLL_VOLATILITY_WINDOW_MINUTES', '60'))
+# The plan of poll intervals is recomputed at most this often, in seconds
+POLL_PLAN_TTL = int(os.getenv('POLL_PLAN_TTL', '60'))
+# Flat annual rates for the Black-Scholes Greeks (portfolio_tracker.greeks)
+GREEKS_RISK_FREE_RATE = float(os.getenv('GREEKS_RISK_FREE_RATE', '0.04'))
+GREEKS_DIVIDEND_YIELD = float(os.getenv('GREEKS_DIVIDEND_YIELD', '0'))
+# Greeks are recomputed when a price or position changes, and at least this often (seconds) for time decay
+GREEKS_CACHE_SECONDS = int(os.getenv('GREEKS_CACHE_SECONDS', '60'))
+# Historical risk (portfolio_tracker.risk): calendar days of daily returns behind the covariance matrix
+RISK_LOOKBACK_DAYS = int(os.getenv('RISK_LOOKBACK_DAYS', '365'))
+# Instrument pairs with fewer common trading days than this get no covariance
+RISK_MIN_OBSERVATIONS = int(os.getenv('RISK_MIN_OBSERVATIONS', '20'))
+RISK_CONFIDENCE_LEVELS = [float(c) for c in os.getenv('RISK_CONFIDENCE_LEVELS', '0.95,0.99').split(',')]
+# Beta is measured against this symbol's stored candles
+RISK_BENCHMARK_SYMBOL = os.getenv('RISK_BENCHMARK_SYMBOL', BENCHMARK_SYMBOLS[0])
+# The daily model is shared through Redis for this long, in seconds
+RISK_MODEL_TTL = int(os.getenv('RISK_MODEL_TTL', str(2 * 24 * 3600)))
+# Rebalancing (portfolio_tracker.allocation): fraction of portfolio value always left in cash
+REBALANCE_CASH_BUFFER = float(os.getenv('REBALANCE_CASH_BUFFER', '0.02'))
+# Mean-variance mode: penalty on annualized variance, and the most any one target group may get
+REBALANCE_RISK_AVERSION = float(os.getenv('REBALANCE_RISK_AVERSION', '5.0'))
+REBALANCE_MAX_WEIGHT = float(os.getenv('REBALANCE_MAX_WEIGHT', '0.25'))
+# Pulls the group covariance this far toward its diagonal, keeping the pairwise estimate well conditioned
+REBALANCE_COVARIANCE_SHRINKAGE = float(os.getenv('REBALANCE_COVARIANCE_SHRINKAGE', '0.1'))
+
+# Prometheus metrics (portfolio_tracker.metrics), stored in Redis and served at /metrics
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True') == 'True'
+# Seconds to stop recording after Redis fails, so an outage never slows requests or tasks
+METRICS_RETRY_AFTER = float(os.getenv('METRICS_RETRY_AFTER', '30'))
+# If set, /metrics requires "Authorization: Bearer <token>"
+METRICS_AUTH_TOKEN = os.getenv('METRICS_AUTH_TOKEN')
+METRICS_CELERY_QUEUES = os.getenv('METRICS_CELERY_QUEUES', 'celery').split(',')
+
+# Structured logging: LOG_FORMAT=json for one JSON object per line, "text" for key=value lines
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'portfolio_tracker.log_formatting.JsonFormatter'},
+        'text': {
+            '()': 'portfolio_tracker.log_formatting.KeyValueFormatter',
+            'format': '%(asctime)s %(levelname)s %(name)s %(message)s',
+        },
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': LOG_FORMAT},
+    },
+    'root': {'handlers': ['console'], 'level': os.getenv('LOG_LEVEL', 'INFO')},
+}
+# Keep this configuration in workers instead of Celery's own root handler
+CELERY_WORKER_HIJACK_ROOT_LOGGER = False
 
 CORS_ALLOW_ALL_ORIGINS = True 
 
@@ -1,8 +1,10 @@
 # config/urls.py
 from django.contrib import admin
 from django.urls import path, include # 確保 include 被匯入
+from portfolio_tracker.views import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('portfolio_tracker.urls')),
-]
\ No newline at end of file
+    path('metrics', metrics_view, name='metrics'),
+]
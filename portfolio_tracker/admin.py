@@ -1,15 +1,83 @@
 # portfolio_tracker/admin.py
 
 from django.contrib import admin
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+
+from . import ledger
 from .models import (
-    Stock, Option, Holding, Deposit, Transaction, RealizedGain, PortfolioSnapshot
+    Stock, Option, Holding, Deposit, Transaction, RealizedGain, PortfolioSnapshot,
+    BenchmarkCandle, LedgerTotals, AllocationTarget,
 )
+from .tasks import replay_transaction_log
 
 # This makes your models visible on the admin site.
 admin.site.register(Stock)
 admin.site.register(Option)
 admin.site.register(Holding)
-admin.site.register(Deposit)
-admin.site.register(Transaction)
-admin.site.register(RealizedGain)
-admin.site.register(PortfolioSnapshot)
\ No newline at end of file
+admin.site.register(PortfolioSnapshot)
+admin.site.register(BenchmarkCandle)
+admin.site.register(AllocationTarget)
+
+
+# Edits to the cash ledger tables book their effect on LedgerTotals in the same
+# database transaction, like the API views do.
+
+class LedgerAdmin(admin.ModelAdmin):
+    def book(self, obj, sign: int) -> None:
+        raise NotImplementedError
+
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            if change:
+                self.book(type(obj).objects.select_for_update().get(pk=obj.pk), sign=-1)
+            super().save_model(request, obj, form, change)
+            self.book(obj, sign=1)
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            super().delete_model(request, obj)
+            self.book(obj, sign=-1)
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            objs = list(queryset.select_for_update())
+            super().delete_queryset(request, queryset)
+            for obj in objs:
+                self.book(obj, sign=-1)
+
+
+@admin.register(Deposit)
+class DepositAdmin(LedgerAdmin):
+    def book(self, obj, sign):
+        ledger.record_deposit(obj.amount, sign=sign)
+
+
+@admin.register(RealizedGain)
+class RealizedGainAdmin(LedgerAdmin):
+    def book(self, obj, sign):
+        ledger.record_realized_gain(obj.realized_pnl, sign=sign)
+
+
+@admin.register(Transaction)
+class TransactionAdmin(LedgerAdmin):
+    def book(self, obj, sign):
+        is_option = obj.content_type_id == ContentType.objects.get_for_model(Option).id
+        ledger.record_trade(obj.transaction_type, obj.quantity, obj.price, is_option, sign=sign)
+        # Holdings and realized gains are rebuilt from the earliest date the edit touches.
+        since = obj.date.isoformat()
+        transaction.on_commit(lambda: replay_transaction_log.delay(since=since))
+
+
+@admin.register(LedgerTotals)
+class LedgerTotalsAdmin(admin.ModelAdmin):
+    """Read-only: the row is derived. Repair drift with `manage.py rebuild_ledger_totals`."""
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,362 @@
+# portfolio_tracker/allocation.py
+"""
+Rebalancing toward target allocations.
+
+Each AllocationTarget is a group: its stocks plus the options on them. Every
+other holding is left alone. Weights are fractions of the total portfolio
+value V = holdings at market value + free cash. The solve has three steps:
+
+1. Group values. With current values c, targets t = w V and the budget
+   B = V - cash buffer - untargeted holdings, pick x minimizing |x - t|^2
+   subject to sum(x) <= B and x >= lower, where lower is c under no-sell and
+   min(c, t) otherwise, so only overweight groups are ever trimmed; the
+   solution is x = max(lower, t - lam) for the lam >= 0 that meets the budget.
+2. Instrument trades. A group that shrinks sells its long positions pro
+   rata; one that grows buys its stocks in the current mix (equally if none
+   is held yet).
+3. Lots. Trades become whole shares and whole option contracts without
+   spending the cash buffer, and leftover cash buys single lots greedily
+   wherever that brings a group closest to its value from step 1.
+
+mode='mean_variance' swaps the stored weights for a long-only mean-variance
+optimum over the same groups, solved on the risk model's daily returns
+(see risk.py); steps 1-3 then trade toward it. Short positions are never
+traded. Everything is array work, so several hundred positions solve in
+milliseconds.
+"""
+import time
+from typing import Optional
+
+import numpy as np
+from django.conf import settings
+
+from . import ledger
+from .models import Stock, Option, AllocationTarget
+from .risk import get_model, pairwise_covariance
+from .valuation import value_holdings
+
+TRADING_DAYS_PER_YEAR = 252
+
+
+class RebalanceError(Exception):
+    """The request cannot be solved, e.g. there are no targets to rebalance to."""
+
+
+def _load_book() -> dict:
+    """
+    Targets, holdings, member-stock prices and free cash as aligned arrays,
+    one row per instrument: every held stock and option, plus target stocks
+    not held yet. Seven queries whatever the portfolio size.
+    """
+    targets = list(AllocationTarget.objects.values_list('id', 'name', 'weight'))
+    group_of_target = {target_id: g for g, (target_id, _, _) in enumerate(targets)}
+    group_of_stock = {
+        stock_id: group_of_target[target_id]
+        for target_id, stock_id in AllocationTarget.stocks.through.objects.values_list('allocationtarget_id', 'stock_id')
+    }
+
+    valuation = value_holdings()
+    held = {}
+    for position, quantity, value, price, multiplier in zip(
+        valuation.positions, valuation.quantity.tolist(), valuation.market_value.tolist(),
+        np.nan_to_num(valuation.last_price).tolist(), valuation.multiplier.tolist(),
+    ):
+        if position['instrument_type'] is None:
+            continue
+        key = (position['instrument_type'], position['object_id'])
+        if key in held:
+            quantity, value = quantity + held[key][0], value + held[key][1]
+        held[key] = (quantity, value, position['instrument_name'], price, multiplier)
+    option_ids = [object_id for kind, object_id in held if kind == 'option']
+    underlying = dict(Option.objects.filter(id__in=option_ids).values_list('id', 'underlying_stock_id')) if option_ids else {}
+    candidates = [stock_id for stock_id in group_of_stock if ('stock', stock_id) not in held]
+    for stock_id, symbol, price in Stock.objects.filter(id__in=candidates).values_list('id', 'symbol', 'last_price'):
+        held[('stock', stock_id)] = (0.0, 0.0, symbol, float(price or 0), 1.0)
+
+    keys = list(held)
+    rows = [held[key] for key in keys]
+    stock_of = [object_id if kind == 'stock' else underlying.get(object_id) for kind, object_id in keys]
+    return {
+        'targets': targets,
+        'keys': keys,
+        'stock_ids': stock_of,
+        'names': [row[2] for row in rows],
+        'quantity': np.array([row[0] for row in rows], dtype=float),
+        'value': np.array([row[1] for row in rows], dtype=float),
+        'price': np.array([row[3] for row in rows], dtype=float),
+        'multiplier': np.array([row[4] for row in rows], dtype=float),
+        'group': np.array([group_of_stock.get(stock_id, -1) for stock_id in stock_of], dtype=int),
+        'is_stock': np.array([kind == 'stock' for kind, _ in keys], dtype=bool),
+        'free_cash': float(ledger.get_totals().free_cash),
+    }
+
+
+def _fill(target: np.ndarray, lower: np.ndarray, budget: float) -> np.ndarray:
+    """argmin |x - target|^2 subject to x >= lower and sum(x) <= budget."""
+    x = np.maximum(lower, target)
+    if x.sum() <= budget:
+        return x
+    if lower.sum() >= budget:
+        return lower.copy()
+    lo, hi = 0.0, float(np.max(target - lower))
+    for _ in range(60):
+        lam = (lo + hi) / 2
+        if np.maximum(lower, target - lam).sum() > budget:
+            lo = lam
+        else:
+            hi = lam
+    return np.maximum(lower, target - hi)
+
+
+def project_capped_simplex(v: np.ndarray, total: float, cap: float) -> np.ndarray:
+    """
+    Euclidean projection of `v` onto {w : 0 <= w <= cap, sum(w) = total},
+    exactly: w = clip(v - tau, 0, cap), with tau read off the piecewise-linear
+    sum at the sorted breakpoints (prefix sums plus searchsorted, no iteration).
+    """
+    cap = max(cap, total / len(v))
+    a = np.sort(v)[::-1]
+    b = a - cap
+    prefix_a, prefix_b = np.concatenate([[0.0], np.cumsum(a)]), np.concatenate([[0.0], np.cumsum(b)])
+
+    def clipped_sum(tau):
+        # sum(max(a - tau, 0)) - sum(max(b - tau, 0)) == sum(clip(v - tau, 0, cap))
+        ka, kb = np.searchsorted(-a, -tau, side='left'), np.searchsorted(-b, -tau, side='left')
+        return (prefix_a[ka] - ka * tau) - (prefix_b[kb] - kb * tau)
+
+    breakpoints = np.unique(np.concatenate([a, b]))
+    sums = clipped_sum(breakpoints)
+    i = int(np.argmax(sums <= total))
+    if i == 0:
+        return np.clip(v - breakpoints[0], 0, cap)
+    t0, t1, s0, s1 = breakpoints[i - 1], breakpoints[i], sums[i - 1], sums[i]
+    tau = t0 + (s0 - total) * (t1 - t0) / (s0 - s1)
+    return np.clip(v - tau, 0, cap)
+
+
+def mean_variance_weights(mean: np.ndarray, covariance: np.ndarray, total: float,
+                          risk_aversion: float, max_weight: float) -> np.ndarray:
+    """
+    Long-only weights maximizing mean'w - risk_aversion / 2 * w'Cw with
+    0 <= w <= max_weight and sum(w) = total, by accelerated projected
+    gradient (FISTA) with step 1 / Lipschitz constant from power iteration.
+    """
+    n = len(mean)
+    if n == 0:
+        return np.zeros(0)
+    v = np.ones(n) / np.sqrt(n)
+    for _ in range(30):
+        v = covariance @ v
+        v /= np.linalg.norm(v) or 1.0
+    lipschitz = risk_aversion * float(np.abs(v @ covariance @ v)) * 1.1 or 1.0
+
+    w = project_capped_simplex(np.full(n, total / n), total, max_weight)
+    y, momentum = w, 1.0
+    for _ in range(500):
+        gradient = risk_aversion * (covariance @ y) - mean
+        w_next = project_capped_simplex(y - gradient / lipschitz, total, max_weight)
+        momentum_next = (1 + np.sqrt(1 + 4 * momentum * momentum)) / 2
+        y = w_next + (momentum - 1) / momentum_next * (w_next - w)
+        if np.max(np.abs(w_next - w)) < 1e-9:
+            w = w_next
+            break
+        w, momentum = w_next, momentum_next
+    return w
+
+
+def _group_returns(book: dict, groups: int) -> np.ndarray:
+    """Daily returns of each group, the equal-weighted mean of its stocks; NaN where none has a price."""
+    members = sorted({stock_id for stock_id, g, is_stock in zip(book['stock_ids'], book['group'], book['is_stock'])
+                      if g >= 0 and is_stock})
+    model = get_model(members)
+    returns = model.returns[:, [model.column[stock_id] for stock_id in members]]
+    group_of = dict(zip(book['stock_ids'], book['group']))
+    membership = np.zeros((len(members), groups))
+    membership[np.arange(len(members)), [group_of[stock_id] for stock_id in members]] = 1.0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (np.nan_to_num(returns) @ membership) / (np.isfinite(returns) @ membership)
+
+
+def _mean_variance_targets(book: dict, weights: np.ndarray, total: float, risk_aversion: float,
+                           max_weight: float) -> dict:
+    returns = _group_returns(book, len(weights))
+    covariance = pairwise_covariance(returns, returns) * TRADING_DAYS_PER_YEAR
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.nansum(returns, axis=0) / np.isfinite(returns).sum(axis=0) * TRADING_DAYS_PER_YEAR
+    usable = np.isfinite(mean) & np.isfinite(np.diag(covariance))
+    cov = np.nan_to_num(covariance[np.ix_(usable, usable)])
+    # Shrink toward the diagonal: pairwise-complete estimates need not be positive definite.
+    shrinkage = settings.REBALANCE_COVARIANCE_SHRINKAGE
+    cov = (1 - shrinkage) * cov + shrinkage * np.diag(np.diag(cov))
+
+    # Groups without enough history keep their stored weight; the rest is optimized.
+    optimized = np.where(usable, 0.0, weights)
+    optimized[usable] = mean_variance_weights(
+        mean[usable], cov, max(total - float(optimized.sum()), 0.0), risk_aversion, max_weight,
+    )
+    chosen = optimized[usable]
+    return {
+        'weights': optimized,
+        'report': {
+            'risk_aversion': risk_aversion,
+            'max_weight': max_weight,
+            'expected_return': float(mean[usable] @ chosen),
+            'volatility': float(np.sqrt(max(chosen @ cov @ chosen, 0.0))),
+            'observations': len(returns),
+            'excluded': [bool(not ok) for ok in usable],
+        },
+    }
+
+
+def _round_to_lots(book: dict, trade: np.ndarray, plan: np.ndarray, spendable: float) -> np.ndarray:
+    """
+    Dollar trades -> whole lots (shares, contracts). Sells round to the
+    nearest lot and never exceed the position; buys round down, are trimmed
+    if they overspend `spendable`, and leftover cash then buys one lot at a
+    time wherever that most reduces the squared distance to `plan`.
+    """
+    lot = book['price'] * book['multiplier']
+    tradable = lot > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        wanted = np.where(tradable, trade / lot, 0.0)
+    lots = np.where(wanted < 0, -np.minimum(np.rint(-wanted), np.maximum(book['quantity'], 0)), np.floor(wanted))
+    lots[~tradable] = 0
+
+    group, groups = book['group'], len(plan)
+    buyable = book['is_stock'] & tradable & (group >= 0)
+
+    def shortfall(current_lots):
+        final = np.bincount(group[group >= 0], weights=(book['value'] + current_lots * lot)[group >= 0], minlength=groups)
+        return plan - final
+
+    def cash_left(current_lots):
+        return spendable - float(current_lots @ lot)
+
+    for _ in range(len(lots) * 4 + 100):
+        if cash_left(lots) >= 0:
+            break
+        # Drop a lot from the buy whose group would end furthest above plan.
+        buys = lots > 0
+        if not buys.any():
+            break
+        deficit = shortfall(lots)
+        j = int(np.flatnonzero(buys)[np.argmin(deficit[group[buys]])])
+        lots[j] -= 1
+
+    for _ in range(len(lots) * 4 + 100):
+        remaining = cash_left(lots)
+        deficit = shortfall(lots)
+        gain = np.where(buyable & (lot <= remaining), lot * (2 * deficit[np.maximum(group, 0)] - lot), -np.inf)
+        j = int(np.argmax(gain)) if len(gain) else 0
+        if not len(gain) or gain[j] <= 0:
+            break
+        lots[j] += 1
+    return lots
+
+
+def rebalance(mode: str = 'targets', no_sell: bool = False, cash_buffer: Optional[float] = None,
+              band: float = 0.0, risk_aversion: Optional[float] = None, max_weight: Optional[float] = None) -> dict:
+    """
+    The trade list that moves the portfolio to its target weights (or, in
+    'mean_variance' mode, to the mean-variance optimum over the targets'
+    groups), within whole lots, the cash buffer and, with `no_sell`, buys
+    only. Groups within `band` (a weight fraction) of target are not traded.
+    """
+    started = time.perf_counter()
+    cash_buffer = settings.REBALANCE_CASH_BUFFER if cash_buffer is None else cash_buffer
+    book = _load_book()
+    targets = book['targets']
+    if not targets:
+        raise RebalanceError("No allocation targets are set.")
+
+    group, value, groups = book['group'], book['value'], len(targets)
+    in_group = group >= 0
+    current = np.bincount(group[in_group], weights=value[in_group], minlength=groups)
+    total_value = float(value.sum()) + book['free_cash']
+    untargeted = float(value[~in_group].sum())
+    buffer_amount = cash_buffer * total_value
+    weights = np.array([float(weight) for _, _, weight in targets])
+
+    mean_variance = None
+    if mode == 'mean_variance':
+        result = _mean_variance_targets(
+            book, weights, float(weights.sum()),
+            settings.REBALANCE_RISK_AVERSION if risk_aversion is None else risk_aversion,
+            settings.REBALANCE_MAX_WEIGHT if max_weight is None else max_weight,
+        )
+        weights, mean_variance = result['weights'], result['report']
+
+    target = weights * total_value
+    # Groups inside the band stay as they are and keep their share of the budget.
+    hold = np.abs(current - target) <= band * total_value
+    # An underweight group is never sold to fund another one.
+    lower = np.where(hold | no_sell, current, np.minimum(current, target))
+    target = np.where(hold, current, target)
+    budget = total_value - buffer_amount - untargeted
+    plan = _fill(target, lower, budget)
+
+    # Spread each group's change over its instruments.
+    change = plan - current
+    g = np.maximum(group, 0)
+    long_value = np.where(in_group & (value > 0), value, 0.0)
+    long_total = np.bincount(g, weights=long_value, minlength=groups)
+    buyable = in_group & book['is_stock'] & (book['price'] > 0)
+    buy_mix = np.where(buyable, np.maximum(value, 0.0), 0.0)
+    buy_total = np.bincount(g, weights=buy_mix, minlength=groups)
+    buy_count = np.bincount(g, weights=buyable.astype(float), minlength=groups)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sell_share = np.nan_to_num(long_value / long_total[g])
+        buy_share = np.where(buy_total[g] > 0, buy_mix / buy_total[g], buyable / buy_count[g])
+    group_change = np.where(in_group, change[g], 0.0)
+    trade = np.where(group_change < 0, group_change * sell_share, group_change * np.nan_to_num(buy_share))
+
+    spendable = book['free_cash'] - buffer_amount
+    lots = _round_to_lots(book, trade, plan, spendable)
+    lot = book['price'] * book['multiplier']
+    amount = lots * lot
+    final = np.bincount(g[in_group], weights=(value + amount)[in_group], minlength=groups)
+    cash_after = book['free_cash'] - float(amount.sum())
+
+    trades = [
+        {
+            'instrument_type': kind,
+            'object_id': object_id,
+            'instrument_name': book['names'][i],
+            'target': targets[group[i]][1],
+            'side': 'buy' if lots[i] > 0 else 'sell',
+            'quantity': abs(int(lots[i])),
+            'price': float(book['price'][i]),
+            'amount': float(amount[i]),
+        }
+        for i, (kind, object_id) in enumerate(book['keys']) if lots[i]
+    ]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        current_weight, final_weight = current / total_value, final / total_value
+    result = {
+        'mode': mode,
+        'no_sell': no_sell,
+        'total_value': total_value,
+        'free_cash': book['free_cash'],
+        'cash_buffer': buffer_amount,
+        'cash_after': cash_after,
+        'untargeted_value': untargeted,
+        'turnover': float(np.abs(amount).sum()),
+        'targets': [
+            {
+                'name': name,
+                'target_weight': weights[i].item(),
+                'current_value': current[i].item(),
+                'current_weight': current_weight[i].item() if total_value else None,
+                'planned_value': plan[i].item(),
+                'final_value': final[i].item(),
+                'final_weight': final_weight[i].item() if total_value else None,
+            }
+            for i, (_, name, _) in enumerate(targets)
+        ],
+        'trades': trades,
+    }
+    if mean_variance is not None:
+        mean_variance['excluded'] = [name for (_, name, _), excluded in zip(targets, mean_variance['excluded']) if excluded]
+        result['mean_variance'] = mean_variance
+    result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return result
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class PortfolioTrackerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'portfolio_tracker'
+
+    def ready(self):
+        from . import metrics
+        metrics.connect_celery_signals()
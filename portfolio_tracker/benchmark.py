@@ -0,0 +1,278 @@
+# portfolio_tracker/benchmark.py
+"""
+Synthetic-portfolio benchmark harness used by `manage.py run_benchmarks`.
+
+seed_portfolio() fills an (empty, throwaway) database with a reproducible
+portfolio of the requested size, stub_providers() replaces Finnhub, Alpha
+Vantage and the Redis-backed broadcast path with deterministic in-process
+fakes, and run_cases() times the tasks and views we care about.
+"""
+import json
+import random
+import statistics
+import time
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass
+from datetime import date, datetime, time as dt_time, timedelta, timezone as dt_timezone
+from decimal import ROUND_DOWN, Decimal
+from typing import Callable, Optional
+from unittest import mock
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from . import ledger, tasks
+from .models import (
+    Stock, Option, Holding, Deposit, Transaction, PortfolioSnapshot, BenchmarkCandle, AllocationTarget,
+)
+
+SIZES = {
+    'smoke':  {'stocks': 100,    'options': 1_000,   'transactions': 10_000,    'years': 1},
+    'medium': {'stocks': 1_000,  'options': 10_000,  'transactions': 100_000,   'years': 5},
+    'full':   {'stocks': 10_000, 'options': 100_000, 'transactions': 1_000_000, 'years': 10},
+}
+BATCH_SIZE = 10_000
+TARGET_GROUP_SIZE = 10
+CENT = Decimal('0.01')
+
+
+def _price(value: float) -> Decimal:
+    return Decimal(str(round(value, 4)))
+
+
+def seed_portfolio(stocks: int, options: int, transactions: int, years: int, seed: int = 0) -> dict:
+    """
+    Bulk-inserts a synthetic portfolio into an empty database: `stocks` stocks,
+    `options` contracts spread over them, `transactions` buys dated over the
+    last `years` years, the holdings and deposits those buys imply, one
+    snapshot and one benchmark candle per day, allocation targets over
+    consecutive blocks of TARGET_GROUP_SIZE stocks, and rebuilt ledger totals.
+    The same arguments and seed always produce the same rows.
+    """
+    rng = random.Random(seed)
+    today = date.today()
+    start = today - timedelta(days=365 * years)
+
+    Stock.objects.bulk_create([
+        Stock(symbol=f"B{i:05d}", last_price=_price(p), previous_close=_price(p * rng.uniform(0.97, 1.03)))
+        for i, p in ((i, rng.uniform(5, 500)) for i in range(stocks))
+    ], batch_size=BATCH_SIZE)
+    stock_rows = list(Stock.objects.order_by('id').values_list('id', 'last_price'))
+
+    # Contracts per underlying are distinct (expiry, strike, type) combinations.
+    option_rows = []
+    for n in range(options):
+        stock_id, spot = stock_rows[n % len(stock_rows)]
+        slot = n // len(stock_rows)
+        option_rows.append(Option(
+            underlying_stock_id=stock_id,
+            expiration_date=today + timedelta(days=7 * (1 + slot // 20)),
+            strike_price=(spot * Decimal('0.8') + slot % 20 * spot / 50).quantize(Decimal('0.5')),
+            option_type='C' if slot % 2 else 'P',
+            last_price=_price(rng.uniform(0.05, 30)), previous_close=_price(rng.uniform(0.05, 30)),
+        ))
+    Option.objects.bulk_create(option_rows, batch_size=BATCH_SIZE, ignore_conflicts=True)
+    del option_rows
+
+    stock_type = ContentType.objects.get_for_model(Stock).id
+    option_type = ContentType.objects.get_for_model(Option).id
+    instruments = [(stock_type, stock_id) for stock_id, _ in stock_rows] + [
+        (option_type, option_id) for option_id in Option.objects.values_list('id', flat=True)
+    ]
+
+    # Fold the buys into holdings while inserting them, one batch in memory at a time.
+    positions = {}
+    span = (today - start).days * 86400
+    epoch = datetime.combine(start, dt_time(14, 30), tzinfo=dt_timezone.utc)
+    cash_needed = Decimal(0)
+    for offset in range(0, transactions, BATCH_SIZE):
+        batch = []
+        for _ in range(min(BATCH_SIZE, transactions - offset)):
+            content_type_id, object_id = rng.choice(instruments)
+            is_option = content_type_id == option_type
+            quantity = Decimal(rng.randint(1, 5) if is_option else rng.randint(1, 100))
+            price = _price(rng.uniform(0.05, 30) if is_option else rng.uniform(5, 500))
+            batch.append(Transaction(
+                content_type_id=content_type_id, object_id=object_id, transaction_type='buy',
+                quantity=quantity, price=price, date=epoch + timedelta(seconds=rng.randrange(span)),
+            ))
+            quantity_held, cost = positions.get((content_type_id, object_id), (Decimal(0), Decimal(0)))
+            positions[(content_type_id, object_id)] = (quantity_held + quantity, cost + quantity * price)
+            cash_needed += ledger.trade_amount(quantity, price, is_option)
+        Transaction.objects.bulk_create(batch, batch_size=BATCH_SIZE)
+
+    Holding.objects.bulk_create([
+        Holding(content_type_id=content_type_id, object_id=object_id,
+                quantity=quantity, cost_basis=(cost / quantity).quantize(Decimal('0.0001')))
+        for (content_type_id, object_id), (quantity, cost) in positions.items()
+    ], batch_size=BATCH_SIZE)
+
+    # Monthly deposits that together cover every buy.
+    months = max(1, 12 * years)
+    monthly = (cash_needed / months).quantize(CENT) + CENT
+    Deposit.objects.bulk_create([
+        Deposit(amount=monthly, date=epoch + timedelta(days=30 * m)) for m in range(months)
+    ], batch_size=BATCH_SIZE)
+
+    days = [start + timedelta(days=d) for d in range((today - start).days)]
+    value, close = 100_000.0, 400.0
+    snapshots, candles = [], []
+    for day in days:
+        value *= 1 + rng.gauss(0.0003, 0.01)
+        close *= 1 + rng.gauss(0.0003, 0.01)
+        snapshots.append(PortfolioSnapshot(date=day, total_value=_price(value)))
+        candles.append(BenchmarkCandle(symbol='VOO', date=day, close=_price(close)))
+    PortfolioSnapshot.objects.bulk_create(snapshots, batch_size=BATCH_SIZE)
+    BenchmarkCandle.objects.bulk_create(candles, batch_size=BATCH_SIZE)
+
+    groups = [stock_rows[i:i + TARGET_GROUP_SIZE] for i in range(0, len(stock_rows), TARGET_GROUP_SIZE)]
+    weight = (Decimal('0.9') / len(groups)).quantize(Decimal('0.0001'), rounding=ROUND_DOWN)
+    AllocationTarget.objects.bulk_create([
+        AllocationTarget(name=f"T{g:04d}", weight=weight) for g in range(len(groups))
+    ], batch_size=BATCH_SIZE)
+    target_ids = AllocationTarget.objects.order_by('name').values_list('id', flat=True)
+    AllocationTarget.stocks.through.objects.bulk_create([
+        AllocationTarget.stocks.through(allocationtarget_id=target_id, stock_id=stock_id)
+        for target_id, group in zip(target_ids, groups) for stock_id, _ in group
+    ], batch_size=BATCH_SIZE)
+
+    ledger.rebuild_totals()
+    return {
+        'stocks': Stock.objects.count(), 'options': Option.objects.count(),
+        'transactions': transactions, 'holdings': len(positions), 'snapshots': len(snapshots),
+    }
+
+
+@contextmanager
+def stub_providers(seed: int = 0):
+    """
+    Replaces every outside dependency the timed code reaches for: quotes and
+    option chains come from a seeded random walk, broadcasts are dropped, and
+    Celery .delay() calls run inline so a manager task is timed together with
+    the work it dispatches. Option chains are indexed up front so building a
+    fake chain costs no queries inside a timed run.
+    """
+    rng = random.Random(seed)
+    chains = {}
+    for symbol, expiration, strike, option_type in Option.objects.values_list(
+        'underlying_stock__symbol', 'expiration_date', 'strike_price', 'option_type'
+    ).iterator(chunk_size=BATCH_SIZE):
+        chains.setdefault(symbol, {}).setdefault(expiration, []).append((float(strike), option_type))
+
+    def quote(symbol, max_age=None):
+        price = round(rng.uniform(5, 500), 4)
+        return {'price': price, 'previous_close': round(price * rng.uniform(0.97, 1.03), 4)}
+
+    def option_chain(symbol, expirations=None, strikes=None):
+        return {'lastTradePrice': round(rng.uniform(5, 500), 4), 'data': [
+            {
+                'expirationDate': expiration.isoformat(),
+                'options': {
+                    side: [{'strike': strike, 'lastPrice': round(rng.uniform(0.05, 30), 4)}
+                           for strike, option_type in contracts if option_type == side[0]]
+                    for side in ('CALL', 'PUT')
+                },
+            }
+            for expiration, contracts in chains.get(symbol, {}).items()
+        ]}
+
+    def inline(task):
+        return lambda *args, **kwargs: task(*args, **kwargs)
+
+    with ExitStack() as stack:
+        stack.enter_context(mock.patch.object(tasks, 'get_quote', side_effect=quote))
+        stack.enter_context(mock.patch.object(tasks, 'fetch_option_chain_from_finnhub_requests', side_effect=option_chain))
+        stack.enter_context(mock.patch.object(tasks, 'store_quote'))
+        stack.enter_context(mock.patch.object(tasks, 'queue_price_update', return_value=False))
+        stack.enter_context(mock.patch.object(tasks.update_stock_price, 'delay', side_effect=inline(tasks.update_stock_price)))
+        stack.enter_context(mock.patch.object(
+            tasks.update_option_prices_for_stock, 'delay', side_effect=inline(tasks.update_option_prices_for_stock)
+        ))
+        stack.enter_context(mock.patch.object(tasks.replay_transaction_log, 'delay'))
+        yield
+
+
+def option_chain_payload(expirations: int = 20, strikes: int = 200, seed: int = 0) -> bytes:
+    """
+    A Finnhub /stock/option-chain body of realistic shape and size (every
+    contract carries the provider's full field set), for timing the parser.
+    """
+    rng = random.Random(seed)
+    first = date.today()
+
+    def contract(expiration, strike, side):
+        fields = {
+            'contractName': f"SYN{expiration:%y%m%d}{side[0]}{int(strike * 1000):08d}", 'contractSize': 'REGULAR',
+            'contractPeriod': 'MONTHLY', 'currency': 'USD', 'type': side.lower(), 'inTheMoney': 'FALSE',
+            'lastTradeDateTime': f"{first} 15:59:59", 'expirationDate': expiration.isoformat(), 'strike': strike,
+            'lastPrice': round(rng.uniform(0.05, 30), 2), 'bid': 0.0, 'ask': 0.0, 'change': 0.0, 'changePercent': 0.0,
+            'volume': rng.randint(0, 5000), 'openInterest': rng.randint(0, 50000),
+        }
+        fields.update({greek: round(rng.uniform(-1, 1), 4) for greek in (
+            'impliedVolatility', 'delta', 'gamma', 'theta', 'vega', 'rho', 'theoretical', 'intrinsicValue', 'timeValue',
+        )})
+        return fields
+
+    data = []
+    for i in range(expirations):
+        expiration = first + timedelta(days=7 * (i + 1))
+        data.append({
+            'expirationDate': expiration.isoformat(), 'impliedVolatility': 30.0, 'putVolume': 0, 'callVolume': 0,
+            'putCallRatio': 0, 'putOpenInterest': 0, 'callOpenInterest': 0, 'putCallOpenInterestRatio': 0,
+            'optionsCount': 2 * strikes,
+            'options': {
+                side: [contract(expiration, 50 + 2.5 * k, side) for k in range(strikes)] for side in ('CALL', 'PUT')
+            },
+        })
+    return json.dumps({
+        'code': 'SYN', 'exchange': 'US', 'lastTradeDate': first.isoformat(), 'lastTradePrice': 123.45, 'data': data,
+    }).encode()
+
+
+@dataclass
+class Case:
+    name: str
+    func: Callable[[], object]
+    repeat: Optional[int] = None
+
+
+def run_cases(cases, repeat: int = 3, log: Callable[[str], None] = print) -> list:
+    """
+    Runs each case `repeat` times (or its own repeat count) and returns one
+    result dict per case with wall-clock statistics in seconds and the query
+    count of the last run.
+    """
+    results = []
+    for case in cases:
+        timings, queries = [], 0
+        for _ in range(case.repeat or repeat):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                case.func()
+                timings.append(time.perf_counter() - started)
+            queries = len(captured)
+        result = {
+            'name': case.name,
+            'runs': len(timings),
+            'min': min(timings),
+            'median': statistics.median(timings),
+            'mean': statistics.fmean(timings),
+            'max': max(timings),
+            'queries': queries,
+        }
+        log(f"{case.name:<40} median {result['median'] * 1000:10.1f} ms  min {result['min'] * 1000:10.1f} ms  {queries:>7} queries")
+        results.append(result)
+    return results
+
+
+def compare(baseline: dict, current: dict) -> list:
+    """Pairs up cases by name and returns (name, baseline median, current median, ratio) rows."""
+    previous = {result['name']: result for result in baseline.get('results', [])}
+    rows = []
+    for result in current['results']:
+        before = previous.get(result['name'])
+        if before:
+            ratio = result['median'] / before['median'] if before['median'] else float('inf')
+            rows.append((result['name'], before['median'], result['median'], ratio))
+    return rows
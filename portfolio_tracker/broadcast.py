@@ -0,0 +1,97 @@
+# portfolio_tracker/broadcast.py
+import json
+import re
+import zlib
+from collections import defaultdict
+from typing import Iterable, List, Set
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from django.contrib.contenttypes.models import ContentType
+
+from .metrics import BROADCAST_FLUSH_DURATION, BROADCAST_GROUP_SENDS, BROADCAST_SYMBOLS
+from .models import Stock, Option, Holding
+from .redis_client import get_redis_client
+
+PENDING_KEY = "price_broadcast:pending"
+WINDOW_KEY = "price_broadcast:window"
+
+
+def shard_for_symbol(symbol: str) -> int:
+    """Stable across processes, unlike hash()."""
+    return zlib.crc32(symbol.encode()) % settings.PRICE_BROADCAST_SHARDS
+
+
+def shard_group_name(shard: int) -> str:
+    return f"prices.shard.{shard}"
+
+
+def normalize_symbols(symbols: Iterable) -> Set[str]:
+    """Upper-cases client-supplied symbols and drops anything that is not a plausible ticker."""
+    return {str(s).strip().upper() for s in symbols if re.fullmatch(r"[A-Za-z0-9.\-]{1,10}", str(s).strip())}
+
+
+def held_symbols() -> Set[str]:
+    """Symbols of held stocks plus the underlyings of held options."""
+    content_types = ContentType.objects.get_for_models(Stock, Option)
+    held = Holding.objects.values_list('object_id', flat=True)
+    stock_ids = held.filter(content_type=content_types[Stock])
+    option_ids = held.filter(content_type=content_types[Option])
+    return set(
+        Stock.objects.filter(id__in=stock_ids).values_list('symbol', flat=True)
+    ) | set(
+        Option.objects.filter(id__in=option_ids).values_list('underlying_stock__symbol', flat=True)
+    )
+
+
+def queue_price_update(symbol: str, price: float) -> bool:
+    """
+    Records the latest price for `symbol` in the pending batch; a later update
+    for the same symbol in the same window simply overwrites it.
+
+    Returns True when this update opened a new window, in which case the
+    caller must schedule flush_price_updates() PRICE_BROADCAST_WINDOW seconds out.
+    """
+    pipe = get_redis_client().pipeline()
+    pipe.hset(PENDING_KEY, symbol, json.dumps(price))
+    pipe.set(WINDOW_KEY, 1, nx=True, px=int(settings.PRICE_BROADCAST_WINDOW * 1000))
+    _, opened = pipe.execute()
+    return bool(opened)
+
+
+def flush_price_updates() -> List[dict]:
+    """
+    Takes every pending price atomically and publishes them as "price.batch"
+    messages, one per shard group that has changes. Each consumer forwards
+    only the symbols it is subscribed to. Returns the published batch.
+    """
+    with BROADCAST_FLUSH_DURATION.time():
+        batch, groups = _publish_pending()
+    if batch:
+        BROADCAST_SYMBOLS.inc(len(batch))
+        BROADCAST_GROUP_SENDS.inc(groups)
+    return batch
+
+
+def _publish_pending():
+    client = get_redis_client()
+    # Close the window first so any update racing with this flush schedules its own.
+    client.delete(WINDOW_KEY)
+    pipe = client.pipeline()
+    pipe.hgetall(PENDING_KEY)
+    pipe.delete(PENDING_KEY)
+    pending, _ = pipe.execute()
+    if not pending:
+        return [], 0
+
+    batch = [{"symbol": symbol.decode(), "price": json.loads(price)} for symbol, price in pending.items()]
+    by_shard = defaultdict(list)
+    for item in batch:
+        by_shard[shard_for_symbol(item["symbol"])].append(item)
+
+    group_send = async_to_sync(get_channel_layer().group_send)
+    for shard, items in by_shard.items():
+        group_send(shard_group_name(shard), {"type": "price.batch", "data": items})
+    return batch, len(by_shard)
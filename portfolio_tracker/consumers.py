@@ -1,32 +1,139 @@
 # portfolio_tracker/consumers.py
-import json
+import asyncio
+import logging
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.conf import settings
+from redis import RedisError
+
+from .broadcast import held_symbols, normalize_symbols, shard_for_symbol, shard_group_name
+from .metrics import WEBSOCKET_CLIENTS
+from .polling import publish_subscribers, track_subscribers
+
+logger = logging.getLogger(__name__)
+
+# Clients connected to this process, and the task that keeps its presence keys alive while there are any
+_clients = 0
+_heartbeat = None
+
+
+def _publish_presence() -> None:
+    publish_subscribers()
+    WEBSOCKET_CLIENTS.set(_clients, ttl=settings.WEBSOCKET_PRESENCE_TTL)
+
+
+async def _keep_presence_alive():
+    # Refreshes this process's subscriber counts and client gauge well inside their TTL.
+    # If the process dies, both expire instead of counting its clients forever.
+    while _clients:
+        await asyncio.sleep(settings.WEBSOCKET_PRESENCE_TTL / 3)
+        try:
+            await sync_to_async(_publish_presence)()
+        except RedisError as e:
+            logger.warning("Could not refresh WebSocket presence: %s", e)
+
 
 class PriceUpdateConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Streams "price.batch" frames for the symbols this client watches.
+
+    On connect the client is subscribed to the symbols it holds. It can then send
+    {"action": "subscribe" | "unsubscribe", "symbols": [...]} to change the set;
+    every change is answered with {"type": "subscriptions", "data": [...]}.
+    A subscribe that would take the client past WEBSOCKET_MAX_SYMBOLS is
+    refused with an error frame and changes nothing.
+    """
+
     async def connect(self):
         # A user connects to the WebSocket
-        await self.channel_layer.group_add(
-            "price_updates", self.channel_name
-        )
+        self.symbols = set()
+        self.shards = Counter()
+        self.counted = False
         await self.accept()
-        print(f"WebSocket client connected: {self.channel_name}")
+        await self.subscribe(await database_sync_to_async(held_symbols)())
+        await self.count_client(1)
+        self.counted = True
+        global _heartbeat
+        if _heartbeat is None or _heartbeat.done():
+            _heartbeat = asyncio.ensure_future(_keep_presence_alive())
+        logger.debug("WebSocket client connected", extra={"channel": self.channel_name})
 
     async def disconnect(self, close_code):
         # A user disconnects
-        await self.channel_layer.group_discard(
-            "price_updates", self.channel_name
-        )
-        print(f"WebSocket client disconnected: {self.channel_name}")
-
-    # This method is a handler for messages sent to the 'price_updates' group
-    async def price_update(self, event):
-        # The 'event' dictionary contains the data sent from our Celery task
-        message_data = event["data"]
-
-        # Send the data down to the connected frontend client
-        await self.send_json(
-            {
-                "type": "price.update",
-                "data": message_data,
-            }
-        )
\ No newline at end of file
+        await self.track(getattr(self, 'symbols', ()), -1)
+        for shard in self.shards:
+            await self.channel_layer.group_discard(shard_group_name(shard), self.channel_name)
+        if getattr(self, 'counted', False):
+            await self.count_client(-1)
+        logger.debug("WebSocket client disconnected", extra={"channel": self.channel_name})
+
+    async def track(self, symbols, delta):
+        try:
+            await sync_to_async(track_subscribers)(symbols, delta)
+        except RedisError as e:
+            # This process's counts are already updated; the heartbeat publishes them once Redis is back.
+            logger.warning("Could not publish WebSocket subscriber counts: %s", e)
+
+    async def count_client(self, delta):
+        global _clients
+        _clients += delta
+        await sync_to_async(WEBSOCKET_CLIENTS.set)(_clients, ttl=settings.WEBSOCKET_PRESENCE_TTL)
+
+    async def receive_json(self, content, **kwargs):
+        action = content.get("action") if isinstance(content, dict) else None
+        symbols = content.get("symbols") if isinstance(content, dict) else None
+        if action not in ("subscribe", "unsubscribe") or not isinstance(symbols, list):
+            await self.send_json({"type": "error", "data": "Expected {action: subscribe|unsubscribe, symbols: [...]}."})
+            return
+        if action == "subscribe":
+            await self.subscribe(normalize_symbols(symbols))
+        else:
+            await self.unsubscribe(normalize_symbols(symbols))
+
+    async def subscribe(self, symbols):
+        added = set(symbols) - self.symbols
+        if len(self.symbols) + len(added) > settings.WEBSOCKET_MAX_SYMBOLS:
+            await self.send_json({
+                "type": "error",
+                "data": f"At most {settings.WEBSOCKET_MAX_SYMBOLS} symbols per connection; unsubscribe some first.",
+            })
+            return
+        # Watched symbols are polled more often (see portfolio_tracker/polling.py)
+        await self.track(added, 1)
+        for symbol in added:
+            shard = shard_for_symbol(symbol)
+            if not self.shards[shard]:
+                await self.channel_layer.group_add(shard_group_name(shard), self.channel_name)
+            self.shards[shard] += 1
+            self.symbols.add(symbol)
+        await self.send_subscriptions()
+
+    async def unsubscribe(self, symbols):
+        removed = set(symbols) & self.symbols
+        await self.track(removed, -1)
+        for symbol in removed:
+            shard = shard_for_symbol(symbol)
+            self.shards[shard] -= 1
+            if not self.shards[shard]:
+                del self.shards[shard]
+                await self.channel_layer.group_discard(shard_group_name(shard), self.channel_name)
+            self.symbols.discard(symbol)
+        await self.send_subscriptions()
+
+    async def send_subscriptions(self):
+        await self.send_json({"type": "subscriptions", "data": sorted(self.symbols)})
+
+    # Handler for batched updates sent to a shard group (see portfolio_tracker/broadcast.py).
+    # A shard carries other symbols too, so forward only the ones this client watches.
+    async def price_batch(self, event):
+        data = [item for item in event["data"] if item["symbol"] in self.symbols]
+        if data:
+            await self.send_json(
+                {
+                    "type": "price.batch",
+                    "data": data,
+                }
+            )
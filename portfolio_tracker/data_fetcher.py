@@ -1,31 +1,73 @@
 # portfolio_tracker/data_fetcher.py
-import datetime
-import time
-import finnhub
+import logging
+
 from django.conf import settings
-from typing import List, Union
+from redis import RedisError
+from typing import List, Optional, Set, Union
+
+from .http_client import get_json, stream_json
+from .metrics import PROVIDER_QUOTA_EXHAUSTED
+from .rate_limiter import RateLimitTimeout, finnhub_rate_limiter
 
-import requests
+logger = logging.getLogger(__name__)
 
-finnhub_client = None
-if hasattr(settings, 'FINNHUB_API_TOKEN'):
-    finnhub_client = finnhub.Client(api_key=settings.FINNHUB_API_TOKEN)
-else:
+if not getattr(settings, 'FINNHUB_API_TOKEN', None):
     # 拋出一個警告，這樣在啟動時就能發現問題
-    print("警告：FINNHUB_API_TOKEN 未在 settings.py 中設定。API 請求將會失敗。")
+    logger.warning("FINNHUB_API_TOKEN 未在 settings.py 中設定。API 請求將會失敗。")
 
 # -----------------------------------------------------------
 
+def _finnhub_get(path: str, params: dict) -> dict:
+    """
+    GETs a Finnhub endpoint through the pooled HTTP client. The token goes in
+    a header so it never shows up in logged URLs.
+    """
+    return get_json(
+        f"{settings.FINNHUB_BASE_URL}{path}",
+        params=params,
+        headers={"X-Finnhub-Token": settings.FINNHUB_API_TOKEN},
+        provider="finnhub",
+    )
+
+
+def _finnhub_stream(path: str, params: dict):
+    """Like _finnhub_get, but yields a JsonStreamReader over the response body."""
+    return stream_json(
+        f"{settings.FINNHUB_BASE_URL}{path}",
+        params=params,
+        headers={"X-Finnhub-Token": settings.FINNHUB_API_TOKEN},
+        provider="finnhub",
+    )
+
+
+def _take_finnhub_token(symbol: str) -> bool:
+    """
+    Takes a token from the shared Finnhub rate limiter. RateLimitTimeout is
+    left to propagate so tasks can re-queue; if Redis itself is unreachable
+    the call is skipped (False) rather than made unaccounted.
+    """
+    try:
+        finnhub_rate_limiter.acquire(timeout=settings.FINNHUB_RATE_LIMIT_MAX_WAIT)
+    except RedisError:
+        logger.exception("無法從 Redis 取得 Finnhub 配額", extra={"symbol": symbol})
+        return False
+    return True
+
+
 def fetch_stock_data_from_finnhub(symbol: str) -> Union[dict, None]:
     """
-    使用 finnhub-python 官方函式庫獲取最新報價和昨日收盤價。
+    從 Finnhub /quote 獲取最新報價和昨日收盤價。
+    Takes a token from the shared Finnhub rate limiter first and raises
+    RateLimitTimeout if none frees up within FINNHUB_RATE_LIMIT_MAX_WAIT, or
+    if Finnhub answers 429 anyway. Returns None if the limiter's Redis is unavailable.
     """
-    if not finnhub_client:
+    if not getattr(settings, 'FINNHUB_API_TOKEN', None):
         return None
 
+    if not _take_finnhub_token(symbol):
+        return None
     try:
-        # 函式庫的使用方式，非常直觀！
-        quote = finnhub_client.quote(symbol)
+        quote = _finnhub_get("/quote", {"symbol": symbol})
         
         # 'c' = current price (當前價格)
         # 'pc' = previous close price (昨日收盤價)
@@ -39,69 +81,115 @@ def fetch_stock_data_from_finnhub(symbol: str) -> Union[dict, None]:
         if current_price is not None and prev_close is not None:
             return {"price": current_price, "previous_close": prev_close}
         else:
-            print(f"從 Finnhub 獲取 {symbol} 數據時，數據不完整。 回應: {quote}")
+            logger.warning("從 Finnhub 獲取數據時，數據不完整。", extra={"symbol": symbol, "response": quote})
             return None
 
-    except finnhub.FinnhubAPIException as e:
-        print(f"Finnhub API 錯誤 (查詢 {symbol}): {e}")
-        return None
-    except Exception as e:
-        print(f"獲取 {symbol} 數據時發生未知錯誤: {e}")
+    except RateLimitTimeout:
+        # Finnhub answered 429; the task re-queues and retries through the rate limiter.
+        raise
+    except Exception:
+        logger.exception("獲取報價時發生未知錯誤", extra={"symbol": symbol})
         return None
     
     
 
-def fetch_option_chain_from_finnhub_requests(underlying_symbol: str) -> Union[dict, None]:
+def _filter_expiration(expiration: dict, strikes: Optional[Set[float]]) -> dict:
+    """Drops the contracts of `expiration` whose strike we do not hold."""
+    if strikes is None:
+        return expiration
+    options = expiration.get('options') or {}
+    return {
+        **expiration,
+        'options': {
+            side: [contract for contract in contracts if contract.get('strike') in strikes]
+            for side, contracts in options.items()
+        },
+    }
+
+
+def _read_option_chain(reader, expirations: Optional[Set[str]], strikes: Optional[Set[float]]) -> dict:
+    """
+    Builds the chain dict from a JsonStreamReader one expiration at a time,
+    keeping only the expirations in `expirations` and the strikes in
+    `strikes` (None keeps everything), so the full chain is never in memory.
+    """
+    chain = {'data': []}
+    for key in reader.members():
+        if key != 'data' or reader.peek() != '[':
+            chain[key] = reader.value()
+            continue
+        for expiration in reader.items():
+            if expirations is None or expiration.get('expirationDate') in expirations:
+                chain['data'].append(_filter_expiration(expiration, strikes))
+    return chain
+
+
+def fetch_option_chain_from_finnhub_requests(underlying_symbol: str, expirations: Optional[Set[str]] = None,
+                                             strikes: Optional[Set[float]] = None) -> Union[dict, None]:
     """
-    使用 requests 手動獲取指定股票的完整期權鏈。
+    使用共用的 HTTP client 獲取指定股票的期權鏈。
+    The response is parsed as it streams in and only the expirations
+    (ISO dates) in `expirations` and the strikes in `strikes` are kept; both
+    default to everything. Besides 'data', the returned dict carries the
+    payload's top-level fields, including the underlying's lastTradePrice.
+    Raises RateLimitTimeout like fetch_stock_data_from_finnhub.
     """
-    if not hasattr(settings, 'FINNHUB_API_TOKEN'):
-        print("錯誤：請在 settings.py 中設定 FINNHUB_API_TOKEN")
+    if not getattr(settings, 'FINNHUB_API_TOKEN', None):
+        logger.error("請在 settings.py 中設定 FINNHUB_API_TOKEN")
         return None
 
-    api_token = settings.FINNHUB_API_TOKEN
-    url = "https://finnhub.io/api/v1/stock/option-chain"
-    params = {
-        "symbol": underlying_symbol,
-        "token": api_token
-    }
-
+    if not _take_finnhub_token(underlying_symbol):
+        return None
     try:
-        response = requests.get(url, params=params)
-        response.raise_for_status() # 檢查請求是否成功 (狀態碼 2xx)
-        chain = response.json()
-        
-        if chain and chain.get('data'):
+        with _finnhub_stream("/stock/option-chain", {"symbol": underlying_symbol}) as reader:
+            chain = _read_option_chain(reader, expirations, strikes)
+
+        if chain.get('data'):
+            return chain
+        elif expirations is not None and chain.get('lastTradePrice'):
+            # None of the held expirations are listed any more; the underlying price is still usable.
+            logger.info("期權鏈中沒有持有的到期日。", extra={"symbol": underlying_symbol})
             return chain
         else:
-            print(f"從 Finnhub 獲取 {underlying_symbol} 期權鏈時，回傳數據為空。")
+            logger.warning("從 Finnhub 獲取期權鏈時，回傳數據為空。", extra={"symbol": underlying_symbol})
             return None
             
-    except Exception as e:
-        print(f"使用 requests 獲取 {underlying_symbol} 期權鏈時發生未知錯誤: {e}")
+    except RateLimitTimeout:
+        raise
+    except Exception:
+        logger.exception("獲取期權鏈時發生未知錯誤", extra={"symbol": underlying_symbol})
         return None
 
-def fetch_benchmark_candles_from_alpha_vantage(symbol: str) -> List[dict]:
-    """ Fetches historical daily stock prices from Alpha Vantage. """
+def fetch_benchmark_candles_from_alpha_vantage(symbol: str, outputsize: str = "compact") -> List[dict]:
+    """
+    Fetches historical daily stock prices from Alpha Vantage.
+    "compact" returns the latest 100 trading days, "full" the whole history.
+    """
     api_key = getattr(settings, 'ALPHA_VANTAGE_API_KEY', None)
     if not api_key:
-        print("WARNING: ALPHA_VANTAGE_API_KEY is not set.")
+        logger.warning("ALPHA_VANTAGE_API_KEY is not set.")
         return []
 
-    url = f"https://www.alphavantage.co/query?function=TIME_SERIES_DAILY&symbol={symbol}&outputsize=compact&apikey={api_key}"
+    params = {
+        "function": "TIME_SERIES_DAILY",
+        "symbol": symbol,
+        "outputsize": outputsize,
+        "apikey": api_key,
+    }
 
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
+        data = get_json(f"{settings.ALPHA_VANTAGE_BASE_URL}/query", params=params, provider="alpha_vantage")
 
         if "Error Message" in data or not data.get("Time Series (Daily)"):
-            print(f"Alpha Vantage API Error or unexpected response: {data}")
+            # Alpha Vantage answers 200 with a "Note"/"Information" message once the quota is used up.
+            if "Note" in data or "Information" in data:
+                PROVIDER_QUOTA_EXHAUSTED.inc(provider="alpha_vantage", reason="quota_message")
+            logger.warning("Alpha Vantage API error or unexpected response", extra={"symbol": symbol, "response": data})
             return []
 
         time_series = data["Time Series (Daily)"]
         candles = [{'date': date_str, 'price': float(values['4. close'])} for date_str, values in time_series.items()]
         return candles[::-1] # Reverse to be in chronological order
-    except Exception as e:
-        print(f"An error occurred fetching from Alpha Vantage: {e}")
-        return []
\ No newline at end of file
+    except Exception:
+        logger.exception("An error occurred fetching from Alpha Vantage", extra={"symbol": symbol})
+        return []
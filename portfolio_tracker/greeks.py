@@ -0,0 +1,263 @@
+# portfolio_tracker/greeks.py
+"""
+Black-Scholes implied volatility and Greeks for every held option, as arrays.
+
+All contracts go through the model together: one NumPy pass prices them, a
+bracketed Newton iteration solves every implied volatility at once, and one
+more pass produces the Greeks. Inputs are the contract's last_price and the
+underlying's Stock.last_price; the risk-free rate and dividend yield are
+flat (GREEKS_RISK_FREE_RATE, GREEKS_DIVIDEND_YIELD).
+
+Contracts whose price is outside the no-arbitrage bounds, that have no price,
+or that are past expiry get NaN, which the totals skip.
+"""
+import hashlib
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
+
+from .market_calendar import EASTERN, REGULAR_CLOSE
+from .models import Option, Holding
+from .valuation import OPTION_CONTRACT_MULTIPLIER, to_array, to_list
+
+SECONDS_PER_YEAR = 365 * 24 * 3600
+MIN_VOLATILITY, MAX_VOLATILITY = 1e-4, 5.0
+PRICE_TOLERANCE = 1e-8
+VOLATILITY_TOLERANCE = 1e-7
+MAX_ITERATIONS = 100
+
+# (inputs digest, result) of the last computation in this process, shared by its threads
+_last_result: Tuple[Optional[str], Optional[dict]] = (None, None)
+_last_result_lock = threading.Lock()
+
+
+def _erfc(x: np.ndarray) -> np.ndarray:
+    # Chebyshev fit from Numerical Recipes, fractional error below 1.2e-7 everywhere
+    z = np.abs(x)
+    t = 1.0 / (1.0 + 0.5 * z)
+    r = t * np.exp(-z * z - 1.26551223 + t * (1.00002368 + t * (0.37409196 + t * (0.09678418 + t * (
+        -0.18628806 + t * (0.27886807 + t * (-1.13520398 + t * (1.48851587 + t * (-0.82215223 + t * 0.17087277)))))))))
+    return np.where(x >= 0, r, 2.0 - r)
+
+
+def norm_cdf(x: np.ndarray) -> np.ndarray:
+    return 0.5 * _erfc(-x / np.sqrt(2.0))
+
+
+def norm_pdf(x: np.ndarray) -> np.ndarray:
+    return np.exp(-0.5 * x * x) / np.sqrt(2.0 * np.pi)
+
+
+def _d1_d2(spot, strike, years, rate, dividend, sigma):
+    sqrt_t = np.sqrt(years)
+    d1 = (np.log(spot / strike) + (rate - dividend + 0.5 * sigma * sigma) * years) / (sigma * sqrt_t)
+    return d1, d1 - sigma * sqrt_t
+
+
+def bs_price(spot, strike, years, rate, dividend, sigma, is_call) -> np.ndarray:
+    """Black-Scholes-Merton price per share; `is_call` is a boolean array."""
+    d1, d2 = _d1_d2(spot, strike, years, rate, dividend, sigma)
+    carry, discount = spot * np.exp(-dividend * years), strike * np.exp(-rate * years)
+    call = carry * norm_cdf(d1) - discount * norm_cdf(d2)
+    put = discount * norm_cdf(-d2) - carry * norm_cdf(-d1)
+    return np.where(is_call, call, put)
+
+
+def _vega(spot, years, dividend, d1) -> np.ndarray:
+    return spot * np.exp(-dividend * years) * norm_pdf(d1) * np.sqrt(years)
+
+
+def implied_volatility(price, spot, strike, years, rate, dividend, is_call) -> np.ndarray:
+    """
+    Solves every contract's volatility at once. Each step is a Newton step
+    where it lands inside the contract's current bracket and a bisection
+    where it does not, so the iteration cannot diverge on deep in- or
+    out-of-the-money contracts where vega vanishes. A contract is done when
+    its price error or its bracket is within tolerance. NaN where the price is
+    missing or outside the no-arbitrage bounds, or the solve did not converge.
+    """
+    carry, discount = spot * np.exp(-dividend * years), strike * np.exp(-rate * years)
+    lower = np.where(is_call, np.maximum(carry - discount, 0.0), np.maximum(discount - carry, 0.0))
+    upper = np.where(is_call, carry, discount)
+    with np.errstate(invalid='ignore'):
+        solvable = np.isfinite(price) & np.isfinite(spot) & np.isfinite(years) & (price > lower) & (price < upper)
+
+    n = int(solvable.sum())
+    sigma = np.full(len(price), np.nan)
+    if not n:
+        return sigma
+    p, s, k, t, call = price[solvable], spot[solvable], strike[solvable], years[solvable], is_call[solvable]
+    lo, hi = np.full(n, MIN_VOLATILITY), np.full(n, MAX_VOLATILITY)
+    # Brenner-Subrahmanyam's at-the-money approximation as the starting point
+    x = np.clip(np.sqrt(2 * np.pi / t) * p / s, MIN_VOLATILITY * 2, MAX_VOLATILITY / 2)
+    done = np.zeros(n, dtype=bool)
+    for _ in range(MAX_ITERATIONS):
+        d1, _ = _d1_d2(s, k, t, rate, dividend, x)
+        error = bs_price(s, k, t, rate, dividend, x, call) - p
+        done |= np.abs(error) < PRICE_TOLERANCE * np.maximum(p, 1.0)
+        if done.all():
+            break
+        # Price rises with volatility, so the sign of the error says which side of the root x is on.
+        hi = np.where(error > 0, x, hi)
+        lo = np.where(error < 0, x, lo)
+        # Where vega is negligible the price pins the volatility down no further than this.
+        done |= hi - lo < VOLATILITY_TOLERANCE
+        vega = _vega(s, t, dividend, d1)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            newton = x - error / vega
+        step = np.where((newton > lo) & (newton < hi), newton, 0.5 * (lo + hi))
+        x = np.where(done, x, step)
+    sigma[solvable] = np.where(done, x, np.nan)
+    return sigma
+
+
+def greeks(spot, strike, years, rate, dividend, sigma, is_call) -> Dict[str, np.ndarray]:
+    """
+    Per-share Greeks in one pass: delta, gamma (per $1), vega (per volatility
+    point), theta (per calendar day) and rho (per rate point).
+    """
+    d1, d2 = _d1_d2(spot, strike, years, rate, dividend, sigma)
+    carry_factor, discount_factor = np.exp(-dividend * years), np.exp(-rate * years)
+    pdf, sqrt_t = norm_pdf(d1), np.sqrt(years)
+    cdf_d1, cdf_d2 = norm_cdf(d1), norm_cdf(d2)
+
+    decay = -spot * carry_factor * pdf * sigma / (2 * sqrt_t)
+    call_theta = decay - rate * strike * discount_factor * cdf_d2 + dividend * spot * carry_factor * cdf_d1
+    put_theta = decay + rate * strike * discount_factor * (1 - cdf_d2) - dividend * spot * carry_factor * (1 - cdf_d1)
+    return {
+        'delta': carry_factor * np.where(is_call, cdf_d1, cdf_d1 - 1),
+        'gamma': carry_factor * pdf / (spot * sigma * sqrt_t),
+        'vega': spot * carry_factor * pdf * sqrt_t / 100,
+        'theta': np.where(is_call, call_theta, put_theta) / 365,
+        'rho': np.where(is_call, strike * years * discount_factor * cdf_d2,
+                        -strike * years * discount_factor * (1 - cdf_d2)) / 100,
+    }
+
+
+def _years_to_expiry(expirations, now: datetime) -> np.ndarray:
+    """Years until each expiration's 4 p.m. New York close; NaN once it has passed."""
+    seconds = np.array([
+        (datetime.combine(expiration, REGULAR_CLOSE, tzinfo=EASTERN) - now).total_seconds()
+        for expiration in expirations
+    ], dtype=float)
+    return np.where(seconds > 0, seconds / SECONDS_PER_YEAR, np.nan)
+
+
+def _held_options() -> Tuple[List[tuple], np.ndarray]:
+    """
+    Every held option contract with its underlying's price, and the net
+    quantity held of each. Two queries: the option holdings and the contracts.
+    """
+    option_ct = ContentType.objects.get_for_model(Option).id
+    held = {}
+    for object_id, quantity in Holding.objects.filter(content_type_id=option_ct).values_list('object_id', 'quantity'):
+        held[object_id] = held.get(object_id, 0) + quantity
+    contracts = list(Option.objects.filter(id__in=list(held)).order_by('id').values_list(
+        'id', 'underlying_stock__symbol', 'expiration_date', 'strike_price', 'option_type',
+        'last_price', 'underlying_stock__last_price', 'underlying_stock_id',
+    )) if held else []
+    return contracts, to_array(held[row[0]] for row in contracts)
+
+
+def _digest(contracts: List[tuple], quantity: np.ndarray, bucket: int) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr(contracts).encode())
+    h.update(quantity.tobytes())
+    h.update(str(bucket).encode())
+    return h.hexdigest()
+
+
+def portfolio_greeks(use_cache: bool = True) -> dict:
+    """
+    Greeks of every held option, per position, per underlying and in total.
+    Dollar figures are for the whole position: delta_dollars is the value of
+    the equivalent stock position (delta x spot x shares covered),
+    gamma_dollars how much delta_dollars moves on a 1% move in the
+    underlying, theta_dollars and vega_dollars the P&L of one calendar day and
+    of one volatility point.
+
+    The result is reused while prices, positions and the GREEKS_CACHE_SECONDS
+    time bucket are unchanged, so only a new price tick pays for the solve;
+    use_cache=False always solves. A reused result is a copy whose as_of is
+    the time of this call; computed_at says when it was solved.
+    """
+    global _last_result
+    contracts, quantity = _held_options()
+    now = timezone.now()
+    key = _digest(contracts, quantity, int(time.time() // settings.GREEKS_CACHE_SECONDS))
+    with _last_result_lock:
+        cached_key, cached = _last_result
+    if use_cache and cached_key == key:
+        return {**cached, 'as_of': now.isoformat()}
+
+    rate, dividend = settings.GREEKS_RISK_FREE_RATE, settings.GREEKS_DIVIDEND_YIELD
+    strike = to_array(row[3] for row in contracts)
+    price = to_array(row[5] for row in contracts)
+    spot = to_array(row[6] for row in contracts)
+    is_call = np.array([row[4] == 'C' for row in contracts], dtype=bool)
+    years = _years_to_expiry([row[2] for row in contracts], now)
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        sigma = implied_volatility(price, spot, strike, years, rate, dividend, is_call)
+        per_share = greeks(spot, strike, years, rate, dividend, sigma, is_call)
+    units = quantity * OPTION_CONTRACT_MULTIPLIER
+    exposure = {
+        'delta_dollars': per_share['delta'] * spot * units,
+        'gamma_dollars': per_share['gamma'] * spot * spot * 0.01 * units,
+        'theta_dollars': per_share['theta'] * units,
+        'vega_dollars': per_share['vega'] * units,
+    }
+
+    columns = {
+        'quantity': quantity, 'last_price': price, 'underlying_price': spot, 'years_to_expiry': years,
+        'implied_volatility': sigma, **per_share, **exposure,
+    }
+    columns = {name: to_list(values) for name, values in columns.items()}
+    positions = [
+        {
+            'option_id': pk,
+            'instrument_name': Option.format_name(symbol, expiration, strike_price, option_type),
+            'underlying_stock': underlying_id,
+            'underlying_symbol': symbol,
+            **{name: values[i] for name, values in columns.items()},
+        }
+        for i, (pk, symbol, expiration, strike_price, option_type, _, _, underlying_id) in enumerate(contracts)
+    ]
+
+    symbols, group = np.unique([row[1] for row in contracts], return_inverse=True) if contracts else ([], [])
+    sums = {
+        name: np.bincount(group, weights=np.nan_to_num(values), minlength=len(symbols)).tolist()
+        for name, values in exposure.items()
+    }
+    underlying_price = dict(zip((row[1] for row in contracts), columns['underlying_price']))
+    by_underlying = [
+        {
+            'underlying_symbol': symbol,
+            'underlying_price': underlying_price[symbol],
+            **{name: values[g] for name, values in sums.items()},
+        }
+        for g, symbol in enumerate(symbols.tolist() if contracts else [])
+    ]
+
+    result = {
+        'as_of': now.isoformat(),
+        'computed_at': now.isoformat(),
+        'risk_free_rate': rate,
+        'dividend_yield': dividend,
+        'positions': positions,
+        'by_underlying': by_underlying,
+        'totals': {
+            'positions': len(contracts),
+            'unsolved': int(np.isnan(sigma).sum()),
+            **{name: float(np.nansum(values)) for name, values in exposure.items()},
+        },
+    }
+    with _last_result_lock:
+        _last_result = (key, result)
+    return {**result}
@@ -0,0 +1,142 @@
+# portfolio_tracker/history.py
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
+
+from .models import Stock, Option, Transaction, PriceBar
+from .valuation import OPTION_CONTRACT_MULTIPLIER
+
+
+def forward_fill(matrix: np.ndarray) -> np.ndarray:
+    """Carries the last non-NaN value of every column down the rows."""
+    rows = np.where(~np.isnan(matrix), np.arange(matrix.shape[0])[:, None], 0)
+    np.maximum.accumulate(rows, axis=0, out=rows)
+    return matrix[rows, np.arange(matrix.shape[1])]
+
+
+def day_bounds(first: date, last: date) -> Tuple[datetime, datetime]:
+    """
+    Aware start of `first` and start of the day after `last`, in the current
+    time zone. Filtering timestamp__gte/__lt on these keeps the PriceBar index
+    usable, where timestamp__date would wrap the column in a cast.
+    """
+    return (
+        timezone.make_aware(datetime.combine(first, time.min)),
+        timezone.make_aware(datetime.combine(last + timedelta(days=1), time.min)),
+    )
+
+
+def traded_stocks_without_daily_bars() -> Dict[int, str]:
+    """{id: symbol} of every stock in the Transaction log that has no daily PriceBar yet."""
+    stock_ct = ContentType.objects.get_for_model(Stock)
+    stock_ids = Transaction.objects.filter(content_type=stock_ct).values('object_id')
+    with_bars = PriceBar.objects.filter(content_type=stock_ct, interval=PriceBar.DAILY).values('object_id')
+    return dict(Stock.objects.filter(id__in=stock_ids).exclude(id__in=with_bars).values_list('id', 'symbol'))
+
+
+def build_value_history(start: Optional[date] = None, end: Optional[date] = None) -> Tuple[List[date], np.ndarray]:
+    """
+    Daily portfolio market values rebuilt from the Transaction log.
+
+    Builds a date x instrument position matrix (cumulative signed fills) and a
+    matching close matrix from the PriceBar history (raw and daily bars),
+    falling back to the instrument's own trade prices where it has none, with
+    prices carried forward over weekends and gaps. The daily values are then
+    one product of the two matrices with the contract multipliers. Runs a
+    constant number of queries for any range and any number of instruments.
+    """
+    content_types = ContentType.objects.get_for_models(Stock, Option)
+    stock_ct, option_ct = content_types[Stock].id, content_types[Option].id
+
+    fills = list(Transaction.objects.order_by('date', 'id').values_list(
+        'content_type_id', 'object_id', 'transaction_type', 'quantity', 'price', 'date'
+    ))
+    if not fills:
+        return [], np.zeros(0)
+
+    first_day = timezone.localtime(fills[0][5]).date()
+    start = start or first_day
+    end = end or timezone.localdate()
+    if end < start:
+        return [], np.zeros(0)
+    history_start = min(start, first_day)
+    day_count = (end - history_start).days + 1
+
+    keys = sorted({(ct, object_id) for ct, object_id, _, _, _, _ in fills})
+    column = {key: j for j, key in enumerate(keys)}
+
+    # Fills on or before `end`, as parallel arrays.
+    day_idx, col_idx, signed_qty, trade_price = [], [], [], []
+    for ct, object_id, transaction_type, quantity, price, when in fills:
+        d = (timezone.localtime(when).date() - history_start).days
+        if d >= day_count:
+            break
+        day_idx.append(d)
+        col_idx.append(column[(ct, object_id)])
+        signed_qty.append(float(quantity) if transaction_type == 'buy' else -float(quantity))
+        trade_price.append(float(price))
+    day_idx, col_idx = np.array(day_idx, dtype=int), np.array(col_idx, dtype=int)
+
+    positions = np.zeros((day_count, len(keys)))
+    np.add.at(positions, (day_idx, col_idx), signed_qty)
+    positions = np.cumsum(positions, axis=0)
+
+    closes = np.full((day_count, len(keys)), np.nan)
+    # Trade prices first; price bars overwrite them where they exist.
+    closes[day_idx, col_idx] = trade_price
+
+    # Stored price bars (raw and rolled-up daily), last bar of each day wins.
+    since, until = day_bounds(history_start, end)
+    bars = PriceBar.objects.filter(
+        content_type_id__in=[stock_ct, option_ct], object_id__in={o for _, o in keys},
+        timestamp__gte=since, timestamp__lt=until,
+    ).order_by('timestamp').values_list('content_type_id', 'object_id', 'timestamp', 'close')
+    for ct, object_id, ts, close in bars.iterator(chunk_size=5000):
+        j = column.get((ct, object_id))
+        if j is not None:
+            closes[(timezone.localtime(ts).date() - history_start).days, j] = close
+
+    closes = np.nan_to_num(forward_fill(closes))
+
+    # Contracts stop counting after expiration instead of keeping their last trade price.
+    expirations = dict(Option.objects.filter(id__in=[o for ct, o in keys if ct == option_ct]).values_list('id', 'expiration_date'))
+    for (ct, object_id), j in column.items():
+        if ct == option_ct and object_id in expirations:
+            positions[max(0, (expirations[object_id] - history_start).days + 1):, j] = 0
+    multipliers = np.array([OPTION_CONTRACT_MULTIPLIER if ct == option_ct else 1 for ct, _ in keys], dtype=float)
+    values = (positions * closes) @ multipliers
+
+    offset = (start - history_start).days
+    dates = [start + timedelta(days=i) for i in range(day_count - offset)]
+    return dates, values[offset:]
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling. Returns the indices of the
+    `threshold` points that best preserve the visual shape of (x, y); the
+    first and last points are always kept.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # Bucket boundaries for the n - 2 interior points.
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    selected = np.empty(threshold, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, stop = edges[i], edges[i + 1]
+        # Average of the next bucket (or the last point) is the third triangle vertex.
+        next_start, next_stop = stop, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[next_start:next_stop].mean(), y[next_start:next_stop].mean()
+        areas = np.abs(
+            (x[a] - avg_x) * (y[start:stop] - y[a]) - (x[a] - x[start:stop]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
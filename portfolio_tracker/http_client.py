@@ -0,0 +1,136 @@
+# portfolio_tracker/http_client.py
+import os
+from contextlib import contextmanager
+from typing import Iterator, Optional
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .json_stream import JsonStreamReader
+from .metrics import PROVIDER_QUOTA_EXHAUSTED, PROVIDER_REQUEST_DURATION, PROVIDER_REQUESTS
+from .rate_limiter import RateLimitTimeout
+
+_session = None
+_session_pid = None
+
+
+class _CappedRetry(Retry):
+    """
+    Honours Retry-After, but never sleeps longer than backoff_max, so a
+    provider cannot park a worker. Never retries 429: every attempt has to go
+    through the caller's rate limiter, so _get raises RateLimitTimeout instead
+    and the task re-queues.
+    """
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        # Retry would otherwise retry any 429 that carries a Retry-After header.
+        return status_code != 429 and super().is_retry(method, status_code, has_retry_after)
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        return None if retry_after is None else min(retry_after, self.backoff_max)
+
+
+def _build_session() -> requests.Session:
+    retry = _CappedRetry(
+        total=settings.HTTP_CLIENT_MAX_RETRIES,
+        backoff_factor=settings.HTTP_CLIENT_BACKOFF_FACTOR,
+        backoff_jitter=settings.HTTP_CLIENT_BACKOFF_JITTER,
+        backoff_max=settings.HTTP_CLIENT_BACKOFF_MAX,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset({'GET'}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=settings.HTTP_CLIENT_POOL_CONNECTIONS,
+        pool_maxsize=settings.HTTP_CLIENT_POOL_MAXSIZE,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+    return session
+
+
+def get_session() -> requests.Session:
+    """
+    Returns this process's pooled keep-alive session. Celery's prefork pool
+    forks after import, so the session is rebuilt whenever the pid changes
+    instead of sharing sockets with the parent.
+    """
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        _session = _build_session()
+        _session_pid = os.getpid()
+    return _session
+
+
+def _get(url: str, params: Optional[dict], headers: Optional[dict], provider: Optional[str],
+         stream: bool = False) -> requests.Response:
+    provider = provider or urlsplit(url).hostname
+    with PROVIDER_REQUEST_DURATION.time(provider=provider, status='error') as labels:
+        try:
+            response = get_session().get(
+                url,
+                params=params,
+                headers=headers,
+                timeout=(settings.HTTP_CLIENT_CONNECT_TIMEOUT, settings.HTTP_CLIENT_READ_TIMEOUT),
+                stream=stream,
+            )
+        except requests.RequestException as e:
+            labels['status'] = type(e).__name__
+            PROVIDER_REQUESTS.inc(provider=provider, status=labels['status'])
+            raise
+        labels['status'] = response.status_code
+    PROVIDER_REQUESTS.inc(provider=provider, status=response.status_code)
+    if response.status_code == 429:
+        PROVIDER_QUOTA_EXHAUSTED.inc(provider=provider, reason='http_429')
+        response.close()
+        raise RateLimitTimeout(provider, _retry_after(response))
+    if not response.ok:
+        response.close()
+    response.raise_for_status()
+    return response
+
+
+def _retry_after(response: requests.Response) -> float:
+    """Seconds the provider asked us to wait, within HTTP_CLIENT_BACKOFF_MAX (1s when unspecified)."""
+    try:
+        seconds = Retry().parse_retry_after(response.headers['Retry-After'])
+    except Exception:
+        seconds = 1.0
+    return min(max(seconds, 0.0), settings.HTTP_CLIENT_BACKOFF_MAX)
+
+
+def get_json(url: str, params: Optional[dict] = None, headers: Optional[dict] = None,
+             provider: Optional[str] = None) -> dict:
+    """
+    GETs `url` through the pooled session with connect/read timeouts, retrying
+    5xx responses with exponential backoff and jitter. Raises RateLimitTimeout
+    on a 429 and requests.RequestException on connection errors and on a final
+    non-2xx status.
+    Latency and outcome are recorded per `provider` (default: the URL's host).
+    """
+    return _get(url, params, headers, provider).json()
+
+
+@contextmanager
+def stream_json(url: str, params: Optional[dict] = None, headers: Optional[dict] = None,
+                provider: Optional[str] = None) -> Iterator[JsonStreamReader]:
+    """
+    Like get_json, but yields a JsonStreamReader over the body as it arrives
+    instead of the decoded document, for payloads too large to build whole.
+    The connection goes back to the pool when the block exits. The recorded
+    latency is time to headers; reading the body is the caller's time.
+    """
+    response = _get(url, params, headers, provider, stream=True)
+    try:
+        chunks = response.iter_content(settings.HTTP_CLIENT_STREAM_CHUNK_SIZE)
+        yield JsonStreamReader(chunks, response.encoding or 'utf-8')
+    finally:
+        response.close()
@@ -0,0 +1,191 @@
+# portfolio_tracker/ingestion.py
+import logging
+from decimal import Decimal
+from functools import partial
+from typing import List
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import ledger
+from .models import Stock, Option, Holding, Transaction, RealizedGain
+from .replay import invalidate_checkpoints
+from .tasks import update_stock_price
+
+logger = logging.getLogger(__name__)
+
+
+class FillError(Exception):
+    """A fill that cannot be applied; nothing from its batch is written."""
+
+    def __init__(self, index: int, message: str):
+        super().__init__(message)
+        self.index = index
+        self.message = message
+
+
+def _queue_price_updates(stock_ids: List[int]) -> None:
+    # Runs after the fills commit, so a broker outage must not turn a booked request into a 500
+    # that clients retry. The next scheduled poll prices these stocks instead.
+    for stock_id in stock_ids:
+        try:
+            update_stock_price.delay(stock_id)
+        except Exception as e:
+            logger.warning("Could not queue a price update", extra={"stock_id": stock_id, "error": str(e)})
+
+
+def is_option_fill(fill: dict) -> bool:
+    return all(fill.get(k) is not None for k in ['strike_price', 'expiration_date', 'option_type'])
+
+
+def _option_key(stock_id, strike_price, expiration_date, option_type):
+    return (stock_id, Decimal(strike_price).quantize(Decimal('0.0001')), expiration_date, option_type.upper())
+
+
+def _resolve_stocks(symbols) -> dict:
+    existing = {stock.symbol: stock for stock in Stock.objects.filter(symbol__in=symbols)}
+    missing = set(symbols) - set(existing)
+    if missing:
+        Stock.objects.bulk_create([Stock(symbol=symbol) for symbol in missing], ignore_conflicts=True)
+        existing.update({stock.symbol: stock for stock in Stock.objects.filter(symbol__in=missing)})
+    return existing
+
+
+def _resolve_options(keys) -> dict:
+    def fetch():
+        options = Option.objects.filter(
+            underlying_stock_id__in={key[0] for key in keys},
+            expiration_date__in={key[2] for key in keys},
+        )
+        return {
+            _option_key(o.underlying_stock_id, o.strike_price, o.expiration_date, o.option_type): o
+            for o in options
+        }
+
+    existing = fetch()
+    missing = set(keys) - set(existing)
+    if missing:
+        Option.objects.bulk_create(
+            [
+                Option(underlying_stock_id=stock_id, strike_price=strike, expiration_date=expiration, option_type=option_type)
+                for stock_id, strike, expiration, option_type in missing
+            ],
+            ignore_conflicts=True,
+        )
+        existing = fetch()
+    return existing
+
+
+@transaction.atomic
+def apply_fills(fills: List[dict]) -> List[Transaction]:
+    """
+    Applies validated TransactionSerializer data in order, as one database
+    transaction: either every fill lands or none does (FillError).
+
+    Instruments are resolved and created in bulk, then the instrument rows and
+    their holdings are locked with SELECT ... FOR UPDATE in primary-key order,
+    so concurrent fills for the same symbol are serialized instead of racing on
+    cost_basis. Holdings, realized gains, transactions and the ledger totals are
+    written with a handful of bulk statements regardless of the batch size.
+    """
+    if not fills:
+        return []
+    # Serializes with other fills and with transaction-log replays.
+    ledger.lock_totals()
+    content_types = ContentType.objects.get_for_models(Stock, Option)
+    stock_ct, option_ct = content_types[Stock], content_types[Option]
+
+    stocks = _resolve_stocks({fill['symbol'].upper() for fill in fills})
+    # New symbols are priced through the shared quote cache once the fills commit.
+    unpriced = [stock.id for stock in stocks.values() if stock.last_price is None]
+    if unpriced:
+        transaction.on_commit(partial(_queue_price_updates, unpriced))
+    option_keys = {
+        _option_key(stocks[fill['symbol'].upper()].id, fill['strike_price'], fill['expiration_date'], fill['option_type'])
+        for fill in fills if is_option_fill(fill)
+    }
+    options = _resolve_options(option_keys) if option_keys else {}
+
+    # Resolve every fill to (content type, instrument, display name).
+    resolved = []
+    for fill in fills:
+        stock = stocks[fill['symbol'].upper()]
+        if is_option_fill(fill):
+            option = options[_option_key(stock.id, fill['strike_price'], fill['expiration_date'], fill['option_type'])]
+            name = Option.format_name(stock.symbol, option.expiration_date, option.strike_price, option.option_type)
+            resolved.append((option_ct, option, name))
+        else:
+            resolved.append((stock_ct, stock, stock.symbol))
+
+    stock_ids = sorted({instrument.id for ct, instrument, _ in resolved if ct == stock_ct})
+    option_ids = sorted({instrument.id for ct, instrument, _ in resolved if ct == option_ct})
+    # The instrument rows are the lock points: they exist even before a first buy creates the holding.
+    list(Stock.objects.select_for_update().filter(id__in=stock_ids).order_by('id').values_list('id', flat=True))
+    list(Option.objects.select_for_update().filter(id__in=option_ids).order_by('id').values_list('id', flat=True))
+    holdings = {
+        (holding.content_type_id, holding.object_id): holding
+        for holding in Holding.objects.select_for_update().filter(
+            Q(content_type=stock_ct, object_id__in=stock_ids) | Q(content_type=option_ct, object_id__in=option_ids)
+        ).order_by('id')
+    }
+
+    now = timezone.now()
+    touched, gains, transactions = set(), [], []
+    buy_cost = sell_proceeds = realized_pnl = Decimal('0')
+    for index, (fill, (ct, instrument, name)) in enumerate(zip(fills, resolved)):
+        key = (ct.id, instrument.id)
+        quantity, price = fill['quantity'], fill['price']
+        holding = holdings.get(key)
+        if quantity <= 0:
+            raise FillError(index, "Quantity must be positive.")
+
+        trade = Transaction(
+            content_type=ct, object_id=instrument.id, transaction_type=fill['transaction_type'],
+            quantity=quantity, price=price, date=fill.get('date') or now,
+        )
+        if fill['transaction_type'] == 'buy':
+            if holding is None:
+                holding = holdings[key] = Holding(content_type=ct, object_id=instrument.id, quantity=0, cost_basis=0)
+            # Rounded per fill as the column stores it, so a batch matches the same fills sent one by one.
+            holding.cost_basis = ledger.average_cost(holding.quantity, holding.cost_basis, quantity, price)
+            holding.quantity += quantity
+            buy_cost += ledger.trade_amount(quantity, price, ct == option_ct)
+
+        elif fill['transaction_type'] == 'sell':
+            if holding is None or holding.quantity <= 0:
+                raise FillError(index, "No holding found to sell.")
+            if quantity > holding.quantity:
+                raise FillError(index, f"Cannot sell more than you own. You have {holding.quantity}.")
+
+            # Rounded like the RealizedGain column, so the ledger total matches the rows.
+            gain_or_loss = ledger.realized_gain(quantity, price, holding.cost_basis)
+            gains.append(RealizedGain(instrument_name=name, realized_pnl=gain_or_loss, date=trade.date, transaction=trade))
+            realized_pnl += gain_or_loss
+            holding.quantity -= quantity
+            sell_proceeds += ledger.trade_amount(quantity, price, ct == option_ct)
+
+        touched.add(key)
+        transactions.append(trade)
+
+    to_create, to_update, to_delete = [], [], []
+    for key in touched:
+        holding = holdings[key]
+        if holding.pk is None:
+            if holding.quantity > 0:
+                to_create.append(holding)
+        elif holding.quantity <= 0:
+            to_delete.append(holding.pk)
+        else:
+            to_update.append(holding)
+    Holding.objects.bulk_create(to_create)
+    Holding.objects.bulk_update(to_update, ['quantity', 'cost_basis'])
+    Holding.objects.filter(pk__in=to_delete).delete()
+
+    created = Transaction.objects.bulk_create(transactions)
+    RealizedGain.objects.bulk_create(gains)
+    # Backdated fills make any replay checkpoint after them stale.
+    invalidate_checkpoints(min(t.date for t in transactions))
+    ledger.record_fill_totals(buy_cost, sell_proceeds, realized_pnl)
+    return created
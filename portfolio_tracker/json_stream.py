@@ -0,0 +1,122 @@
+# portfolio_tracker/json_stream.py
+import codecs
+import json
+from typing import Iterable, Iterator
+
+_WHITESPACE = ' \t\n\r'
+_NUMBER_CHARS = frozenset('0123456789+-.eE')
+
+
+class JsonStreamReader:
+    """
+    Walks a JSON document arriving as text chunks without holding all of it.
+    The caller steers: members() steps through an object's keys, items()
+    through an array's elements, and value() decodes whatever comes next
+    with the stdlib's C decoder. Only the value being decoded is buffered,
+    so a large array can be filtered element by element.
+
+        reader = JsonStreamReader(response.iter_content(65536))
+        for key in reader.members():
+            if key == 'data':
+                for element in reader.items():
+                    ...
+            else:
+                reader.value()
+
+    Every value a key yields must be consumed before asking for the next key.
+    """
+
+    def __init__(self, chunks: Iterable, encoding: str = 'utf-8'):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder(encoding)()
+        self._json = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self, at_least: int = 1) -> bool:
+        """
+        Appends at least `at_least` more characters (fewer at the end of the
+        input) to the buffer; False if there was nothing left to read.
+        """
+        if self._eof:
+            return False
+        if self._pos:
+            self._buffer, self._pos = self._buffer[self._pos:], 0
+        # Join once rather than growing the buffer chunk by chunk.
+        parts, size = [self._buffer], 0
+        for chunk in self._chunks:
+            text = self._decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+            parts.append(text)
+            size += len(text)
+            if size >= at_least:
+                break
+        else:
+            parts.append(self._decoder.decode(b'', final=True))
+            self._eof = True
+        before = len(self._buffer)
+        self._buffer = ''.join(parts)
+        return len(self._buffer) > before
+
+    def peek(self) -> str:
+        """The next non-whitespace character, without consuming it ('' at the end of the input)."""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, chars: str) -> str:
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"Expected one of {chars!r} at offset {self._pos}, found {char!r}")
+        self._pos += 1
+        return char
+
+    def value(self):
+        """Decodes the next complete value, reading as many chunks as it needs."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if not self._grow():
+                    raise
+                continue
+            # A number cut off by the chunk boundary ("12" of "12.5e3") still decodes; only
+            # a delimiter after it proves it complete.
+            cut = end == len(self._buffer) or self._buffer[end] in _NUMBER_CHARS
+            if cut and self._grow():
+                continue
+            self._pos = end
+            return value
+
+    def _grow(self) -> bool:
+        # Double the pending text, so retrying a large value stays linear overall.
+        return self._fill(at_least=max(1, len(self._buffer) - self._pos))
+
+    def members(self) -> Iterator[str]:
+        """Yields each key of the object that comes next; the caller consumes its value."""
+        self._expect('{')
+        if self.peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self.value()
+            self._expect(':')
+            yield key
+            if self._expect(',}') == '}':
+                return
+
+    def items(self) -> Iterator:
+        """Yields each element of the array that comes next, decoded."""
+        self._expect('[')
+        if self.peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self.value()
+            if self._expect(',]') == ']':
+                return
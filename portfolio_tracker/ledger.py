@@ -0,0 +1,145 @@
+# portfolio_tracker/ledger.py
+"""
+Running totals of the cash ledger (the LedgerTotals row).
+
+Every code path that writes Deposit, Transaction or RealizedGain rows (the
+API views, ingestion.apply_fills, replays, the admin and the backfill
+command) books the same change here inside its own database transaction.
+Anything that writes those tables without going through this module, such as
+bulk_create in fixtures, loaddata or SQL, must be followed by
+`manage.py rebuild_ledger_totals`, which recomputes the row from the raw
+tables (rebuild_totals) and is the repair path for any drift.
+"""
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Case, DecimalField, F, Q, Sum, Value, When
+
+from .models import Deposit, LedgerTotals, Option, RealizedGain, Transaction
+from .valuation import OPTION_CONTRACT_MULTIPLIER
+
+LEDGER_PK = 1
+TOTAL_FIELDS = ('total_deposits', 'total_buy_cost', 'total_sell_proceeds', 'total_realized_pnl', 'free_cash')
+# Precision of Holding.cost_basis and RealizedGain.realized_pnl
+COST_QUANTUM = Decimal('0.0001')
+CENT = Decimal('0.01')
+
+
+def get_totals() -> LedgerTotals:
+    totals, _ = LedgerTotals.objects.get_or_create(pk=LEDGER_PK)
+    return totals
+
+
+def lock_totals() -> LedgerTotals:
+    """
+    Locks the totals row until the current transaction ends. Everything that
+    rewrites holdings (fills, replays) takes this lock first, so they never
+    interleave.
+    """
+    get_totals()
+    return LedgerTotals.objects.select_for_update().get(pk=LEDGER_PK)
+
+
+def _apply(**deltas) -> None:
+    """
+    Adds `deltas` to the totals row with a single UPDATE ... SET x = x + delta,
+    so concurrent writers never lose each other's changes. Call it inside the
+    same transaction.atomic() block as the ledger write it accounts for.
+    """
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    updated = LedgerTotals.objects.filter(pk=LEDGER_PK).update(
+        **{field: F(field) + Value(delta) for field, delta in deltas.items()}
+    )
+    if not updated:
+        get_totals()
+        _apply(**deltas)
+
+
+def average_cost(held_quantity, cost_basis, quantity, price) -> Decimal:
+    """
+    Average cost after buying `quantity` at `price`, rounded as the column
+    stores it (PostgreSQL rounds numeric half away from zero). Fills and
+    replays both use it, so a position's cost never depends on the path.
+    """
+    total_cost = held_quantity * cost_basis + quantity * price
+    return (total_cost / (held_quantity + quantity)).quantize(COST_QUANTUM, rounding=ROUND_HALF_UP)
+
+
+def realized_gain(quantity, price, cost_basis) -> Decimal:
+    """P&L of selling `quantity` at `price`, rounded to cents like the RealizedGain column."""
+    return ((price - cost_basis) * quantity).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def trade_amount(quantity, price, is_option: bool) -> Decimal:
+    """Cash value of a fill, applying the contract multiplier for options."""
+    return Decimal(quantity) * Decimal(price) * (OPTION_CONTRACT_MULTIPLIER if is_option else 1)
+
+
+def record_deposit(amount, sign: int = 1) -> None:
+    amount = Decimal(amount) * sign
+    _apply(total_deposits=amount, free_cash=amount)
+
+
+def record_trade(transaction_type: str, quantity, price, is_option: bool, sign: int = 1) -> None:
+    """Books a buy or sell; pass sign=-1 to reverse a previously booked trade."""
+    amount = trade_amount(quantity, price, is_option) * sign
+    if transaction_type == 'buy':
+        _apply(total_buy_cost=amount, free_cash=-amount)
+    else:
+        _apply(total_sell_proceeds=amount, free_cash=amount)
+
+
+def record_fill_totals(buy_cost, sell_proceeds, realized_pnl) -> None:
+    """Books the summed effect of a batch of fills with a single UPDATE."""
+    _apply(
+        total_buy_cost=buy_cost,
+        total_sell_proceeds=sell_proceeds,
+        free_cash=sell_proceeds - buy_cost,
+        total_realized_pnl=realized_pnl,
+    )
+
+
+def record_realized_gain(realized_pnl, sign: int = 1) -> None:
+    _apply(total_realized_pnl=Decimal(realized_pnl) * sign)
+
+
+def compute_totals() -> dict:
+    """Recomputes every total from the raw Deposit, Transaction and RealizedGain tables."""
+    option_content_type = ContentType.objects.get_for_model(Option)
+    trade_value = Case(
+        When(content_type=option_content_type, then=(F('price') * F('quantity') * Value(OPTION_CONTRACT_MULTIPLIER))),
+        default=(F('price') * F('quantity')),
+        output_field=DecimalField()
+    )
+    trades = Transaction.objects.aggregate(
+        buy=Sum(trade_value, filter=Q(transaction_type='buy')),
+        sell=Sum(trade_value, filter=Q(transaction_type='sell')),
+    )
+    totals = {
+        'total_deposits': Deposit.objects.aggregate(total=Sum('amount'))['total'] or Decimal('0'),
+        'total_buy_cost': trades['buy'] or Decimal('0'),
+        'total_sell_proceeds': trades['sell'] or Decimal('0'),
+        'total_realized_pnl': RealizedGain.objects.aggregate(total=Sum('realized_pnl'))['total'] or Decimal('0'),
+    }
+    totals['free_cash'] = totals['total_deposits'] - totals['total_buy_cost'] + totals['total_sell_proceeds']
+    return totals
+
+
+def verify_totals() -> dict:
+    """Returns {field: (stored, expected)} for every total that has drifted from the raw tables."""
+    stored = get_totals()
+    quantum = Decimal('0.0001')
+    mismatches = {}
+    for field, expected in compute_totals().items():
+        expected = Decimal(expected).quantize(quantum)
+        if getattr(stored, field).quantize(quantum) != expected:
+            mismatches[field] = (getattr(stored, field), expected)
+    return mismatches
+
+
+def rebuild_totals() -> LedgerTotals:
+    totals = compute_totals()
+    LedgerTotals.objects.update_or_create(pk=LEDGER_PK, defaults=totals)
+    return get_totals()
@@ -0,0 +1,45 @@
+# portfolio_tracker/log_formatting.py
+"""
+Formatters for structured logs. Call sites pass their fields as `extra`, e.g.
+logger.info("Stock price updated", extra={"symbol": "AAPL", "price": 189.5}),
+and LOG_FORMAT picks whether they are written as JSON lines or key=value text.
+"""
+import json
+import logging
+from datetime import datetime, timezone
+
+# Attributes every LogRecord has; anything else on a record came from `extra`.
+_RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def _fields(record: logging.LogRecord) -> dict:
+    return {key: value for key, value in vars(record).items() if key not in _RESERVED}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            **_fields(record),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class KeyValueFormatter(logging.Formatter):
+    """The usual text line followed by the structured fields as key=value pairs."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = _fields(record)
+        if not fields:
+            return line
+        pairs = " ".join(f"{key}={json.dumps(value, default=str)}" for key, value in fields.items())
+        head, _, tail = line.partition("\n")
+        return f"{head} {pairs}" + (f"\n{tail}" if tail else "")
@@ -1,8 +1,11 @@
 # portfolio_tracker/management/commands/backfill_transactions.py
 
+from django.contrib.contenttypes.models import ContentType
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from django.utils import timezone
-from portfolio_tracker.models import Holding, Transaction
+from portfolio_tracker import ledger
+from portfolio_tracker.models import Holding, Option, Transaction
 
 class Command(BaseCommand):
     help = 'Backfills initial buy transactions from existing holdings.'
@@ -12,6 +15,7 @@ class Command(BaseCommand):
         
         created_count = 0
         skipped_count = 0
+        option_ct = ContentType.objects.get_for_model(Option)
 
         for holding in Holding.objects.all():
             # Check if a transaction for this exact instrument already exists
@@ -27,14 +31,16 @@ class Command(BaseCommand):
                 skipped_count += 1
                 continue
 
-            # Create the initial "buy" transaction
-            Transaction.objects.create(
-                instrument=holding.instrument,
-                transaction_type='buy',
-                quantity=holding.quantity,
-                price=holding.cost_basis,  # Assume cost_basis is the original purchase price
-                date=timezone.now() # NOTE: The date will be today, as we don't know the original purchase date.
-            )
+            # Create the initial "buy" transaction and book its cost in the ledger totals
+            with transaction.atomic():
+                Transaction.objects.create(
+                    instrument=holding.instrument,
+                    transaction_type='buy',
+                    quantity=holding.quantity,
+                    price=holding.cost_basis,  # Assume cost_basis is the original purchase price
+                    date=timezone.now() # NOTE: The date will be today, as we don't know the original purchase date.
+                )
+                ledger.record_trade('buy', holding.quantity, holding.cost_basis, holding.content_type_id == option_ct.id)
             created_count += 1
             self.stdout.write(self.style.SUCCESS(f"Created initial 'buy' transaction for {holding.instrument}"))
 
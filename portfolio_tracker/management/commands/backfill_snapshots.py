@@ -0,0 +1,62 @@
+# portfolio_tracker/management/commands/backfill_snapshots.py
+
+import time
+from datetime import date
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from portfolio_tracker.history import build_value_history, traded_stocks_without_daily_bars
+from portfolio_tracker.models import PortfolioSnapshot, Stock
+from portfolio_tracker.price_store import record_daily_closes
+from portfolio_tracker.tasks import fetch_daily_candles
+
+class Command(BaseCommand):
+    help = 'Rebuilds daily PortfolioSnapshot rows from the Transaction log and stored price bars.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='First date to write (YYYY-MM-DD). Defaults to the first transaction.')
+        parser.add_argument('--end', help='Last date to write (YYYY-MM-DD). Defaults to today.')
+        parser.add_argument(
+            '--overwrite', action='store_true',
+            help='Replace existing snapshots instead of only filling missing dates.',
+        )
+        parser.add_argument(
+            '--fetch-missing', action='store_true',
+            help='Download daily closes for traded stocks that have no daily price bars yet '
+                 '(one or two Alpha Vantage calls per symbol; mind the daily quota).',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            start = date.fromisoformat(options['start']) if options['start'] else None
+            end = date.fromisoformat(options['end']) if options['end'] else None
+        except ValueError:
+            raise CommandError("--start/--end must be YYYY-MM-DD dates.")
+
+        if options['fetch_missing']:
+            missing = traded_stocks_without_daily_bars()
+            if missing:
+                self.stdout.write(f"Fetching daily closes for {len(missing)} symbols...")
+            for stock_id, symbol in missing.items():
+                candles = fetch_daily_candles(symbol, full=True)
+                record_daily_closes(Stock, stock_id, ((date.fromisoformat(c['date']), c['price']) for c in candles))
+
+        started = time.perf_counter()
+        dates, values = build_value_history(start, end)
+        snapshots = [
+            PortfolioSnapshot(date=day, total_value=Decimal(str(round(float(value), 4))))
+            for day, value in zip(dates, values)
+        ]
+        if options['overwrite']:
+            PortfolioSnapshot.objects.bulk_create(
+                snapshots, batch_size=1000,
+                update_conflicts=True, unique_fields=['date'], update_fields=['total_value', 'updated_at'],
+            )
+        else:
+            PortfolioSnapshot.objects.bulk_create(snapshots, batch_size=1000, ignore_conflicts=True)
+
+        elapsed = time.perf_counter() - started
+        kept = "replaced" if options['overwrite'] else "kept"
+        self.stdout.write(self.style.SUCCESS(
+            f"Computed {len(snapshots)} daily values in {elapsed:.2f}s ({kept} existing snapshots)."
+        ))
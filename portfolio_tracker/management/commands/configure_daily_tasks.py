@@ -0,0 +1,38 @@
+# portfolio_tracker/management/commands/configure_daily_tasks.py
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django_celery_beat.models import CrontabSchedule, PeriodicTask
+
+from portfolio_tracker.market_calendar import EASTERN
+
+# (beat entry name, task, hour, minute) in US/Eastern, on trading weekdays. The price-bar roll-up
+# runs first, and the risk model is rebuilt only after the benchmark candles it measures beta against.
+DAILY_TASKS = [
+    ('Roll up price bars', 'portfolio_tracker.tasks.roll_up_price_bars', 17, 0),
+    ('Sync benchmark candles', 'portfolio_tracker.tasks.sync_benchmark_candles', 18, 0),
+    ('Refresh risk model', 'portfolio_tracker.tasks.refresh_risk_model', 18, 30),
+]
+
+
+class Command(BaseCommand):
+    help = ('Installs the daily beat entries for roll_up_price_bars, sync_benchmark_candles and '
+            'refresh_risk_model. Safe to re-run; existing entries are updated in place.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--disable', action='store_true', help='Disable the entries instead of enabling them.')
+
+    def handle(self, *args, **options):
+        enabled = not options['disable']
+        with transaction.atomic():
+            for name, task, hour, minute in DAILY_TASKS:
+                schedule, _ = CrontabSchedule.objects.get_or_create(
+                    minute=str(minute), hour=str(hour), day_of_week='1-5', day_of_month='*', month_of_year='*',
+                    timezone=EASTERN,
+                )
+                PeriodicTask.objects.update_or_create(
+                    name=name, defaults={'task': task, 'crontab': schedule, 'interval': None, 'enabled': enabled},
+                )
+                self.stdout.write(f"  {name:<24} {hour:02d}:{minute:02d} ET, Mon-Fri{'' if enabled else ' (disabled)'}")
+
+        self.stdout.write(self.style.SUCCESS(f"{'Installed' if enabled else 'Disabled'} {len(DAILY_TASKS)} daily beat entries."))
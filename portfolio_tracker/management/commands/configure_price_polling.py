@@ -0,0 +1,65 @@
+# portfolio_tracker/management/commands/configure_price_polling.py
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django_celery_beat.models import IntervalSchedule, PeriodicTask, PeriodicTasks
+
+from portfolio_tracker.market_calendar import CLOSED, REGULAR, next_session_start, session_at
+from portfolio_tracker.models import Stock
+from portfolio_tracker.polling import build_plan
+
+TASK_NAME = 'Adaptive price polling'
+FIXED_CADENCE_TASKS = [
+    'portfolio_tracker.tasks.sync_all_stock_prices',
+    'portfolio_tracker.tasks.sync_all_option_prices',
+]
+
+class Command(BaseCommand):
+    help = ('Installs the schedule_price_polls beat entry and disables the fixed-cadence '
+            'sync_all_stock_prices / sync_all_option_prices entries it replaces.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=int, default=15, help='Seconds between scheduler ticks (default: 15).')
+        parser.add_argument('--keep-fixed', action='store_true', help='Leave the fixed-cadence sync entries enabled.')
+        parser.add_argument(
+            '--show-plan', nargs='?', const='now', choices=['now', 'pre', 'regular', 'post'],
+            help='Only print the poll plan for the current (or given) session; change nothing.',
+        )
+
+    def handle(self, *args, **options):
+        if options['show_plan']:
+            return self.show_plan(session_at() if options['show_plan'] == 'now' else options['show_plan'])
+
+        with transaction.atomic():
+            schedule, _ = IntervalSchedule.objects.get_or_create(every=options['every'], period=IntervalSchedule.SECONDS)
+            PeriodicTask.objects.update_or_create(
+                name=TASK_NAME,
+                defaults={'task': 'portfolio_tracker.tasks.schedule_price_polls', 'interval': schedule, 'enabled': True},
+            )
+            disabled = 0
+            if not options['keep_fixed']:
+                disabled = PeriodicTask.objects.filter(task__in=FIXED_CADENCE_TASKS, enabled=True).update(enabled=False)
+                # QuerySet.update skips the signal that tells beat to reload its schedule.
+                PeriodicTasks.update_changed()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"'{TASK_NAME}' runs every {options['every']}s; disabled {disabled} fixed-cadence sync entries."
+        ))
+
+    def show_plan(self, session):
+        self.stdout.write(f"Session: {session}")
+        if session == CLOSED:
+            self.stdout.write(f"Market closed; polling resumes at {next_session_start():%Y-%m-%d %H:%M %Z}.")
+            return
+        plan = build_plan(session)
+        symbols = dict(Stock.objects.values_list('id', 'symbol'))
+        for kind in ('stocks', 'options'):
+            intervals = plan[kind]
+            if not intervals:
+                continue
+            per_minute = sum(60 / interval for interval in intervals.values())
+            self.stdout.write(f"{kind}: {len(intervals)} polled, {per_minute:.1f} calls/minute. Most frequent:")
+            for stock_id, interval in sorted(intervals.items(), key=lambda item: item[1])[:15]:
+                self.stdout.write(f"  {symbols.get(stock_id, stock_id):<10} every {interval:>8.1f}s")
+        if session != REGULAR:
+            self.stdout.write("Option chains are only polled during the regular session.")
@@ -0,0 +1,33 @@
+# portfolio_tracker/management/commands/rebuild_ledger_totals.py
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from portfolio_tracker import ledger
+from portfolio_tracker.models import LedgerTotals
+
+class Command(BaseCommand):
+    help = 'Verifies the LedgerTotals row against the raw Deposit/Transaction/RealizedGain tables and rebuilds it.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify-only', action='store_true',
+            help='Only report drift; exit with an error instead of rebuilding.',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            # Lock the row so no write lands between the comparison and the rebuild.
+            LedgerTotals.objects.select_for_update().filter(pk=ledger.LEDGER_PK).first()
+            mismatches = ledger.verify_totals()
+
+            for field, (stored, expected) in mismatches.items():
+                self.stdout.write(self.style.WARNING(f"{field}: stored {stored}, raw tables give {expected}"))
+
+            if not mismatches:
+                self.stdout.write(self.style.SUCCESS("Ledger totals match the raw tables."))
+                return
+            if options['verify_only']:
+                raise CommandError(f"{len(mismatches)} ledger total(s) have drifted.")
+
+            totals = ledger.rebuild_totals()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt ledger totals. Free cash: {totals.free_cash}"))
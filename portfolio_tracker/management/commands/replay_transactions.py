@@ -0,0 +1,33 @@
+# portfolio_tracker/management/commands/replay_transactions.py
+
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from portfolio_tracker.replay import replay_transactions
+
+class Command(BaseCommand):
+    help = 'Rebuilds holdings and realized gains by replaying the Transaction log.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since',
+            help='ISO datetime of the earliest changed transaction; resumes from the nearest checkpoint before it. '
+                 'Without it the whole history is replayed.',
+        )
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = datetime.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError("--since must be an ISO datetime, e.g. 2025-01-31T00:00:00+00:00")
+
+        result = replay_transactions(since)
+        if result['resumed_from']:
+            self.stdout.write(f"Resumed from checkpoint at {result['resumed_from']}.")
+        self.stdout.write(self.style.SUCCESS(
+            f"Replayed {result['replayed']} of {result['transactions']} transactions: "
+            f"{result['holdings']} holdings, {result['realized_gains']} realized gains, "
+            f"{result['checkpoints_saved']} new checkpoints."
+        ))
@@ -0,0 +1,189 @@
+# portfolio_tracker/management/commands/run_benchmarks.py
+
+import json
+import platform
+import subprocess
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import django
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework.test import APIClient
+
+from portfolio_tracker import tasks
+from portfolio_tracker.allocation import mean_variance_weights
+from portfolio_tracker.greeks import portfolio_greeks
+from portfolio_tracker.risk import current_exposures, get_model
+from portfolio_tracker.benchmark import (
+    SIZES, Case, compare, option_chain_payload, run_cases, seed_portfolio, stub_providers,
+)
+from portfolio_tracker.data_fetcher import _read_option_chain
+from portfolio_tracker.json_stream import JsonStreamReader
+from portfolio_tracker.models import AllocationTarget, Option, Stock
+
+class Command(BaseCommand):
+    help = ('Times the price-sync tasks, the daily snapshot, the summary view, transaction creation and the list '
+            'endpoints against a seeded synthetic portfolio in a throwaway test database, and saves the results as JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', choices=sorted(SIZES), default='smoke', help='Preset portfolio size (default: smoke).')
+        for name in ('stocks', 'options', 'transactions', 'years'):
+            parser.add_argument(f'--{name}', type=int, help=f'Override the preset number of {name}.')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the data generator and the stubbed providers.')
+        parser.add_argument('--repeat', type=int, default=3, help='Timed runs per case (default: 3).')
+        parser.add_argument('--only', nargs='+', metavar='CASE', help='Run only the named cases.')
+        parser.add_argument('--output', help='Results file. Defaults to benchmarks/<timestamp>-<size>.json.')
+        parser.add_argument('--compare', metavar='RESULTS', help='Earlier results file to print median ratios against.')
+        parser.add_argument(
+            '--keepdb', action='store_true',
+            help='Keep the test database between runs and reuse its data if it is already seeded.',
+        )
+
+    def handle(self, *args, **options):
+        size = dict(SIZES[options['size']])
+        for name in size:
+            if options[name] is not None:
+                size[name] = options[name]
+        baseline = None
+        if options['compare']:
+            try:
+                baseline = json.loads(Path(options['compare']).read_text())
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Cannot read --compare file: {e}")
+
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            if Stock.objects.exists():
+                self.stdout.write("Reusing the seeded test database.")
+            else:
+                self.stdout.write(f"Seeding {size} ...")
+                started = datetime.now()
+                counts = seed_portfolio(seed=options['seed'], **size)
+                self.stdout.write(f"Seeded {counts} in {(datetime.now() - started).total_seconds():.1f}s.")
+
+            with stub_providers(seed=options['seed']):
+                cases = self.build_cases()
+                if options['only']:
+                    unknown = set(options['only']) - {case.name for case in cases}
+                    if unknown:
+                        raise CommandError(f"Unknown cases: {', '.join(sorted(unknown))}")
+                    cases = [case for case in cases if case.name in options['only']]
+                results = run_cases(cases, repeat=options['repeat'], log=self.stdout.write)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        report = {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'commit': self.git_commit(),
+            'size': options['size'],
+            'seed': options['seed'],
+            'parameters': size,
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'machine': platform.machine(),
+            },
+            'results': results,
+        }
+        output = Path(options['output'] or Path(settings.BASE_DIR) / 'benchmarks' / (
+            f"{datetime.now():%Y%m%d-%H%M%S}-{options['size']}.json"
+        ))
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(report, indent=2))
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(results)} results to {output}."))
+
+        if baseline:
+            for name, before, after, ratio in compare(baseline, report):
+                style = self.style.ERROR if ratio > 1.1 else self.style.SUCCESS if ratio < 0.9 else str
+                self.stdout.write(style(f"{name:<40} {before * 1000:10.1f} ms -> {after * 1000:10.1f} ms  x{ratio:.2f}"))
+
+    def build_cases(self):
+        client = APIClient()
+        busiest_stock = (
+            Option.objects.values('underlying_stock_id').annotate(n=Count('id')).order_by('-n')
+            .values_list('underlying_stock_id', flat=True).first()
+        )
+        symbol = Stock.objects.filter(id=busiest_stock).values_list('symbol', flat=True).first() \
+            or Stock.objects.values_list('symbol', flat=True).first()
+        expiration = (date.today() + timedelta(days=30)).isoformat()
+
+        def get(url):
+            def request():
+                response = client.get(url)
+                if response.status_code != 200:
+                    raise CommandError(f"GET {url} returned {response.status_code}")
+            return request
+
+        def stream(url):
+            def request():
+                response = client.get(url)
+                for _ in response.streaming_content:
+                    pass
+            return request
+
+        def create_transaction():
+            response = client.post('/api/transactions/', {
+                'transaction_type': 'buy', 'quantity': '1', 'price': '1', 'symbol': symbol,
+                'strike_price': '1', 'expiration_date': expiration, 'option_type': 'C',
+            })
+            if response.status_code != 201:
+                raise CommandError(f"POST /api/transactions/ returned {response.status_code}: {response.content[:200]}")
+
+        payload = option_chain_payload()
+        held_expirations = {json.loads(payload)['data'][3]['expirationDate']}
+
+        def parse_chain(expirations, strikes):
+            def parse():
+                chunks = (payload[i:i + 65536] for i in range(0, len(payload), 65536))
+                _read_option_chain(JsonStreamReader(chunks), expirations, strikes)
+            return parse
+
+        # A dense problem the size of the seeded targets, for the optimizer alone.
+        groups = max(AllocationTarget.objects.count(), 2)
+        rng = np.random.default_rng(0)
+        daily = rng.normal(0.0004, 0.015, (250, groups)) + rng.normal(0, 0.01, (250, 1))
+        mean, covariance = daily.mean(axis=0) * 252, np.cov(daily, rowvar=False) * 252
+
+        return [
+            Case('option_chain_parse_full', parse_chain(None, None)),
+            Case('option_chain_parse_held', parse_chain(held_expirations, {100.0, 150.0})),
+            Case('sync_all_stock_prices', tasks.sync_all_stock_prices),
+            Case('update_option_prices_for_stock', lambda: tasks.update_option_prices_for_stock(busiest_stock)),
+            Case('create_daily_portfolio_snapshot', tasks.create_daily_portfolio_snapshot),
+            Case('portfolio_summary_view', get('/api/portfolio-summary/')),
+            Case('transaction_create', create_transaction, repeat=20),
+            Case('stock_list', get('/api/stocks/')),
+            Case('option_list', get('/api/options/')),
+            Case('option_positions', get('/api/options/?view=positions')),
+            Case('holding_list', get('/api/holdings/')),
+            Case('holding_positions', get('/api/holdings/?view=positions')),
+            Case('option_greeks_view', get('/api/option-greeks/')),
+            Case('option_greeks_solve', lambda: portfolio_greeks(use_cache=False)),
+            Case('risk_model_build', lambda: get_model(list(current_exposures()[0]), rebuild=True)),
+            Case('portfolio_risk_view', get(f'/api/portfolio-risk/?what_if={symbol}:10000')),
+            Case('rebalance_view', get('/api/rebalance/')),
+            Case('rebalance_mean_variance_view', get('/api/rebalance/?mode=mean_variance')),
+            Case('mean_variance_solve', lambda: mean_variance_weights(mean, covariance, 0.9, 5.0, 0.05)),
+            Case('deposit_list', get('/api/deposits/')),
+            Case('transaction_list', get('/api/transactions/')),
+            Case('transaction_page', get('/api/transactions/?page_size=100')),
+            Case('transaction_stream', stream('/api/transactions/?stream=1')),
+        ]
+
+    def git_commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -0,0 +1,131 @@
+# portfolio_tracker/market_calendar.py
+"""
+US equity session calendar (NYSE/Nasdaq rules), computed rather than fetched:
+full-day holidays, 1 p.m. early closes, and the pre-market / regular /
+after-hours phases in New York time. Ad-hoc closures such as national days
+of mourning go in MARKET_EXTRA_CLOSURES.
+"""
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.utils import timezone
+
+EASTERN = ZoneInfo('America/New_York')
+
+PRE_MARKET, REGULAR, AFTER_HOURS, CLOSED = 'pre', 'regular', 'post', 'closed'
+
+PRE_MARKET_OPEN = time(4, 0)
+REGULAR_OPEN = time(9, 30)
+REGULAR_CLOSE = time(16, 0)
+EARLY_CLOSE = time(13, 0)
+AFTER_HOURS_CLOSE = time(20, 0)
+EARLY_AFTER_HOURS_CLOSE = time(17, 0)
+
+
+def _nth_weekday(year: int, month: int, weekday: int, n: int) -> date:
+    """n-th `weekday` (Mon=0) of the month; n=-1 for the last one."""
+    if n > 0:
+        first = date(year, month, 1)
+        return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def _easter(year: int) -> date:
+    # Anonymous Gregorian algorithm
+    a, b, c = year % 19, year // 100, year % 100
+    d, e = b // 4, b % 4
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = c // 4, c % 4
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def _observed(day: date) -> date:
+    """Saturday holidays are observed on Friday, Sunday holidays on Monday."""
+    if day.weekday() == 5:
+        return day - timedelta(days=1)
+    if day.weekday() == 6:
+        return day + timedelta(days=1)
+    return day
+
+
+@lru_cache(maxsize=16)
+def holidays(year: int) -> Dict[date, str]:
+    """Full-day exchange holidays of `year`."""
+    days = {
+        _nth_weekday(year, 1, 0, 3): "Martin Luther King Jr. Day",
+        _nth_weekday(year, 2, 0, 3): "Washington's Birthday",
+        _easter(year) - timedelta(days=2): "Good Friday",
+        _nth_weekday(year, 5, 0, -1): "Memorial Day",
+        _observed(date(year, 7, 4)): "Independence Day",
+        _nth_weekday(year, 9, 0, 1): "Labor Day",
+        _nth_weekday(year, 11, 3, 4): "Thanksgiving Day",
+        _observed(date(year, 12, 25)): "Christmas Day",
+    }
+    # A Saturday New Year's Day is not moved back into the previous year.
+    if date(year, 1, 1).weekday() != 5:
+        days[_observed(date(year, 1, 1))] = "New Year's Day"
+    if year >= 2022:
+        days[_observed(date(year, 6, 19))] = "Juneteenth"
+    return days
+
+
+@lru_cache(maxsize=16)
+def early_closes(year: int) -> frozenset:
+    """Days the regular session ends at 1 p.m.: July 3, the day after Thanksgiving and Christmas Eve."""
+    days = {_nth_weekday(year, 11, 3, 4) + timedelta(days=1)}
+    for candidate in (date(year, 7, 3), date(year, 12, 24)):
+        if candidate.weekday() < 4:  # Mon-Thu; on a Friday it is either a holiday or a normal day
+            days.add(candidate)
+    return frozenset(day for day in days if day not in holidays(year))
+
+
+def _extra_closures() -> set:
+    return {date.fromisoformat(day.strip()) for day in settings.MARKET_EXTRA_CLOSURES if day.strip()}
+
+
+def is_trading_day(day: date) -> bool:
+    return day.weekday() < 5 and day not in holidays(day.year) and day not in _extra_closures()
+
+
+def session_bounds(day: date) -> Optional[Dict[str, Tuple[datetime, datetime]]]:
+    """Start and end (aware, New York time) of each phase on `day`, or None if the market is shut."""
+    if not is_trading_day(day):
+        return None
+    early = day in early_closes(day.year)
+    at = lambda t: datetime.combine(day, t, tzinfo=EASTERN)
+    close = EARLY_CLOSE if early else REGULAR_CLOSE
+    return {
+        PRE_MARKET: (at(PRE_MARKET_OPEN), at(REGULAR_OPEN)),
+        REGULAR: (at(REGULAR_OPEN), at(close)),
+        AFTER_HOURS: (at(close), at(EARLY_AFTER_HOURS_CLOSE if early else AFTER_HOURS_CLOSE)),
+    }
+
+
+def session_at(moment: Optional[datetime] = None) -> str:
+    """PRE_MARKET, REGULAR, AFTER_HOURS or CLOSED at `moment` (default: now)."""
+    local = (moment or timezone.now()).astimezone(EASTERN)
+    for phase, (start, end) in (session_bounds(local.date()) or {}).items():
+        if start <= local < end:
+            return phase
+    return CLOSED
+
+
+def next_session_start(moment: Optional[datetime] = None) -> datetime:
+    """When quotes next start moving: the next pre-market open after `moment`."""
+    local = (moment or timezone.now()).astimezone(EASTERN)
+    day = local.date()
+    for _ in range(15):
+        bounds = session_bounds(day)
+        if bounds and bounds[PRE_MARKET][0] > local:
+            return bounds[PRE_MARKET][0]
+        day += timedelta(days=1)
+    raise ValueError("No trading day within the next two weeks; check MARKET_EXTRA_CLOSURES.")
@@ -0,0 +1,268 @@
+# portfolio_tracker/metrics.py
+"""
+Prometheus metrics shared by the web, worker and beat processes.
+
+Those processes run in separate containers, so samples are not kept in a
+per-process registry. Each metric is one Redis hash with one field per label
+set, and GET /metrics renders every hash in the Prometheus text format.
+Recording a sample costs one pipelined round trip. If Redis is unreachable,
+samples are dropped for METRICS_RETRY_AFTER seconds instead of slowing the
+code being measured.
+"""
+import logging
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Sequence
+
+import redis
+from django.conf import settings
+
+from .redis_client import PROCESS_ID, get_redis_client
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "metrics:"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+REGISTRY: List['_Metric'] = []
+_unavailable_until = 0.0
+
+
+def _record(fill: Callable) -> None:
+    """Runs `fill(pipeline)` and executes it, unless metrics are off or Redis recently failed."""
+    global _unavailable_until
+    if not settings.METRICS_ENABLED or time.monotonic() < _unavailable_until:
+        return
+    try:
+        pipe = get_redis_client().pipeline(transaction=False)
+        fill(pipe)
+        pipe.execute()
+    except redis.RedisError as e:
+        _unavailable_until = time.monotonic() + settings.METRICS_RETRY_AFTER
+        logger.warning("Dropping metrics for %ss, Redis unavailable: %s", settings.METRICS_RETRY_AFTER, e)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.key = f"{KEY_PREFIX}{name}"
+        REGISTRY.append(self)
+
+    def _labels(self, labels: dict) -> str:
+        return ",".join(f'{name}="{_escape(labels.get(name, ""))}"' for name in self.labelnames)
+
+    @staticmethod
+    def _series(name: str, labels: str, value: float) -> str:
+        return f"{name}{{{labels}}} {_number(value)}" if labels else f"{name} {_number(value)}"
+
+    def collect(self, raw: Dict[str, str]) -> Iterable[str]:
+        for labels, value in sorted(raw.items()):
+            yield self._series(self.name, labels, float(value))
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        _record(lambda pipe: pipe.hincrbyfloat(self.key, self._labels(labels), amount))
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        _record(lambda pipe: pipe.hset(self.key, self._labels(labels), value))
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        _record(lambda pipe: pipe.hincrbyfloat(self.key, self._labels(labels), amount))
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class ProcessGauge(_Metric):
+    """
+    A gauge every process reports for itself, rendered as the sum over live
+    processes. Each process keeps its value in its own key with a TTL that
+    `set()` restarts, so a process that dies without setting 0 stops counting
+    once the TTL lapses instead of leaving its last value behind.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self.key = None
+        self.prefix = f"{KEY_PREFIX}{name}:"
+
+    def set(self, value: float, ttl: int) -> None:
+        _record(lambda pipe: pipe.set(f"{self.prefix}{PROCESS_ID}", value, ex=ttl))
+
+    def collect(self, raw) -> Iterable[str]:
+        client = get_redis_client()
+        keys = list(client.scan_iter(match=f"{self.prefix}*"))
+        values = client.mget(keys) if keys else []
+        yield self._series(self.name, '', sum(float(value) for value in values if value is not None))
+
+
+class CallbackGauge(_Metric):
+    """A gauge that is not stored but computed at scrape time by `callback() -> [(labels dict, value), ...]`."""
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, callback: Callable, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.key = None
+        self.callback = callback
+
+    def collect(self, raw) -> Iterable[str]:
+        for labels, value in self.callback():
+            yield self._series(self.name, self._labels(labels), value)
+
+
+class Histogram(_Metric):
+    """
+    Each observation increments only its own bucket plus _sum and _count, in
+    fields named "<labels>|<le>", "<labels>|sum" and "<labels>|count". Buckets
+    are made cumulative when rendered.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        prefix = self._labels(labels)
+        bucket = next((_number(b) for b in self.buckets if value <= b), '+Inf')
+
+        def fill(pipe):
+            pipe.hincrby(self.key, f"{prefix}|{bucket}", 1)
+            pipe.hincrbyfloat(self.key, f"{prefix}|sum", value)
+            pipe.hincrby(self.key, f"{prefix}|count", 1)
+        _record(fill)
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observes the duration of the block. Yields the labels dict so the block
+        can fill in labels it only knows at the end, such as a status code.
+        """
+        started = time.perf_counter()
+        try:
+            yield labels
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def collect(self, raw: Dict[str, str]) -> Iterable[str]:
+        series = defaultdict(dict)
+        for field, value in raw.items():
+            labels, part = field.rsplit('|', 1)
+            series[labels][part] = float(value)
+        for labels, parts in sorted(series.items()):
+            cumulative = 0
+            for bound in [_number(b) for b in self.buckets] + ['+Inf']:
+                cumulative += parts.get(bound, 0)
+                le = f'le="{bound}"'
+                yield self._series(f"{self.name}_bucket", f"{labels},{le}" if labels else le, cumulative)
+            yield self._series(f"{self.name}_sum", labels, parts.get('sum', 0))
+            yield self._series(f"{self.name}_count", labels, parts.get('count', 0))
+
+
+def render() -> str:
+    """Every registered metric in the Prometheus text exposition format. Raises redis.RedisError."""
+    stored = [metric for metric in REGISTRY if metric.key]
+    pipe = get_redis_client().pipeline(transaction=False)
+    for metric in stored:
+        pipe.hgetall(metric.key)
+    raw = {
+        metric.name: {field.decode(): value.decode() for field, value in values.items()}
+        for metric, values in zip(stored, pipe.execute())
+    }
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.collect(raw.get(metric.name, {})))
+    return "\n".join(lines) + "\n"
+
+
+def reset() -> None:
+    """Deletes every stored sample, e.g. after changing bucket boundaries."""
+    get_redis_client().delete(*[metric.key for metric in REGISTRY if metric.key])
+
+
+def _celery_queue_lengths() -> list:
+    # The broker is the same Redis; Celery keeps each queue as a list named after it.
+    client = get_redis_client()
+    return [({'queue': queue}, client.llen(queue)) for queue in settings.METRICS_CELERY_QUEUES]
+
+
+HTTP_REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'Latency of HTTP requests by resolved view.', ['view', 'method', 'status'],
+)
+CELERY_TASK_DURATION = Histogram(
+    'celery_task_duration_seconds', 'Run time of Celery tasks.', ['task', 'state'],
+)
+CELERY_TASKS = Counter(
+    'celery_tasks_total', 'Finished Celery task runs by final state (success, failure, retry).', ['task', 'state'],
+)
+CELERY_QUEUE_LENGTH = CallbackGauge(
+    'celery_queue_length', 'Messages waiting in each Celery queue.', _celery_queue_lengths, ['queue'],
+)
+PROVIDER_REQUEST_DURATION = Histogram(
+    'provider_request_duration_seconds', 'Latency of outbound market-data calls, retries included.', ['provider', 'status'],
+)
+PROVIDER_REQUESTS = Counter(
+    'provider_requests_total', 'Outbound market-data calls by final HTTP status or error class.', ['provider', 'status'],
+)
+PROVIDER_QUOTA_EXHAUSTED = Counter(
+    'provider_quota_exhausted_total',
+    'Calls not made or refused because a quota was used up (rate_limiter, http_429, quota_message).',
+    ['provider', 'reason'],
+)
+WEBSOCKET_CLIENTS = ProcessGauge(
+    'websocket_connected_clients', 'Currently connected price WebSocket clients.',
+)
+BROADCAST_FLUSH_DURATION = Histogram(
+    'price_broadcast_flush_seconds', 'Time to drain the pending price batch and send it to every shard group.',
+)
+BROADCAST_GROUP_SENDS = Counter(
+    'price_broadcast_group_sends_total', 'price.batch messages sent to shard groups.',
+)
+BROADCAST_SYMBOLS = Counter(
+    'price_broadcast_symbols_total', 'Symbol prices published over WebSocket.',
+)
+POLL_PLANNED_RATE = Gauge(
+    'price_poll_planned_calls_per_minute', 'Provider calls per minute the current adaptive polling plan will make.', ['kind'],
+)
+
+_task_started: Dict[str, float] = {}
+
+
+def connect_celery_signals() -> None:
+    """Times every task this process runs. Called from the app config, so workers pick it up on start."""
+    from celery.signals import task_prerun, task_postrun
+
+    @task_prerun.connect(weak=False)
+    def _start(task_id=None, **kwargs):
+        _task_started[task_id] = time.perf_counter()
+
+    @task_postrun.connect(weak=False)
+    def _finish(task_id=None, task=None, state=None, **kwargs):
+        started = _task_started.pop(task_id, None)
+        state = (state or 'unknown').lower()
+        if started is not None:
+            CELERY_TASK_DURATION.observe(time.perf_counter() - started, task=task.name, state=state)
+        CELERY_TASKS.inc(task=task.name, state=state)
@@ -0,0 +1,27 @@
+# portfolio_tracker/middleware.py
+import time
+
+from .metrics import HTTP_REQUEST_DURATION
+
+
+class RequestMetricsMiddleware:
+    """
+    Records every request's latency in http_request_duration_seconds, labelled
+    by the resolved view name (e.g. "stock-list") rather than the path, so
+    detail URLs do not create a series per primary key.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        HTTP_REQUEST_DURATION.observe(
+            time.perf_counter() - started,
+            view=match.view_name if match else 'unresolved',
+            method=request.method,
+            status=response.status_code,
+        )
+        return response
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.24 on 2026-10-17 15:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio_tracker', '0005_realizedgain'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BenchmarkCandle',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('symbol', models.CharField(help_text='Benchmark ticker, e.g., VOO', max_length=10)),
+                ('date', models.DateField()),
+                ('close', models.DecimalField(decimal_places=4, help_text='Daily close', max_digits=12)),
+            ],
+            options={
+                'ordering': ['symbol', 'date'],
+                'unique_together': {('symbol', 'date')},
+            },
+        ),
+    ]
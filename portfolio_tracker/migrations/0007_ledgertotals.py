@@ -0,0 +1,64 @@
+# Generated by Django 4.2.24 on 2026-10-17 15:36
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Case, DecimalField, F, Q, Sum, Value, When
+
+
+def seed_ledger_totals(apps, schema_editor):
+    """Starts the running totals from whatever history already exists."""
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    Deposit = apps.get_model('portfolio_tracker', 'Deposit')
+    Transaction = apps.get_model('portfolio_tracker', 'Transaction')
+    RealizedGain = apps.get_model('portfolio_tracker', 'RealizedGain')
+    LedgerTotals = apps.get_model('portfolio_tracker', 'LedgerTotals')
+
+    option_content_type = ContentType.objects.filter(app_label='portfolio_tracker', model='option').first()
+    trade_value = Case(
+        When(content_type=option_content_type, then=F('price') * F('quantity') * Value(100)),
+        default=F('price') * F('quantity'),
+        output_field=DecimalField(),
+    )
+    trades = Transaction.objects.aggregate(
+        buy=Sum(trade_value, filter=Q(transaction_type='buy')),
+        sell=Sum(trade_value, filter=Q(transaction_type='sell')),
+    )
+    deposits = Deposit.objects.aggregate(total=Sum('amount'))['total'] or Decimal('0')
+    buy_cost = trades['buy'] or Decimal('0')
+    sell_proceeds = trades['sell'] or Decimal('0')
+    LedgerTotals.objects.create(
+        pk=1,
+        total_deposits=deposits,
+        total_buy_cost=buy_cost,
+        total_sell_proceeds=sell_proceeds,
+        total_realized_pnl=RealizedGain.objects.aggregate(total=Sum('realized_pnl'))['total'] or Decimal('0'),
+        free_cash=deposits - buy_cost + sell_proceeds,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('portfolio_tracker', '0006_benchmarkcandle'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerTotals',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_deposits', models.DecimalField(decimal_places=4, default=0, max_digits=18)),
+                ('total_buy_cost', models.DecimalField(decimal_places=4, default=0, help_text='Including the option contract multiplier', max_digits=18)),
+                ('total_sell_proceeds', models.DecimalField(decimal_places=4, default=0, help_text='Including the option contract multiplier', max_digits=18)),
+                ('total_realized_pnl', models.DecimalField(decimal_places=4, default=0, max_digits=18)),
+                ('free_cash', models.DecimalField(decimal_places=4, default=0, help_text='deposits - buy cost + sell proceeds', max_digits=18)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'ledger totals',
+            },
+        ),
+        migrations.RunPython(seed_ledger_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.24 on 2026-10-17 15:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio_tracker', '0007_ledgertotals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReplayCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('as_of', models.DateTimeField(help_text='State covers all transactions strictly before this time', unique=True)),
+                ('positions', models.JSONField(help_text='[[content_type_id, object_id, quantity, cost_basis], ...]')),
+                ('transaction_count', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['as_of'],
+            },
+        ),
+    ]
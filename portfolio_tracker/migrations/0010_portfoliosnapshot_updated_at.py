@@ -0,0 +1,18 @@
+# Generated by Django 4.2.24 on 2026-10-17 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio_tracker', '0009_pricebar'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='portfoliosnapshot',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, help_text="Drives the history endpoint's Last-Modified/ETag"),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.24 on 2026-10-17 15:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio_tracker', '0010_portfoliosnapshot_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='deposit',
+            index=models.Index(fields=['date', 'id'], name='deposit_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='option',
+            index=models.Index(fields=['expiration_date', 'strike_price', 'id'], name='option_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['date', 'id'], name='transaction_keyset_idx'),
+        ),
+    ]
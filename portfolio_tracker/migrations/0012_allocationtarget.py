@@ -0,0 +1,25 @@
+# Generated by Django 4.2.24 on 2026-10-17 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio_tracker', '0011_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AllocationTarget',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='The symbol for a single-stock target, else the bucket name', max_length=50, unique=True)),
+                ('weight', models.DecimalField(decimal_places=4, help_text='Fraction of total portfolio value, 0-1', max_digits=7)),
+                ('stocks', models.ManyToManyField(help_text='Stocks the weight is shared by', related_name='allocation_targets', to='portfolio_tracker.stock')),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+    ]
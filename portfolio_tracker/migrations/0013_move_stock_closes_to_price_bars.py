@@ -0,0 +1,56 @@
+from datetime import datetime, time, timezone
+
+from django.db import migrations
+
+# The benchmarks when this migration was written (BENCHMARK_SYMBOLS' default). Fixed here so the
+# migration moves the same rows on every deployment, whatever the settings say later.
+BENCHMARK_SYMBOLS = {'VOO'}
+
+
+def move_stock_closes(apps, schema_editor):
+    """
+    backfill_snapshots --fetch-missing used to store held stocks' daily closes
+    as BenchmarkCandle rows. They become daily PriceBars, so that table only
+    holds benchmarks again. A candle whose day already has a daily bar is left
+    where it is rather than overwriting or losing either value.
+    """
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    Stock = apps.get_model('portfolio_tracker', 'Stock')
+    BenchmarkCandle = apps.get_model('portfolio_tracker', 'BenchmarkCandle')
+    PriceBar = apps.get_model('portfolio_tracker', 'PriceBar')
+
+    stock_ids = dict(Stock.objects.exclude(symbol__in=BENCHMARK_SYMBOLS).values_list('symbol', 'id'))
+    candles = BenchmarkCandle.objects.filter(symbol__in=list(stock_ids))
+    if not candles.exists():
+        return
+    stock_ct, _ = ContentType.objects.get_or_create(app_label='portfolio_tracker', model='stock')
+    existing = set(PriceBar.objects.filter(
+        content_type_id=stock_ct.id, interval='d', object_id__in=list(stock_ids.values()),
+    ).values_list('object_id', 'timestamp'))
+
+    bars, moved = [], []
+    for candle_id, symbol, day, close in candles.values_list('id', 'symbol', 'date', 'close').iterator(chunk_size=5000):
+        key = (stock_ids[symbol], datetime.combine(day, time.min, tzinfo=timezone.utc))
+        if key in existing:
+            continue
+        existing.add(key)
+        bars.append(PriceBar(
+            content_type_id=stock_ct.id, object_id=key[0], interval='d', timestamp=key[1],
+            open=float(close), high=float(close), low=float(close), close=float(close),
+        ))
+        moved.append(candle_id)
+    PriceBar.objects.bulk_create(bars, batch_size=1000)
+    for start in range(0, len(moved), 1000):
+        BenchmarkCandle.objects.filter(id__in=moved[start:start + 1000]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('portfolio_tracker', '0012_allocationtarget'),
+    ]
+
+    operations = [
+        migrations.RunPython(move_stock_closes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.24 on 2026-10-17 17:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio_tracker', '0013_move_stock_closes_to_price_bars'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='realizedgain',
+            name='transaction',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='realized_gains', to='portfolio_tracker.transaction'),
+        ),
+    ]
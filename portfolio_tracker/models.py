@@ -29,9 +29,16 @@ class Option(models.Model):
     class Meta:
         unique_together = ('underlying_stock', 'strike_price', 'expiration_date', 'option_type')
         ordering = ['expiration_date', 'strike_price']
+        # Serves the keyset pagination order (see portfolio_tracker/pagination.py)
+        indexes = [models.Index(fields=['expiration_date', 'strike_price', 'id'], name='option_keyset_idx')]
 
     def __str__(self):
-        return f"{self.underlying_stock.symbol} {self.expiration_date} ${self.strike_price:.2f} {self.get_option_type_display()}"
+        return self.format_name(self.underlying_stock.symbol, self.expiration_date, self.strike_price, self.option_type)
+
+    @classmethod
+    def format_name(cls, symbol, expiration_date, strike_price, option_type) -> str:
+        """Builds the display name from raw column values, e.g. from a values() query."""
+        return f"{symbol} {expiration_date} ${strike_price:.2f} {dict(cls.OPTION_TYPE_CHOICES)[option_type]}"
 
 class Holding(models.Model):
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, help_text="關聯的內容類型 (Stock或Option)")
@@ -44,9 +51,36 @@ class Holding(models.Model):
     def __str__(self):
         return f"{self.quantity} of {self.instrument}"
 
+class PriceBar(models.Model):
+    """
+    Append-only price history for stocks and options. A raw bar is written
+    whenever a sync sees a new price; roll_up_price_bars later folds old raw
+    bars into one daily OHLC bar per instrument. Prices are floats because this
+    table is only ever read back as NumPy arrays, never used for cash amounts.
+    """
+    RAW, DAILY = 'r', 'd'
+    INTERVAL_CHOICES = [(RAW, 'Raw'), (DAILY, 'Daily')]
+
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    interval = models.CharField(max_length=1, choices=INTERVAL_CHOICES, default=RAW)
+    timestamp = models.DateTimeField()
+    open = models.FloatField()
+    high = models.FloatField()
+    low = models.FloatField()
+    close = models.FloatField()
+
+    class Meta:
+        # Doubles as the (instrument, time) index every range read scans.
+        unique_together = ('content_type', 'object_id', 'interval', 'timestamp')
+
+    def __str__(self):
+        return f"{self.content_type_id}:{self.object_id} {self.timestamp} {self.close}"
+
 class PortfolioSnapshot(models.Model):
     date = models.DateField(unique=True)
     total_value = models.DecimalField(max_digits=15, decimal_places=4)
+    updated_at = models.DateTimeField(auto_now=True, help_text="Drives the history endpoint's Last-Modified/ETag")
 
     class Meta:
         ordering = ['date']
@@ -60,6 +94,9 @@ class Deposit(models.Model):
     amount = models.DecimalField(max_digits=12, decimal_places=2, help_text="Amount of cash deposited")
     date = models.DateTimeField(default=timezone.now, help_text="Date of the deposit")
 
+    class Meta:
+        indexes = [models.Index(fields=['date', 'id'], name='deposit_keyset_idx')]
+
     def __str__(self):
         return f"Deposit of ${self.amount} on {self.date.strftime('%Y-%m-%d')}"
 
@@ -75,14 +112,87 @@ class Transaction(models.Model):
     price = models.DecimalField(max_digits=12, decimal_places=4, help_text="Price per share/contract for this transaction")
     date = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        # (date, id) is both the replay order and the keyset pagination order
+        indexes = [models.Index(fields=['date', 'id'], name='transaction_keyset_idx')]
+
     def __str__(self):
         return f"{self.transaction_type.capitalize()} {self.quantity} of {self.instrument} at ${self.price}"
 
+class LedgerTotals(models.Model):
+    """
+    Single-row running totals of the cash ledger, kept in step with every
+    Deposit, Transaction and RealizedGain write by portfolio_tracker.ledger.
+    Writes that bypass it (bulk_create, loaddata, raw SQL) leave the totals
+    stale; `manage.py rebuild_ledger_totals` recomputes them.
+    """
+    total_deposits = models.DecimalField(max_digits=18, decimal_places=4, default=0)
+    total_buy_cost = models.DecimalField(max_digits=18, decimal_places=4, default=0, help_text="Including the option contract multiplier")
+    total_sell_proceeds = models.DecimalField(max_digits=18, decimal_places=4, default=0, help_text="Including the option contract multiplier")
+    total_realized_pnl = models.DecimalField(max_digits=18, decimal_places=4, default=0)
+    free_cash = models.DecimalField(max_digits=18, decimal_places=4, default=0, help_text="deposits - buy cost + sell proceeds")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "ledger totals"
+
+    def __str__(self):
+        return f"Free cash ${self.free_cash}"
+
+class ReplayCheckpoint(models.Model):
+    """
+    Positions folded from every Transaction dated before `as_of`, saved during a
+    replay so later replays can resume here instead of from the first trade.
+    """
+    as_of = models.DateTimeField(unique=True, help_text="State covers all transactions strictly before this time")
+    positions = models.JSONField(help_text="[[content_type_id, object_id, quantity, cost_basis], ...]")
+    transaction_count = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['as_of']
+
+    def __str__(self):
+        return f"Checkpoint before {self.as_of} ({self.transaction_count} transactions)"
+
 class RealizedGain(models.Model):
     instrument_name = models.CharField(max_length=100)
     realized_pnl = models.DecimalField(max_digits=12, decimal_places=2, help_text="Profit or Loss from a sell transaction")
     date = models.DateTimeField(default=timezone.now)
+    # The sell that realized it. Replays resume from a checkpoint only while every gain has one.
+    transaction = models.ForeignKey(
+        Transaction, null=True, blank=True, on_delete=models.SET_NULL, related_name='realized_gains',
+    )
 
     def __str__(self):
         return f"{self.instrument_name}: ${self.realized_pnl}"
 
+
+class BenchmarkCandle(models.Model):
+    symbol = models.CharField(max_length=10, help_text="Benchmark ticker, e.g., VOO")
+    date = models.DateField()
+    close = models.DecimalField(max_digits=12, decimal_places=4, help_text="Daily close")
+
+    class Meta:
+        unique_together = ('symbol', 'date')
+        ordering = ['symbol', 'date']
+
+    def __str__(self):
+        return f"{self.symbol} {self.date}: ${self.close}"
+
+
+class AllocationTarget(models.Model):
+    """
+    Target weight, as a fraction of total portfolio value (holdings plus free
+    cash), of one stock or of a named bucket of stocks. Options count toward
+    their underlying's target. See portfolio_tracker/allocation.py.
+    """
+    name = models.CharField(max_length=50, unique=True, help_text="The symbol for a single-stock target, else the bucket name")
+    stocks = models.ManyToManyField(Stock, related_name='allocation_targets', help_text="Stocks the weight is shared by")
+    weight = models.DecimalField(max_digits=7, decimal_places=4, help_text="Fraction of total portfolio value, 0-1")
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return f"{self.name}: {self.weight:.2%}"
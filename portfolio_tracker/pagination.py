@@ -0,0 +1,164 @@
+# portfolio_tracker/pagination.py
+import base64
+import json
+from functools import reduce
+from operator import or_
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset ("seek") pagination over a unique composite ordering. The cursor
+    carries the last row's ordering values, and the next page is fetched with
+    WHERE (a, b, id) > (:a, :b, :id) ORDER BY a, b, id LIMIT n. Every page
+    therefore costs the same however deep it is, and rows inserted meanwhile
+    never shift a page.
+
+    Opt-in so existing clients that expect a plain array keep working:
+    requests without ?page_size= or ?cursor= get the unpaginated list.
+    """
+    ordering = ('id',)
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+        self.request = request
+        self.page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        cursor = params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(self.after(self.decode_cursor(queryset.model, cursor)))
+
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request) -> int:
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, settings.KEYSET_PAGE_SIZE))
+        except ValueError:
+            size = settings.KEYSET_PAGE_SIZE
+        return max(1, min(size, settings.KEYSET_MAX_PAGE_SIZE))
+
+    def after(self, values) -> Q:
+        """(f0, f1, ..., fn) > (v0, v1, ..., vn), spelled out for the ORM."""
+        return reduce(or_, (
+            Q(**{field: value for field, value in zip(self.ordering[:i], values[:i])},
+              **{f"{self.ordering[i]}__gt": values[i]})
+            for i in range(len(self.ordering))
+        ))
+
+    def encode_cursor(self, instance) -> str:
+        values = [getattr(instance, field) for field in self.ordering]
+        # str() keeps Decimals exact and datetimes parseable by the fields' to_python().
+        raw = json.dumps(values, default=str).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def decode_cursor(self, model, cursor: str) -> list:
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            values = json.loads(raw)
+            if len(values) != len(self.ordering):
+                raise ValueError
+            return [model._meta.get_field(field).to_python(value) for field, value in zip(self.ordering, values)]
+        except Exception:
+            raise NotFound("Invalid cursor.")
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.page_size_query_param, self.page_size)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {'next': {'type': 'string', 'nullable': True}, 'results': schema},
+        }
+
+
+class DateKeysetPagination(KeysetPagination):
+    ordering = ('date', 'id')
+
+
+class OptionKeysetPagination(KeysetPagination):
+    # id breaks ties between contracts of different underlyings with the same expiry and strike
+    ordering = ('expiration_date', 'strike_price', 'id')
+
+
+class StreamingListMixin:
+    """
+    Adds ?stream=1 to a viewset's list: the JSON array is written chunk by
+    chunk from a server-side cursor (QuerySet.iterator), so exporting a large
+    table holds one chunk in memory instead of the whole result.
+
+    Under ASGI the response gets an async iterator: Django drains a sync one
+    into a list before sending anything there, which would buffer the whole
+    export.
+    """
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get('stream') in ('1', 'true'):
+            queryset = self.filter_queryset(self.get_queryset())
+            ordering = getattr(self.pagination_class, 'ordering', None)
+            if ordering:
+                queryset = queryset.order_by(*ordering)
+            chunks = self.stream_json(queryset)
+            if isinstance(request._request, ASGIRequest):
+                chunks = self.astream(chunks)
+            response = StreamingHttpResponse(chunks, content_type='application/json')
+            response['Cache-Control'] = 'no-store'
+            return response
+        return super().list(request, *args, **kwargs)
+
+    def stream_json(self, queryset):
+        chunk_size = settings.STREAMING_CHUNK_SIZE
+        encoder = JSONEncoder()
+        chunk, first = [], True
+        yield '['
+        for instance in queryset.iterator(chunk_size=chunk_size):
+            chunk.append(instance)
+            if len(chunk) == chunk_size:
+                yield ('' if first else ',') + self.encode_chunk(encoder, chunk)
+                chunk, first = [], False
+        if chunk:
+            yield ('' if first else ',') + self.encode_chunk(encoder, chunk)
+        yield ']'
+
+    @staticmethod
+    async def astream(chunks):
+        """
+        Pulls each chunk of the sync generator through sync_to_async. The
+        calls share one thread, so the cursor stays on the same connection.
+        """
+        pull = sync_to_async(next, thread_sensitive=True)
+        try:
+            while True:
+                chunk = await pull(chunks, None)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            await sync_to_async(chunks.close, thread_sensitive=True)()
+
+    def encode_chunk(self, encoder, chunk) -> str:
+        return ','.join(encoder.encode(row) for row in self.get_serializer(chunk, many=True).data)
@@ -0,0 +1,249 @@
+# portfolio_tracker/polling.py
+"""
+Adaptive price polling.
+
+Instead of refreshing every stock and option chain on a fixed cadence, the
+schedule_price_polls task ticks every few seconds and polls only instruments
+whose own interval has elapsed. Intervals come from a plan that shares the
+Finnhub quota out in proportion to each instrument's priority, where
+priority = 1
+         + POLL_POSITION_WEIGHT   * position size relative to the average held position
+         + POLL_VOLATILITY_WEIGHT * recent price range relative to the median instrument
+         + POLL_SUBSCRIBER_WEIGHT * (1 if a WebSocket client is watching the symbol)
+Extended hours get a smaller budget, option chains are polled only in the
+regular session, and nothing is polled while the market is closed.
+
+Due times live in Redis sorted sets (member = stock id, score = next poll
+time), so a beat restart or a new plan never resets the schedule.
+"""
+import json
+import logging
+import random
+import time
+from collections import Counter
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Avg, Max, Min
+from django.utils import timezone
+
+from .market_calendar import CLOSED, REGULAR, session_at
+from .metrics import POLL_PLANNED_RATE
+from .models import Stock, Option, PriceBar
+from .redis_client import PROCESS_ID, get_redis_client
+from .valuation import value_holdings
+
+logger = logging.getLogger(__name__)
+
+# One hash per web process, "<SUBSCRIBERS_KEY>:<process id>", expiring unless the process refreshes it
+SUBSCRIBERS_KEY = "price_poll:subscribers"
+STOCK_DUE_KEY = "price_poll:due:stocks"
+OPTION_DUE_KEY = "price_poll:due:options"
+TICK_LOCK_KEY = "price_poll:tick"
+RELATIVE_CAP = 10.0
+
+
+def _plan_key(session: str) -> str:
+    return f"price_poll:plan:{session}"
+
+
+# This process's count of WebSocket clients watching each symbol
+_subscribers = Counter()
+
+
+def track_subscribers(symbols: Iterable[str], delta: int) -> None:
+    """Adds `delta` to the number of this process's WebSocket clients watching each symbol."""
+    symbols = list(symbols)
+    if not symbols:
+        return
+    for symbol in symbols:
+        _subscribers[symbol] += delta
+        if _subscribers[symbol] <= 0:
+            del _subscribers[symbol]
+    publish_subscribers()
+
+
+def publish_subscribers() -> None:
+    """
+    Replaces this process's hash with its current counts and restarts its TTL.
+    The WebSocket consumer calls this on a heartbeat, so the counts of a process
+    that dies without disconnecting its clients expire with it.
+    """
+    key = f"{SUBSCRIBERS_KEY}:{PROCESS_ID}"
+    pipe = get_redis_client().pipeline()
+    pipe.delete(key)
+    if _subscribers:
+        pipe.hset(key, mapping=dict(_subscribers))
+        pipe.expire(key, settings.WEBSOCKET_PRESENCE_TTL)
+    pipe.execute()
+
+
+def subscribed_symbols() -> set:
+    """Symbols watched by a client of any live web process."""
+    client = get_redis_client()
+    symbols = set()
+    for key in client.scan_iter(match=f"{SUBSCRIBERS_KEY}:*"):
+        symbols.update(symbol.decode() for symbol in client.hkeys(key))
+    return symbols
+
+
+def _exposures() -> Tuple[Dict[int, float], Dict[int, float]]:
+    """Absolute market value per stock id: held shares plus held options, and held options alone."""
+    valuation = value_holdings()
+    stock_exposure, option_exposure = {}, {}
+    option_values = {}
+    for position, value in zip(valuation.positions, np.abs(valuation.market_value).tolist()):
+        if position['instrument_type'] == 'stock':
+            stock_exposure[position['object_id']] = stock_exposure.get(position['object_id'], 0.0) + value
+        elif position['instrument_type'] == 'option':
+            option_values[position['object_id']] = option_values.get(position['object_id'], 0.0) + value
+    if option_values:
+        for option_id, stock_id in Option.objects.filter(id__in=list(option_values)).values_list('id', 'underlying_stock_id'):
+            stock_exposure[stock_id] = stock_exposure.get(stock_id, 0.0) + option_values[option_id]
+            option_exposure[stock_id] = option_exposure.get(stock_id, 0.0) + option_values[option_id]
+    return stock_exposure, option_exposure
+
+
+def _volatilities() -> Dict[int, float]:
+    """(high - low) / mean of each stock's raw price bars over the volatility window, in one grouped query."""
+    since = timezone.now() - timedelta(minutes=settings.POLL_VOLATILITY_WINDOW_MINUTES)
+    bars = PriceBar.objects.filter(
+        content_type=ContentType.objects.get_for_model(Stock), interval=PriceBar.RAW, timestamp__gte=since,
+    ).values('object_id').annotate(high=Max('high'), low=Min('low'), mean=Avg('close'))
+    return {bar['object_id']: (bar['high'] - bar['low']) / bar['mean'] for bar in bars if bar['mean']}
+
+
+def _relative(values: np.ndarray, reference: float) -> np.ndarray:
+    if not reference or not np.isfinite(reference):
+        return np.zeros_like(values)
+    return np.minimum(np.nan_to_num(values / reference), RELATIVE_CAP)
+
+
+def priorities(ids: List[int], exposure: Dict[int, float], volatility: Dict[int, float], subscribed: set) -> np.ndarray:
+    size = np.array([exposure.get(i, 0.0) for i in ids], dtype=float)
+    vol = np.array([volatility.get(i, np.nan) for i in ids], dtype=float)
+    held = size > 0
+    finite = np.isfinite(vol)
+    return (
+        1.0
+        + settings.POLL_POSITION_WEIGHT * _relative(size, size[held].mean() if held.any() else 0.0)
+        + settings.POLL_VOLATILITY_WEIGHT * _relative(vol, float(np.median(vol[finite])) if finite.any() else 0.0)
+        + settings.POLL_SUBSCRIBER_WEIGHT * np.array([i in subscribed for i in ids], dtype=float)
+    )
+
+
+def allocate(ids: List[int], priority: np.ndarray, calls_per_second: float) -> Dict[int, float]:
+    """Shares `calls_per_second` out in proportion to priority; returns seconds between polls per id."""
+    if not ids or calls_per_second <= 0:
+        return {}
+    rate = calls_per_second * priority / priority.sum()
+    intervals = np.maximum(1.0 / rate, settings.POLL_MIN_INTERVAL)
+    return dict(zip(ids, np.round(intervals, 1).tolist()))
+
+
+def build_plan(session: str) -> dict:
+    """Poll interval per stock id ("stocks") and per option underlying id ("options") for `session`."""
+    if session == CLOSED:
+        return {'session': session, 'stocks': {}, 'options': {}}
+
+    quota = min(settings.FINNHUB_RATE_LIMIT_PER_SECOND, settings.FINNHUB_RATE_LIMIT_PER_MINUTE / 60)
+    budget = quota * settings.POLL_QUOTA_SHARE
+    if session != REGULAR:
+        budget *= settings.POLL_EXTENDED_HOURS_QUOTA_SHARE
+    option_budget = budget * settings.POLL_OPTION_QUOTA_SHARE if session == REGULAR else 0.0
+
+    stocks = list(Stock.objects.values_list('id', 'symbol'))
+    subscribed = subscribed_symbols()
+    subscribed_ids = {stock_id for stock_id, symbol in stocks if symbol in subscribed}
+    stock_exposure, option_exposure = _exposures()
+    volatility = _volatilities()
+
+    stock_ids = [stock_id for stock_id, _ in stocks]
+    plan = {
+        'session': session,
+        'stocks': allocate(
+            stock_ids, priorities(stock_ids, stock_exposure, volatility, subscribed_ids), budget - option_budget,
+        ),
+        'options': {},
+    }
+    if option_budget:
+        underlying_ids = list(
+            Option.objects.filter(expiration_date__gte=timezone.localdate())
+            .order_by().values_list('underlying_stock_id', flat=True).distinct()
+        )
+        plan['options'] = allocate(
+            underlying_ids, priorities(underlying_ids, option_exposure, volatility, subscribed_ids), option_budget,
+        )
+
+    for kind in ('stocks', 'options'):
+        POLL_PLANNED_RATE.set(round(sum(60 / i for i in plan[kind].values()), 2), kind=kind)
+    return plan
+
+
+def get_plan(session: str) -> dict:
+    """The cached plan for `session`, rebuilt at most every POLL_PLAN_TTL seconds."""
+    client = get_redis_client()
+    cached = client.get(_plan_key(session))
+    if cached:
+        plan = json.loads(cached)
+        return {**plan, **{kind: {int(k): v for k, v in plan[kind].items()} for kind in ('stocks', 'options')}}
+    plan = build_plan(session)
+    client.set(_plan_key(session), json.dumps(plan), ex=settings.POLL_PLAN_TTL)
+    logger.info("Price polling plan rebuilt", extra={
+        "session": session, "stocks": len(plan['stocks']), "options": len(plan['options']),
+    })
+    return plan
+
+
+def _take_due(client, key: str, intervals: Dict[int, float], now: float) -> List[int]:
+    """
+    Returns the ids in `key` whose poll is due and pushes them one interval
+    out. Ids new to the plan get a random first slot within their interval so
+    a session open does not fire every poll at once; ids that left the plan
+    are dropped; ids scheduled further out than their new interval are pulled in.
+    """
+    scheduled = {int(member): score for member, score in client.zrange(key, 0, -1, withscores=True)}
+    due = [i for i, at in scheduled.items() if at <= now and i in intervals]
+    updates = {i: now + intervals[i] for i in due}
+    for i, interval in intervals.items():
+        if i not in scheduled:
+            updates[i] = now + random.uniform(0, interval)
+        elif scheduled[i] > now + interval:
+            updates[i] = now + interval
+    stale = [i for i in scheduled if i not in intervals]
+
+    pipe = client.pipeline()
+    if stale:
+        pipe.zrem(key, *stale)
+    if updates:
+        pipe.zadd(key, updates)
+    pipe.execute()
+    return due
+
+
+def take_due_polls(moment=None) -> Optional[dict]:
+    """
+    Stock ids and option-underlying ids to poll now, or None if another tick
+    is still running. Outside market hours the schedules are cleared so the
+    next session starts with a fresh, spread-out schedule.
+    """
+    client = get_redis_client()
+    if not client.set(TICK_LOCK_KEY, 1, nx=True, ex=60):
+        return None
+    try:
+        session = session_at(moment)
+        if session == CLOSED:
+            client.delete(STOCK_DUE_KEY, OPTION_DUE_KEY)
+            return {'session': session, 'stocks': [], 'options': []}
+        plan = get_plan(session)
+        now = time.time()
+        return {
+            'session': session,
+            'stocks': _take_due(client, STOCK_DUE_KEY, plan['stocks'], now),
+            'options': _take_due(client, OPTION_DUE_KEY, plan['options'], now),
+        }
+    finally:
+        client.delete(TICK_LOCK_KEY)
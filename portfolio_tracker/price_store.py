@@ -0,0 +1,156 @@
+# portfolio_tracker/price_store.py
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Stock, PriceBar
+
+
+def record_prices(model, prices: Iterable[Tuple[int, float]], timestamp: Optional[datetime] = None) -> int:
+    """
+    Appends one raw bar per (object_id, price) pair of `model` (Stock or
+    Option) with a single bulk INSERT. Returns the number of bars written.
+    """
+    timestamp = timestamp or timezone.now()
+    content_type = ContentType.objects.get_for_model(model)
+    bars = [
+        PriceBar(
+            content_type=content_type, object_id=object_id, interval=PriceBar.RAW, timestamp=timestamp,
+            open=float(price), high=float(price), low=float(price), close=float(price),
+        )
+        for object_id, price in prices
+    ]
+    PriceBar.objects.bulk_create(bars, batch_size=1000, ignore_conflicts=True)
+    return len(bars)
+
+
+def record_daily_closes(model, object_id: int, closes: Iterable[Tuple[date, float]]) -> int:
+    """
+    Stores provider daily closes of one instrument as daily bars stamped at
+    midnight UTC, like the ones roll_up_bars writes. Days that already have a
+    daily bar keep it. Returns the number of closes given.
+    """
+    content_type = ContentType.objects.get_for_model(model)
+    bars = [
+        PriceBar(
+            content_type=content_type, object_id=object_id, interval=PriceBar.DAILY,
+            timestamp=datetime.combine(day, time.min, tzinfo=dt_timezone.utc),
+            open=float(close), high=float(close), low=float(close), close=float(close),
+        )
+        for day, close in closes
+    ]
+    PriceBar.objects.bulk_create(bars, batch_size=1000, ignore_conflicts=True)
+    return len(bars)
+
+
+def price_series(model, object_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                 interval: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns (timestamps as datetime64[s], closes as float64) for one
+    instrument, oldest first, read straight from a values_list cursor
+    without building a model instance per row. `interval` restricts the read
+    to raw or daily bars; by default both are returned, which together cover
+    the whole retained history.
+    """
+    bars = PriceBar.objects.filter(content_type=ContentType.objects.get_for_model(model), object_id=object_id)
+    if interval:
+        bars = bars.filter(interval=interval)
+    if start:
+        bars = bars.filter(timestamp__gte=start)
+    if end:
+        bars = bars.filter(timestamp__lte=end)
+    rows = list(bars.order_by('timestamp').values_list('timestamp', 'close'))
+    timestamps = np.fromiter((ts.timestamp() for ts, _ in rows), dtype=np.int64, count=len(rows)).astype('datetime64[s]')
+    closes = np.fromiter((close for _, close in rows), dtype=np.float64, count=len(rows))
+    return timestamps, closes
+
+
+def stock_price_series(symbol: str, start: Optional[datetime] = None, end: Optional[datetime] = None):
+    """price_series() for a stock symbol; empty arrays if the symbol is unknown."""
+    stock_id = Stock.objects.filter(symbol=symbol.upper()).values_list('id', flat=True).first()
+    if stock_id is None:
+        return np.array([], dtype='datetime64[s]'), np.array([], dtype=np.float64)
+    return price_series(Stock, stock_id, start, end)
+
+
+# Daily bars written per INSERT while rolling up, which also bounds how many are held in memory.
+ROLL_UP_BATCH_SIZE = 1000
+
+
+def _write_daily_bars(bars) -> None:
+    """
+    Inserts rolled-up daily bars. A day that already has a daily bar (from
+    record_daily_closes, say) keeps its open and gains the rolled-up high,
+    low and close, so neither source's prices are lost.
+    """
+    existing = {
+        (bar.content_type_id, bar.object_id, bar.timestamp): bar
+        for bar in PriceBar.objects.filter(
+            interval=PriceBar.DAILY,
+            content_type_id__in={bar.content_type_id for bar in bars},
+            object_id__in={bar.object_id for bar in bars},
+            timestamp__gte=min(bar.timestamp for bar in bars),
+            timestamp__lte=max(bar.timestamp for bar in bars),
+        ).only('content_type_id', 'object_id', 'timestamp', 'high', 'low')
+    }
+    for bar in bars:
+        stored = existing.get((bar.content_type_id, bar.object_id, bar.timestamp))
+        if stored is not None:
+            bar.high = max(bar.high, stored.high)
+            bar.low = min(bar.low, stored.low)
+    PriceBar.objects.bulk_create(
+        bars, update_conflicts=True, unique_fields=['content_type', 'object_id', 'interval', 'timestamp'],
+        update_fields=['high', 'low', 'close'],
+    )
+
+
+@transaction.atomic
+def roll_up_bars(now: Optional[datetime] = None) -> dict:
+    """
+    Folds raw bars older than PRICE_BAR_RAW_RETENTION_DAYS into one daily OHLC
+    bar per instrument and day, merged into any daily bar already stored for
+    that day, deletes those raw bars, and drops daily bars older than
+    PRICE_BAR_DAILY_RETENTION_DAYS, all in one transaction. Raw rows are
+    streamed in (instrument, time) order and daily bars are written every
+    ROLL_UP_BATCH_SIZE, so memory stays flat.
+    """
+    now = now or timezone.now()
+    raw_cutoff = (now - timedelta(days=settings.PRICE_BAR_RAW_RETENTION_DAYS)).replace(
+        hour=0, minute=0, second=0, microsecond=0
+    )
+    old_raw = PriceBar.objects.filter(interval=PriceBar.RAW, timestamp__lt=raw_cutoff)
+
+    daily, current, written = [], None, 0
+    for ct, object_id, ts, price in old_raw.order_by('content_type_id', 'object_id', 'timestamp').values_list(
+        'content_type_id', 'object_id', 'timestamp', 'close'
+    ).iterator(chunk_size=5000):
+        day = ts.replace(hour=0, minute=0, second=0, microsecond=0)
+        if current is None or (current.content_type_id, current.object_id, current.timestamp) != (ct, object_id, day):
+            # Rows arrive in day order, so every bar before the current one is complete.
+            if len(daily) > ROLL_UP_BATCH_SIZE:
+                _write_daily_bars(daily[:-1])
+                written += len(daily) - 1
+                daily = daily[-1:]
+            current = PriceBar(
+                content_type_id=ct, object_id=object_id, interval=PriceBar.DAILY, timestamp=day,
+                open=price, high=price, low=price, close=price,
+            )
+            daily.append(current)
+        else:
+            current.high = max(current.high, price)
+            current.low = min(current.low, price)
+            current.close = price
+
+    if daily:
+        _write_daily_bars(daily)
+        written += len(daily)
+    raw_deleted, _ = old_raw.delete()
+    daily_deleted, _ = PriceBar.objects.filter(
+        interval=PriceBar.DAILY, timestamp__lt=now - timedelta(days=settings.PRICE_BAR_DAILY_RETENTION_DAYS)
+    ).delete()
+    return {'daily_created': written, 'raw_deleted': raw_deleted, 'daily_deleted': daily_deleted}
@@ -0,0 +1,122 @@
+# portfolio_tracker/quote_cache.py
+import json
+import time
+import uuid
+from typing import Optional, Union
+
+from django.conf import settings
+
+from .data_fetcher import fetch_stock_data_from_finnhub
+from .redis_client import get_redis_client
+
+STATS_KEY = "quote_cache:stats"
+
+# Deletes the lock only if we still own it, so a slow leader whose lock
+# expired cannot release a lock another worker has since taken.
+_RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class QuotePending(Exception):
+    """Another worker's fetch of the symbol is still in flight; retry after `retry_after` seconds."""
+
+    def __init__(self, symbol: str, retry_after: float):
+        super().__init__(f"Quote for {symbol} is still being fetched, retry after {retry_after:.2f}s")
+        self.retry_after = retry_after
+
+
+def _cache_key(symbol: str) -> str:
+    return f"quote_cache:{symbol}"
+
+
+def _lock_key(symbol: str) -> str:
+    return f"quote_cache:lock:{symbol}"
+
+
+def _read(client, symbol: str) -> Optional[dict]:
+    raw = client.get(_cache_key(symbol))
+    return json.loads(raw) if raw else None
+
+
+def get_quote(symbol: str, max_age: Optional[float] = None) -> Union[dict, None]:
+    """
+    Returns {"price", "previous_close"} for `symbol`, calling Finnhub at most
+    once per symbol across all workers.
+
+    A cached quote younger than `max_age` seconds (default QUOTE_CACHE_MAX_AGE)
+    is returned as is. Otherwise the first caller takes a per-symbol lock and
+    fetches; every other caller waits up to QUOTE_CACHE_FOLLOWER_WAIT seconds
+    for that result instead of calling the API again, then raises
+    QuotePending so a task can re-queue rather than hold its worker. Returns
+    None if the fetch failed.
+    """
+    symbol = symbol.upper()
+    if max_age is None:
+        max_age = settings.QUOTE_CACHE_MAX_AGE
+    client = get_redis_client()
+
+    cached = _read(client, symbol)
+    if cached and time.time() - cached['fetched_at'] <= max_age:
+        client.hincrby(STATS_KEY, 'hits', 1)
+        return {'price': cached['price'], 'previous_close': cached['previous_close']}
+
+    requested_at = time.time()
+    token = uuid.uuid4().hex
+    lock_ttl_ms = int(settings.QUOTE_CACHE_LOCK_TIMEOUT * 1000)
+    if client.set(_lock_key(symbol), token, nx=True, px=lock_ttl_ms):
+        client.hincrby(STATS_KEY, 'misses', 1)
+        try:
+            data = fetch_stock_data_from_finnhub(symbol)
+            if data:
+                client.set(
+                    _cache_key(symbol),
+                    json.dumps({**data, 'fetched_at': time.time()}),
+                    ex=settings.QUOTE_CACHE_TTL,
+                )
+            return data
+        finally:
+            client.eval(_RELEASE_LOCK_LUA, 1, _lock_key(symbol), token)
+
+    # Someone else is fetching: wait briefly for their result rather than spending quota.
+    client.hincrby(STATS_KEY, 'coalesced', 1)
+    deadline = time.monotonic() + settings.QUOTE_CACHE_FOLLOWER_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(settings.QUOTE_CACHE_POLL_INTERVAL)
+        cached = _read(client, symbol)
+        if cached and cached['fetched_at'] >= requested_at - max_age:
+            return {'price': cached['price'], 'previous_close': cached['previous_close']}
+        if not client.exists(_lock_key(symbol)):
+            # The leader may have stored its quote and released the lock since the read above.
+            cached = _read(client, symbol)
+            if cached and cached['fetched_at'] >= requested_at - max_age:
+                return {'price': cached['price'], 'previous_close': cached['previous_close']}
+            return None
+    raise QuotePending(symbol, settings.QUOTE_CACHE_FOLLOWER_WAIT)
+
+
+def store_quote(symbol: str, price: float, previous_close: float) -> None:
+    """
+    Caches a quote that arrived some other way (the option chain carries its
+    underlying's price), so get_quote serves it instead of calling /quote.
+    """
+    get_redis_client().set(
+        _cache_key(symbol.upper()),
+        json.dumps({'price': price, 'previous_close': previous_close, 'fetched_at': time.time()}),
+        ex=settings.QUOTE_CACHE_TTL,
+    )
+
+
+def get_stats() -> dict:
+    """Hit/miss counters since the stats key was last reset."""
+    raw = get_redis_client().hgetall(STATS_KEY)
+    stats = {'hits': 0, 'misses': 0, 'coalesced': 0}
+    stats.update({key.decode(): int(value) for key, value in raw.items()})
+    return stats
+
+
+def reset_stats() -> None:
+    get_redis_client().delete(STATS_KEY)
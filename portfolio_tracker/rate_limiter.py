@@ -0,0 +1,111 @@
+# portfolio_tracker/rate_limiter.py
+import time
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+
+from .metrics import PROVIDER_QUOTA_EXHAUSTED
+from .redis_client import get_redis_client
+
+# Atomically refills every bucket in KEYS and takes `requested` tokens from all
+# of them, or none. Returns 0 on success, otherwise the number of milliseconds
+# until the most constrained bucket can satisfy the request.
+# ARGV: requested, capacity_1, period_ms_1, capacity_2, period_ms_2, ...
+_TOKEN_BUCKET_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local requested = tonumber(ARGV[1])
+local wait = 0
+local tokens = {}
+local periods = {}
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[2 * i])
+    local period = tonumber(ARGV[2 * i + 1])
+    local rate = capacity / period
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local level = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now
+    level = math.min(capacity, level + math.max(0, now - ts) * rate)
+    tokens[i] = level
+    periods[i] = period
+    if level < requested then
+        wait = math.max(wait, math.ceil((requested - level) / rate))
+    end
+end
+if wait > 0 then
+    return wait
+end
+for i, key in ipairs(KEYS) do
+    redis.call('HSET', key, 'tokens', tostring(tokens[i] - requested), 'ts', now)
+    redis.call('PEXPIRE', key, periods[i] * 2)
+end
+return 0
+"""
+
+
+class RateLimitTimeout(Exception):
+    """
+    Raised when tokens could not be acquired within the allowed wait, and by
+    http_client when the provider answers 429 despite the limiter.
+    """
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Rate limit '{name}' exhausted, retry after {retry_after:.2f}s")
+        self.retry_after = retry_after
+
+
+class TokenBucketRateLimiter:
+    """
+    Token bucket shared by every process through Redis.
+
+    `limits` is a list of (capacity, period_seconds) pairs, e.g. 30 per second
+    and 60 per minute. A call only succeeds when every bucket has a token, so
+    the tightest quota always wins.
+    """
+
+    def __init__(self, name: str, limits: List[Tuple[int, float]]):
+        self.name = name
+        self.limits = limits
+        # The hash tag keeps all buckets in one slot so the script also runs on Redis Cluster.
+        self.keys = [f"ratelimit:{{{name}}}:{capacity}/{period}s" for capacity, period in limits]
+        self._script = None
+
+    def _get_script(self):
+        if self._script is None:
+            self._script = get_redis_client().register_script(_TOKEN_BUCKET_LUA)
+        return self._script
+
+    def try_acquire(self, tokens: int = 1) -> float:
+        """
+        Takes `tokens` from every bucket if possible. Returns 0 on success,
+        otherwise the number of seconds to wait before trying again.
+        """
+        args = [tokens]
+        for capacity, period in self.limits:
+            args.extend([capacity, int(period * 1000)])
+        wait_ms = self._get_script()(keys=self.keys, args=args)
+        return int(wait_ms) / 1000.0
+
+    def acquire(self, tokens: int = 1, timeout: Optional[float] = None) -> None:
+        """
+        Blocks until `tokens` are available. Raises RateLimitTimeout if that
+        would take longer than `timeout` seconds.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0:
+                return
+            if deadline is not None and time.monotonic() + wait > deadline:
+                PROVIDER_QUOTA_EXHAUSTED.inc(provider=self.name, reason='rate_limiter')
+                raise RateLimitTimeout(self.name, wait)
+            time.sleep(wait)
+
+
+finnhub_rate_limiter = TokenBucketRateLimiter(
+    'finnhub',
+    [
+        (settings.FINNHUB_RATE_LIMIT_PER_SECOND, 1),
+        (settings.FINNHUB_RATE_LIMIT_PER_MINUTE, 60),
+    ],
+)
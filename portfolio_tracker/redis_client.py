@@ -0,0 +1,22 @@
+# portfolio_tracker/redis_client.py
+import uuid
+
+import redis
+from django.conf import settings
+
+# Names this process's entries in keys every process writes its own copy of
+PROCESS_ID = uuid.uuid4().hex
+
+_client = None
+
+
+def get_redis_client() -> redis.Redis:
+    """
+    Returns a per-process Redis client shared by the rate limiter, caches and
+    other cluster-wide coordination helpers. The underlying connection pool is
+    created lazily so importing this module never opens a socket.
+    """
+    global _client
+    if _client is None:
+        _client = redis.Redis(host=settings.REDIS_HOST, port=int(settings.REDIS_PORT), db=0)
+    return _client
@@ -0,0 +1,128 @@
+# portfolio_tracker/replay.py
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Sum
+
+from . import ledger
+from .models import Stock, Option, Holding, Transaction, RealizedGain, ReplayCheckpoint
+
+
+def invalidate_checkpoints(since: datetime) -> int:
+    """Drops checkpoints whose state would include a transaction dated `since` or later."""
+    deleted, _ = ReplayCheckpoint.objects.filter(as_of__gt=since).delete()
+    return deleted
+
+
+def _instrument_names(keys) -> dict:
+    content_types = ContentType.objects.get_for_models(Stock, Option)
+    stock_ct, option_ct = content_types[Stock].id, content_types[Option].id
+    names = {}
+    stock_ids = [object_id for ct, object_id in keys if ct == stock_ct]
+    option_ids = [object_id for ct, object_id in keys if ct == option_ct]
+    for pk, symbol in Stock.objects.filter(id__in=stock_ids).values_list('id', 'symbol'):
+        names[(stock_ct, pk)] = symbol
+    for pk, symbol, expiration, strike, option_type in Option.objects.filter(id__in=option_ids).values_list(
+        'id', 'underlying_stock__symbol', 'expiration_date', 'strike_price', 'option_type'
+    ):
+        names[(option_ct, pk)] = Option.format_name(symbol, expiration, strike, option_type)
+    return names
+
+
+@transaction.atomic
+def replay_transactions(since: Optional[datetime] = None) -> dict:
+    """
+    Rebuilds Holding and RealizedGain from the Transaction log in one pass.
+
+    Resumes from the newest checkpoint dated at or before `since` (the earliest
+    edited transaction), or from the beginning when `since` is None. Rows are
+    streamed in (date, id) order through a server-side cursor, folded into
+    quantity / average cost / realized P&L in memory, and swapped in inside
+    this transaction while the ledger lock keeps new fills out. A checkpoint is
+    saved every REPLAY_CHECKPOINT_INTERVAL transactions.
+    """
+    ledger.lock_totals()
+
+    checkpoint = None
+    # Resuming replaces only the gains of replayed sells, so every gain must name its sell. Gains
+    # recorded before that link existed, or entered by hand, force one full replay, which links them.
+    if since is not None and not RealizedGain.objects.filter(transaction__isnull=True).exists():
+        invalidate_checkpoints(since)
+        checkpoint = ReplayCheckpoint.objects.filter(as_of__lte=since).order_by('-as_of').first()
+    else:
+        ReplayCheckpoint.objects.all().delete()
+
+    positions = {}
+    count = 0
+    transactions = Transaction.objects.order_by('date', 'id')
+    if checkpoint is not None:
+        for ct, object_id, quantity, cost_basis in checkpoint.positions:
+            positions[(ct, object_id)] = [Decimal(quantity), Decimal(cost_basis)]
+        count = checkpoint.transaction_count
+        transactions = transactions.filter(date__gte=checkpoint.as_of)
+
+    interval = settings.REPLAY_CHECKPOINT_INTERVAL
+    gains, checkpoints = [], []
+    # Resuming exactly at a checkpoint must not save that checkpoint again.
+    last_date = checkpoint.as_of if checkpoint is not None else None
+    for transaction_id, ct, object_id, transaction_type, quantity, price, date in transactions.values_list(
+        'id', 'content_type_id', 'object_id', 'transaction_type', 'quantity', 'price', 'date'
+    ).iterator(chunk_size=2000):
+        # Only checkpoint on a timestamp boundary, so "everything before as_of" is exact.
+        if count and count % interval == 0 and date != last_date:
+            checkpoints.append(ReplayCheckpoint(
+                as_of=date,
+                transaction_count=count,
+                positions=[[k[0], k[1], str(q), str(c)] for k, (q, c) in positions.items()],
+            ))
+        count += 1
+        last_date = date
+
+        key = (ct, object_id)
+        held_quantity, cost_basis = positions.get(key, (Decimal('0'), Decimal('0')))
+        if transaction_type == 'buy':
+            new_quantity = held_quantity + quantity
+            if new_quantity > 0:
+                positions[key] = [new_quantity, ledger.average_cost(held_quantity, cost_basis, quantity, price)]
+        else:
+            gains.append((key, ledger.realized_gain(quantity, price, cost_basis), date, transaction_id))
+            held_quantity -= quantity
+            if held_quantity > 0:
+                positions[key] = [held_quantity, cost_basis]
+            else:
+                positions.pop(key, None)
+
+    # Swap the derived state in.
+    stale_gains = RealizedGain.objects.all()
+    if checkpoint is not None:
+        # Same boundary as the replayed transactions, whatever date a gain itself carries.
+        stale_gains = stale_gains.filter(transaction__date__gte=checkpoint.as_of)
+    removed_pnl = stale_gains.aggregate(total=Sum('realized_pnl'))['total'] or Decimal('0')
+    stale_gains.delete()
+    names = _instrument_names({key for key, _, _, _ in gains})
+    RealizedGain.objects.bulk_create([
+        RealizedGain(instrument_name=names.get(key, ''), realized_pnl=pnl, date=date, transaction_id=transaction_id)
+        for key, pnl, date, transaction_id in gains
+    ])
+    added_pnl = sum((pnl for _, pnl, _, _ in gains), Decimal('0'))
+    ledger.record_realized_gain(added_pnl - removed_pnl)
+
+    Holding.objects.all().delete()
+    Holding.objects.bulk_create([
+        Holding(content_type_id=ct, object_id=object_id, quantity=quantity, cost_basis=cost_basis)
+        for (ct, object_id), (quantity, cost_basis) in positions.items()
+    ])
+    ReplayCheckpoint.objects.bulk_create(checkpoints)
+
+    return {
+        'resumed_from': checkpoint.as_of.isoformat() if checkpoint else None,
+        'transactions': count,
+        'replayed': count - (checkpoint.transaction_count if checkpoint else 0),
+        'holdings': len(positions),
+        'realized_gains': len(gains),
+        'checkpoints_saved': len(checkpoints),
+    }
@@ -0,0 +1,366 @@
+# portfolio_tracker/risk.py
+"""
+Historical risk of the current holdings.
+
+Every held stock and every held option's underlying is a risk factor. A
+RiskModel holds their aligned daily returns over RISK_LOOKBACK_DAYS, plus the
+benchmark's, and the covariance matrix of all of them. Returns come from the
+stored PriceBars (the benchmark's from its candles), carried forward over
+missing days. The model is built once per day (refresh_risk_model) and shared
+through Redis; a factor that shows up later is appended as extra columns
+instead of rebuilding the rest.
+
+Positions map onto the factors as dollar exposures: a stock is its market
+value, an option its delta-dollars (see greeks.py). With the exposure vector
+w everything is a matrix product:
+    parametric VaR   z * sqrt(w' C w)
+    historical VaR   loss quantile of the scenario P&L R w
+    beta             w' C[:, benchmark] / var(benchmark) over the net market value,
+                     None while the benchmark has no variance to measure against
+    max drawdown     of the value path the current exposures would have taken
+RiskReport keeps C w and R w, so a what-if change to one position is an
+O(factors + days) update rather than a new product.
+"""
+import io
+import logging
+from datetime import date, timedelta
+from statistics import NormalDist
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
+from redis import RedisError
+
+from .greeks import portfolio_greeks
+from .history import day_bounds, forward_fill
+from .market_calendar import is_trading_day
+from .models import Stock, BenchmarkCandle, PriceBar
+from .redis_client import get_redis_client
+from .valuation import to_list, value_holdings
+
+logger = logging.getLogger(__name__)
+
+_NORMAL = NormalDist()
+
+# The last model this process loaded or built
+_model = None
+
+
+def _model_key(day: date) -> str:
+    return f"risk_model:{day.isoformat()}"
+
+
+def _trading_days(day: date) -> List[date]:
+    start = day - timedelta(days=settings.RISK_LOOKBACK_DAYS)
+    return [d for d in (start + timedelta(days=i) for i in range((day - start).days + 1)) if is_trading_day(d)]
+
+
+def _load_returns(stock_ids: List[int], days: List[date], benchmark: Optional[str]) -> Tuple[np.ndarray, List[str]]:
+    """
+    Daily simple returns on `days` for each of `stock_ids`, plus the
+    benchmark as the last column, and the stocks' symbols. Three queries:
+    price bars, symbols and the benchmark's candles. NaN until an instrument's first price.
+    """
+    row = {d: i for i, d in enumerate(days)}
+    column = {stock_id: j for j, stock_id in enumerate(stock_ids)}
+    closes = np.full((len(days), len(stock_ids) + 1), np.nan)
+
+    since, until = day_bounds(days[0], days[-1])
+    bars = PriceBar.objects.filter(
+        content_type=ContentType.objects.get_for_model(Stock), object_id__in=stock_ids,
+        timestamp__gte=since, timestamp__lt=until,
+    ).order_by('timestamp').values_list('object_id', 'timestamp', 'close')
+    # Last bar of each day wins, raw or rolled up.
+    for object_id, timestamp, close in bars.iterator(chunk_size=5000):
+        i = row.get(timezone.localtime(timestamp).date())
+        if i is not None:
+            closes[i, column[object_id]] = close
+
+    symbols = dict(Stock.objects.filter(id__in=stock_ids).values_list('id', 'symbol'))
+    if benchmark:
+        candles = BenchmarkCandle.objects.filter(
+            symbol=benchmark, date__gte=days[0], date__lte=days[-1],
+        ).values_list('date', 'close')
+        for candle_date, close in candles:
+            i = row.get(candle_date)
+            if i is not None:
+                closes[i, -1] = float(close)
+
+    closes = forward_fill(closes)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = closes[1:] / closes[:-1] - 1
+    returns[~np.isfinite(returns)] = np.nan
+    return returns, [symbols.get(stock_id, '') for stock_id in stock_ids]
+
+
+def pairwise_covariance(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Pairwise-complete sample covariance of every column of `a` with every
+    column of `b`: each pair uses the days on which both have a return, all
+    through matrix products. Pairs with fewer than RISK_MIN_OBSERVATIONS
+    common days are NaN.
+    """
+    mask_a, mask_b = np.isfinite(a).astype(float), np.isfinite(b).astype(float)
+    x_a, x_b = np.nan_to_num(a), np.nan_to_num(b)
+    n = mask_a.T @ mask_b
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = (x_a.T @ x_b - (x_a.T @ mask_b) * (mask_a.T @ x_b) / n) / (n - 1)
+    cov[n < settings.RISK_MIN_OBSERVATIONS] = np.nan
+    return cov
+
+
+class RiskModel:
+    """
+    Aligned daily returns of a set of stocks and the benchmark over the
+    lookback window ending on `day`, and their covariance. Column j of
+    `returns` is stock_ids[j]; the benchmark is the last row and column of
+    `covariance`.
+    """
+
+    def __init__(self, day: date, days: List[date], stock_ids: List[int], symbols: List[str],
+                 returns: np.ndarray, benchmark_returns: np.ndarray, covariance: Optional[np.ndarray] = None):
+        self.day = day
+        self.days = days
+        self.stock_ids = list(stock_ids)
+        self.symbols = list(symbols)
+        self.column = {stock_id: j for j, stock_id in enumerate(self.stock_ids)}
+        self.returns = returns
+        self.benchmark_returns = benchmark_returns
+        if covariance is None:
+            factors = self.factors
+            covariance = pairwise_covariance(factors, factors)
+        self.covariance = covariance
+
+    @property
+    def factors(self) -> np.ndarray:
+        return np.column_stack([self.returns, self.benchmark_returns])
+
+    @classmethod
+    def build(cls, stock_ids: List[int], day: Optional[date] = None) -> 'RiskModel':
+        day = day or timezone.localdate()
+        days = _trading_days(day)
+        returns, symbols = _load_returns(list(stock_ids), days, settings.RISK_BENCHMARK_SYMBOL)
+        return cls(day, days, stock_ids, symbols, returns[:, :-1], returns[:, -1])
+
+    def extend(self, stock_ids: List[int]) -> 'RiskModel':
+        """
+        A model with `stock_ids` appended. Only the new columns' returns are
+        loaded and only their covariances with every factor are computed; the
+        existing block is reused as is.
+        """
+        new, symbols = _load_returns(list(stock_ids), self.days, None)
+        new = new[:, :-1]
+        k, n = len(stock_ids), len(self.stock_ids)
+        cross = pairwise_covariance(np.column_stack([self.factors, new]), new)
+        # Assemble in [old stocks, benchmark, new stocks] order, then move the benchmark last.
+        full = np.block([[self.covariance, cross[:n + 1]], [cross[:n + 1].T, cross[n + 1:]]])
+        order = list(range(n)) + list(range(n + 1, n + 1 + k)) + [n]
+        return RiskModel(
+            self.day, self.days, self.stock_ids + list(stock_ids), self.symbols + symbols,
+            np.column_stack([self.returns, new]), self.benchmark_returns, full[np.ix_(order, order)],
+        )
+
+    def to_bytes(self) -> bytes:
+        buffer = io.BytesIO()
+        np.savez(
+            buffer, day=self.day.toordinal(), days=np.array([d.toordinal() for d in self.days]),
+            stock_ids=np.array(self.stock_ids, dtype=np.int64), symbols=np.array(self.symbols, dtype=str),
+            returns=self.returns, benchmark_returns=self.benchmark_returns, covariance=self.covariance,
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, raw: bytes) -> 'RiskModel':
+        data = np.load(io.BytesIO(raw), allow_pickle=False)
+        return cls(
+            date.fromordinal(int(data['day'])), [date.fromordinal(int(d)) for d in data['days']],
+            data['stock_ids'].tolist(), data['symbols'].tolist(),
+            data['returns'], data['benchmark_returns'], data['covariance'],
+        )
+
+
+def _read_model(day: date) -> Optional[RiskModel]:
+    try:
+        raw = get_redis_client().get(_model_key(day))
+    except RedisError as e:
+        logger.warning("Risk model cache unavailable", extra={"error": str(e)})
+        return None
+    return RiskModel.from_bytes(raw) if raw else None
+
+
+def _store_model(model: RiskModel) -> None:
+    try:
+        get_redis_client().set(_model_key(model.day), model.to_bytes(), ex=settings.RISK_MODEL_TTL)
+    except RedisError as e:
+        logger.warning("Risk model cache unavailable", extra={"error": str(e)})
+
+
+def get_model(stock_ids: List[int], rebuild: bool = False) -> RiskModel:
+    """
+    Today's model covering at least `stock_ids`: this process's copy, else
+    the shared one in Redis, else built now. Missing stocks are appended.
+    """
+    global _model
+    day = timezone.localdate()
+    model = None
+    if not rebuild:
+        model = _model if _model is not None and _model.day == day else _read_model(day)
+    if model is None:
+        model = RiskModel.build(sorted(set(stock_ids)), day)
+        logger.info("Risk model built", extra={"factors": len(model.stock_ids), "days": len(model.days)})
+        _store_model(model)
+    missing = sorted(set(stock_ids) - set(model.column))
+    if missing:
+        model = model.extend(missing)
+        _store_model(model)
+    _model = model
+    return model
+
+
+def current_exposures() -> Tuple[Dict[int, float], float, int]:
+    """
+    Dollar exposure per stock id: held shares at market value plus held
+    options' delta-dollars. Also the net market value of all holdings, and
+    the number of options left out because their delta could not be solved.
+    """
+    valuation = value_holdings()
+    exposure = {}
+    for position, value in zip(valuation.positions, valuation.market_value.tolist()):
+        if position['instrument_type'] == 'stock':
+            exposure[position['object_id']] = exposure.get(position['object_id'], 0.0) + value
+    unmapped = 0
+    for position in portfolio_greeks()['positions']:
+        if position['delta_dollars'] is None:
+            unmapped += 1
+            continue
+        stock_id = position['underlying_stock']
+        exposure[stock_id] = exposure.get(stock_id, 0.0) + position['delta_dollars']
+    return exposure, valuation.total_market_value, unmapped
+
+
+class RiskReport:
+    """Risk of one exposure vector against a RiskModel."""
+
+    def __init__(self, model: RiskModel, exposure: Dict[int, float], market_value: float, horizon_days: int = 1):
+        self.model = model
+        self.stock_ids = sorted(exposure)
+        self.index = np.array([model.column[stock_id] for stock_id in self.stock_ids], dtype=int)
+        self.exposure = np.array([exposure[stock_id] for stock_id in self.stock_ids], dtype=float)
+        self.market_value = market_value
+        self.horizon_days = horizon_days
+
+        covariance = np.nan_to_num(model.covariance[np.ix_(self.index, self.index)])
+        self.covariance_exposure = covariance @ self.exposure
+        self.variance = float(self.exposure @ self.covariance_exposure)
+        self.scenarios = np.nan_to_num(model.returns[:, self.index]) @ self.exposure
+        self.benchmark_variance = float(model.covariance[-1, -1])
+        # Without benchmark history there is no beta, rather than a beta of 0 for everything.
+        self.has_beta = bool(np.isfinite(self.benchmark_variance) and self.benchmark_variance > 0)
+        if self.has_beta:
+            self.betas = np.nan_to_num(model.covariance[self.index, -1] / self.benchmark_variance)
+            self.dollar_beta = float(self.betas @ self.exposure)
+        else:
+            self.betas, self.dollar_beta = None, None
+
+    def figures(self, variance: float, scenarios: np.ndarray, dollar_beta: Optional[float],
+                market_value: float) -> dict:
+        scale = np.sqrt(self.horizon_days)
+        sigma = float(np.sqrt(max(variance, 0.0)) * scale)
+        losses = -scenarios * scale
+        levels = []
+        for confidence in settings.RISK_CONFIDENCE_LEVELS:
+            z = _NORMAL.inv_cdf(confidence)
+            historical_var = float(np.quantile(losses, confidence)) if len(losses) else None
+            levels.append({
+                'confidence': confidence,
+                'parametric_var': z * sigma,
+                'parametric_cvar': sigma * _NORMAL.pdf(z) / (1 - confidence),
+                'historical_var': historical_var,
+                'historical_cvar': float(losses[losses >= historical_var].mean()) if len(losses) else None,
+            })
+
+        drawdown = drawdown_dollars = None
+        if market_value > 0 and len(scenarios):
+            # Daily P&L of the current exposures, held constant, replayed over the window.
+            path = market_value + np.concatenate([[0.0], np.cumsum(scenarios)])
+            peaks = np.maximum.accumulate(path)
+            trough = int(np.argmax(peaks - path))
+            drawdown_dollars = float(peaks[trough] - path[trough])
+            drawdown = drawdown_dollars / float(peaks[trough])
+        return {
+            'market_value': market_value,
+            'volatility': sigma,
+            'var': levels,
+            'dollar_beta': dollar_beta,
+            'beta': dollar_beta / market_value if market_value and dollar_beta is not None else None,
+            'max_drawdown': drawdown,
+            'max_drawdown_dollars': drawdown_dollars,
+        }
+
+    def summary(self) -> dict:
+        variances = np.diag(self.model.covariance)[self.index]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            contribution = self.exposure * self.covariance_exposure / self.variance
+        factors = [
+            {
+                'stock_id': stock_id,
+                'symbol': self.model.symbols[self.model.column[stock_id]],
+                'exposure': exposure,
+                'daily_volatility': volatility,
+                'beta': beta,
+                'variance_contribution': share,
+            }
+            for stock_id, exposure, volatility, beta, share in zip(
+                self.stock_ids, self.exposure.tolist(), to_list(np.sqrt(variances)),
+                self.betas.tolist() if self.has_beta else [None] * len(self.stock_ids), to_list(contribution),
+            )
+        ]
+        return {
+            **self.figures(self.variance, self.scenarios, self.dollar_beta, self.market_value),
+            'gross_exposure': float(np.abs(self.exposure).sum()),
+            'factors': factors,
+            'insufficient_history': [f['symbol'] for f in factors if f['daily_volatility'] is None],
+        }
+
+    def what_if(self, stock_id: int, change: float) -> dict:
+        """
+        Figures after adding `change` dollars of exposure to `stock_id`
+        (negative to reduce it), from the kept C w and R w: the variance gains
+        2 x change x C[j] . w + change^2 x C[j, j] and every scenario gains
+        change x R[:, j]. `stock_id` must be in the model.
+        """
+        j = self.model.column[stock_id]
+        column = np.nan_to_num(self.model.covariance[self.index, j])
+        variance = self.variance + 2 * change * float(column @ self.exposure) \
+            + change * change * float(np.nan_to_num(self.model.covariance[j, j]))
+        scenarios = self.scenarios + change * np.nan_to_num(self.model.returns[:, j])
+        dollar_beta = None
+        if self.has_beta:
+            beta = float(np.nan_to_num(self.model.covariance[j, -1] / self.benchmark_variance))
+            dollar_beta = self.dollar_beta + change * beta
+        return self.figures(variance, scenarios, dollar_beta, self.market_value + change)
+
+
+def portfolio_risk(horizon_days: int = 1, what_if: Optional[Tuple[int, float]] = None) -> dict:
+    """
+    Risk report for the current holdings over `horizon_days` (square-root-of-
+    time scaling). `what_if` = (stock id, dollar change) adds the figures
+    after that one change.
+    """
+    exposure, market_value, unmapped = current_exposures()
+    model = get_model(list(exposure) + ([what_if[0]] if what_if else []))
+    report = RiskReport(model, exposure, market_value, horizon_days)
+    result = {
+        'as_of': timezone.now().isoformat(),
+        'model_date': model.day.isoformat(),
+        'observations': len(model.benchmark_returns),
+        'benchmark': settings.RISK_BENCHMARK_SYMBOL,
+        'horizon_days': horizon_days,
+        **report.summary(),
+        'unmapped_options': unmapped,
+    }
+    if what_if:
+        result['what_if'] = {'stock_id': what_if[0], 'change': what_if[1], **report.what_if(*what_if)}
+    return result
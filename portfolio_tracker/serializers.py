@@ -1,6 +1,7 @@
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers
 from .models import (
-    PortfolioSnapshot, Stock, Option, Holding, Deposit, Transaction, RealizedGain
+    PortfolioSnapshot, Stock, Option, Holding, Deposit, Transaction, RealizedGain, AllocationTarget
 )
 
 class StockSerializer(serializers.ModelSerializer):
@@ -18,11 +19,24 @@ class OptionSerializer(serializers.ModelSerializer):
             'underlying_stock', 'strike_price', 'expiration_date', 'option_type'
         ]
 
+class HoldingListSerializer(serializers.ListSerializer):
+    """
+    Resolves every holding's GenericForeignKey (one query per content type) and
+    the underlying stocks of option holdings before serializing, so
+    instrument_name does not cost a query per row.
+    """
+    def to_representation(self, data):
+        holdings = list(data.all() if hasattr(data, 'all') else data)
+        prefetch_related_objects(holdings, 'instrument')
+        prefetch_related_objects([h.instrument for h in holdings if isinstance(h.instrument, Option)], 'underlying_stock')
+        return super().to_representation(holdings)
+
 class HoldingSerializer(serializers.ModelSerializer):
     instrument_name = serializers.StringRelatedField(source='instrument', read_only=True)
     class Meta:
         model = Holding
         fields = ['id', 'instrument_name', 'quantity', 'cost_basis']
+        list_serializer_class = HoldingListSerializer
 
 class PortfolioSnapshotSerializer(serializers.ModelSerializer):
     value = serializers.DecimalField(max_digits=15, decimal_places=4, source='total_value')
@@ -57,3 +71,39 @@ class RealizedGainSerializer(serializers.ModelSerializer):
         model = RealizedGain
         fields = '__all__'
 
+class AllocationTargetSerializer(serializers.ModelSerializer):
+    # Defaults to the stock named `name`, for single-stock targets
+    symbols = serializers.SlugRelatedField(
+        source='stocks', slug_field='symbol', many=True, queryset=Stock.objects.all(), required=False,
+    )
+
+    class Meta:
+        model = AllocationTarget
+        fields = ['id', 'name', 'weight', 'symbols']
+
+    def validate_weight(self, value):
+        if not 0 <= value <= 1:
+            raise serializers.ValidationError("Weight is a fraction between 0 and 1.")
+        return value
+
+    def validate(self, attrs):
+        name = attrs.get('name', getattr(self.instance, 'name', ''))
+        if 'stocks' not in attrs and self.instance is None:
+            stock = Stock.objects.filter(symbol=name.upper()).first()
+            if stock is None:
+                raise serializers.ValidationError({'symbols': f"No stock {name}; list the bucket's symbols."})
+            attrs['stocks'] = [stock]
+        if 'stocks' in attrs and not attrs['stocks']:
+            raise serializers.ValidationError({'symbols': "A target needs at least one stock."})
+
+        others = AllocationTarget.objects.exclude(pk=getattr(self.instance, 'pk', None))
+        if 'stocks' in attrs:
+            taken = AllocationTarget.stocks.through.objects.filter(stock__in=attrs['stocks']).exclude(
+                allocationtarget_id=getattr(self.instance, 'pk', None)
+            ).values_list('allocationtarget__name', 'stock__symbol')
+            if taken:
+                raise serializers.ValidationError({'symbols': [f"{symbol} already belongs to {target}." for target, symbol in taken]})
+        weight = attrs.get('weight', getattr(self.instance, 'weight', 0))
+        if sum(others.values_list('weight', flat=True)) + weight > 1:
+            raise serializers.ValidationError({'weight': "Target weights add up to more than 1."})
+        return attrs
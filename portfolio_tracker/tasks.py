@@ -1,142 +1,271 @@
 # portfolio_tracker/tasks.py
-from datetime import date
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+import logging
 import time
 from celery import shared_task
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
-from .models import Stock, Option, Holding, PortfolioSnapshot
-from .data_fetcher import fetch_stock_data_from_finnhub, fetch_option_chain_from_finnhub_requests
+from django.conf import settings
+from django.db.models import F, Max, Min
+from django.utils import timezone
+from .models import Stock, Option, PortfolioSnapshot, BenchmarkCandle
+from .broadcast import queue_price_update, flush_price_updates
+from .data_fetcher import fetch_option_chain_from_finnhub_requests, fetch_benchmark_candles_from_alpha_vantage
+from .polling import take_due_polls
+from .price_store import record_prices, roll_up_bars
+from .quote_cache import QuotePending, get_quote, store_quote
+from .rate_limiter import RateLimitTimeout
+from .replay import replay_transactions
+from .risk import current_exposures, get_model
+from .valuation import value_holdings
 
+logger = logging.getLogger(__name__)
 
-@shared_task
-def update_stock_price(stock_id: int):
+PRICE_QUANTUM = Decimal('0.0001')
+
+
+@shared_task(bind=True)
+def update_stock_price(self, stock_id: int, max_age: float = None):
     """
     [Worker Task]
     Updates a single stock's price and previous close, then broadcasts the change.
+    Quotes come from the shared quote cache; `max_age` overrides how old a
+    cached quote may be (default QUOTE_CACHE_MAX_AGE).
+    If the shared Finnhub quota is exhausted, or another worker is still
+    fetching the same quote, the task re-queues itself instead of holding the
+    worker.
     """
     try:
         stock = Stock.objects.get(id=stock_id)
-        data = fetch_stock_data_from_finnhub(stock.symbol)
+        data = get_quote(stock.symbol, max_age=max_age)
 
         if data:
-            new_price = data['price']
-            new_previous_close = data['previous_close']
+            # Quantized like the stored columns, so an unchanged float quote compares equal.
+            new_price = _to_price(data['price'])
+            new_previous_close = _to_price(data['previous_close'])
             
             if stock.last_price != new_price or stock.previous_close != new_previous_close:
                 stock.last_price = new_price
                 stock.previous_close = new_previous_close
                 stock.save()
-                print(f"✅ STOCK UPDATE: {stock.symbol} to {new_price}.")
-
-                channel_layer = get_channel_layer()
-                async_to_sync(channel_layer.group_send)(
-                    "price_updates",
-                    {
-                        "type": "price.update",
-                        "data": { "symbol": stock.symbol, "price": float(new_price) },
-                    },
-                )
+                record_prices(Stock, [(stock.id, new_price)])
+                logger.info("Stock price updated", extra={"symbol": stock.symbol, "price": float(new_price)})
+
+                if queue_price_update(stock.symbol, float(new_price)):
+                    flush_price_broadcasts.apply_async(countdown=settings.PRICE_BROADCAST_WINDOW)
     except Stock.DoesNotExist:
-        print(f"❌ ERROR: Stock with id {stock_id} not found.")
-    except Exception as e:
-        print(f"❌ ERROR updating stock id {stock_id}: {e}")
+        logger.error("Stock not found", extra={"stock_id": stock_id})
+    except (RateLimitTimeout, QuotePending) as e:
+        raise self.retry(countdown=e.retry_after, max_retries=None)
+    except Exception:
+        logger.exception("Stock price update failed", extra={"stock_id": stock_id})
+
+@shared_task
+def flush_price_broadcasts():
+    """
+    [Worker Task]
+    Publishes every price change queued during the last broadcast window as one
+    "price.batch" WebSocket message. The PriceBar history is written where the
+    price is stored, not here.
+    """
+    return len(flush_price_updates())
 
 @shared_task
 def sync_all_stock_prices():
     """
     [Manager Task]
     Dispatches update tasks for all stocks in the database.
+    Everything is enqueued at once; the workers pace themselves through the
+    shared Finnhub rate limiter.
     """
-    print("🚀 Dispatching tasks to sync all stock prices...")
-    for stock in Stock.objects.all():
-        update_stock_price.delay(stock.id)
-        time.sleep(1) 
-    print("✅ All stock update tasks dispatched.")
+    dispatched = 0
+    for stock_id in Stock.objects.values_list('id', flat=True):
+        update_stock_price.delay(stock_id)
+        dispatched += 1
+    logger.info("Stock update tasks dispatched", extra={"count": dispatched})
+
+@shared_task
+def schedule_price_polls():
+    """
+    [Manager Task]
+    Run every few seconds by beat (see the configure_price_polling command).
+    Dispatches price updates only for instruments whose adaptive poll interval
+    has elapsed (see portfolio_tracker/polling.py), and nothing while the US
+    market is closed.
+    """
+    due = take_due_polls()
+    if due is None:
+        return {'skipped': 'previous tick still running'}
+    # The chain fetch refreshes the underlying's price as well.
+    chain_due = set(due['options'])
+    for stock_id in due['stocks']:
+        if stock_id not in chain_due:
+            update_stock_price.delay(stock_id)
+    for stock_id in due['options']:
+        update_option_prices_for_stock.delay(stock_id)
+    return {'session': due['session'], 'stocks': len(due['stocks']), 'options': len(due['options'])}
 
 # (Other tasks remain the same)
 
-@shared_task
-def update_option_prices_for_stock(stock_id: int):
+def _to_price(value) -> Decimal:
+    """Normalises a provider float to the 4-decimal precision of our price fields."""
+    return Decimal(str(value)).quantize(PRICE_QUANTUM)
+
+
+def _update_underlying_from_chain(stock: Stock, chain: dict, now) -> bool:
+    """
+    Applies the underlying's lastTradePrice from an option chain payload and
+    caches it as the stock's quote, so the next update_stock_price for it is
+    served without another /quote call. The chain has no previous close, so
+    the stored one is kept; without one there is nothing to cache.
+    """
+    price = chain.get('lastTradePrice')
+    if not price:
+        return False
+    price = _to_price(price)
+    if stock.previous_close is not None:
+        store_quote(stock.symbol, float(price), float(stock.previous_close))
+    if stock.last_price == price:
+        return False
+    stock.last_price = price
+    stock.updated_at = now
+    stock.save(update_fields=['last_price', 'updated_at'])
+    record_prices(Stock, [(stock.id, price)], now)
+    if queue_price_update(stock.symbol, float(price)):
+        flush_price_broadcasts.apply_async(countdown=settings.PRICE_BROADCAST_WINDOW)
+    return True
+
+
+@shared_task(bind=True)
+def update_option_prices_for_stock(self, stock_id: int):
     """
     [Worker Task]
-    Fetches the entire option chain and updates only the last_price for contracts.
+    Updates last_price for the tracked contracts of one underlying, and the
+    underlying's own price from the same response.
+    All tracked contracts of the underlying are loaded once and indexed by
+    (expiration, strike, type); only those expirations and strikes are kept
+    while the chain streams in, the rest is matched against the index in
+    memory and every changed row is written with a single bulk_update.
     """
     try:
         stock = Stock.objects.get(id=stock_id)
-        print(f"Updating options for underlying stock: {stock.symbol}...")
-        chain = fetch_option_chain_from_finnhub_requests(stock.symbol)
+        index = {
+            (option.expiration_date, option.strike_price, option.option_type): option
+            for option in Option.objects.filter(underlying_stock=stock).only(
+                'id', 'expiration_date', 'strike_price', 'option_type', 'last_price'
+            )
+        }
+        if not index:
+            return {'symbol': stock.symbol, 'matched': 0, 'skipped': 0, 'changed': 0}
+
+        logger.debug("Updating option prices", extra={"symbol": stock.symbol})
+        chain = fetch_option_chain_from_finnhub_requests(
+            stock.symbol,
+            expirations={expiration.isoformat() for expiration, _, _ in index},
+            strikes={float(strike) for _, strike, _ in index},
+        )
         if not chain:
             return
 
-        updated_count = 0
+        now = timezone.now()
+        underlying_changed = _update_underlying_from_chain(stock, chain, now)
+        matched, skipped, changed = 0, 0, []
         for expiration_data in chain.get('data', []):
+            expiration = date.fromisoformat(expiration_data['expirationDate'])
             for option_type in ['CALL', 'PUT']:
                 for contract_data in expiration_data.get('options', {}).get(option_type, []):
-                    try:
-                        option_obj = Option.objects.get(
-                            underlying_stock=stock,
-                            expiration_date=expiration_data['expirationDate'],
-                            strike_price=contract_data['strike'],
-                            option_type=option_type[0]
-                        )
-                        
-                        new_price = contract_data.get('lastPrice')
-                        
-                        # CLEANUP: Removed the non-working previous_close logic
-                        if new_price is not None and option_obj.last_price != new_price:
-                            option_obj.last_price = new_price
-                            option_obj.save()
-                            updated_count += 1
-                            
-                    except Option.DoesNotExist:
-                        continue 
-        
-        if updated_count > 0:
-            print(f"✅ OPTION UPDATE: Updated {updated_count} contracts for {stock.symbol}.")
+                    option_obj = index.get((expiration, _to_price(contract_data['strike']), option_type[0]))
+                    if option_obj is None:
+                        skipped += 1
+                        continue
+                    matched += 1
+
+                    new_price = contract_data.get('lastPrice')
+                    if new_price is None:
+                        continue
+                    new_price = _to_price(new_price)
+                    if option_obj.last_price != new_price:
+                        option_obj.last_price = new_price
+                        # bulk_update bypasses auto_now, so stamp the row ourselves.
+                        option_obj.updated_at = now
+                        changed.append(option_obj)
+
+        if changed:
+            Option.objects.bulk_update(changed, ['last_price', 'updated_at'])
+            record_prices(Option, ((o.id, o.last_price) for o in changed), now)
+            logger.info("Option prices updated", extra={"symbol": stock.symbol, "changed": len(changed)})
+
+        return {
+            'symbol': stock.symbol, 'matched': matched, 'skipped': skipped, 'changed': len(changed),
+            'underlying_changed': underlying_changed,
+        }
 
     except Stock.DoesNotExist:
-        print(f"❌ ERROR: Stock with id {stock_id} not found for option update.")
+        logger.error("Stock not found for option update", extra={"stock_id": stock_id})
+    except RateLimitTimeout as e:
+        raise self.retry(countdown=e.retry_after, max_retries=None)
 
 @shared_task
 def sync_all_option_prices():
     # (This task remains the same)
-    print("🚀 Dispatching tasks to sync all option prices...")
-    stocks_with_options_ids = Option.objects.values_list('underlying_stock_id', flat=True).distinct()
+    # order_by() drops Option's default ordering, which would otherwise defeat distinct()
+    stocks_with_options_ids = Option.objects.order_by().values_list('underlying_stock_id', flat=True).distinct()
     for stock_id in stocks_with_options_ids:
         update_option_prices_for_stock.delay(stock_id)
-        time.sleep(1)
-    print(f"✅ Dispatched option chain updates for {len(stocks_with_options_ids)} underlying stocks.")
+    logger.info("Option chain update tasks dispatched", extra={"count": len(stocks_with_options_ids)})
+
+def _roll_previous_close(queryset, chunk_size: int) -> int:
+    """
+    Copies last_price into previous_close inside the database, skipping rows
+    that are already rolled. Small tables take one UPDATE; larger ones are
+    walked in primary-key ranges of `chunk_size` so no single statement holds
+    row locks on the whole table. QuerySet.update leaves updated_at alone.
+    """
+    queryset = queryset.filter(last_price__isnull=False).exclude(previous_close=F('last_price'))
+    bounds = queryset.aggregate(low=Min('id'), high=Max('id'))
+    if bounds['low'] is None:
+        return 0
+    if bounds['high'] - bounds['low'] < chunk_size:
+        return queryset.update(previous_close=F('last_price'))
+
+    updated = 0
+    for start in range(bounds['low'], bounds['high'] + 1, chunk_size):
+        updated += queryset.filter(id__gte=start, id__lt=start + chunk_size).update(previous_close=F('last_price'))
+    return updated
+
+
+@shared_task
+def roll_previous_close_prices():
+    """
+    [Daily Task]
+    Run once per day after market close. Sets previous_close = last_price for
+    every stock and every unexpired option with set-based UPDATEs, so the next
+    trading day's "Day's P&L" has a baseline.
+    """
+    started = time.perf_counter()
+    chunk_size = settings.PREVIOUS_CLOSE_ROLLOVER_CHUNK_SIZE
+    stocks = _roll_previous_close(Stock.objects.all(), chunk_size)
+    options = _roll_previous_close(Option.objects.filter(expiration_date__gte=timezone.localdate()), chunk_size)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    logger.info("Rolled previous_close", extra={"stocks": stocks, "options": options, "elapsed_ms": round(elapsed_ms, 1)})
+    return {'stocks': stocks, 'options': options, 'elapsed_ms': round(elapsed_ms, 1)}
+
 
-# --- NEW TASK TO FIX "DAY'S P&L" FOR OPTIONS ---
 @shared_task
 def snapshot_option_prices_as_previous_close():
     """
     [Daily Task]
-    This task should be run once per day after market close.
-    It takes the current 'last_price' of all options and saves it
-    to the 'previous_close' field to be used on the next trading day.
+    Kept so existing beat entries keep working; see roll_previous_close_prices.
     """
-    print("📸 Starting daily snapshot of option prices...")
-    updated_count = 0
-    for option in Option.objects.all():
-        if option.last_price is not None:
-            option.previous_close = option.last_price
-            option.save()
-            updated_count += 1
-    print(f"✅ Snapshotted {updated_count} option prices as previous_close.")
+    return roll_previous_close_prices()
 
 
 @shared_task
 def create_daily_portfolio_snapshot():
-    # (This task remains the same)
-    total_value = 0
-    holdings = Holding.objects.all()
-
-    for holding in holdings:
-        instrument = holding.instrument
-        if hasattr(instrument, 'last_price') and instrument.last_price is not None:
-            multiplier = 100 if isinstance(instrument, Option) else 1
-            total_value += holding.quantity * instrument.last_price * multiplier
+    """
+    [Daily Task]
+    Stores today's total market value of all holdings as a PortfolioSnapshot.
+    """
+    total_value = Decimal(str(round(value_holdings().total_market_value, 4)))
 
     PortfolioSnapshot.objects.update_or_create(
         date=date.today(),
@@ -144,3 +273,92 @@ def create_daily_portfolio_snapshot():
     )
     return f"Created snapshot for {date.today()} with value {total_value}"
 
+
+@shared_task
+def replay_transaction_log(since: str = None):
+    """
+    [Worker Task]
+    Rebuilds holdings and realized gains from the Transaction log, resuming from
+    the nearest checkpoint before `since` (ISO datetime) when given.
+    """
+    result = replay_transactions(datetime.fromisoformat(since) if since else None)
+    logger.info("Transaction log replayed", extra={"replayed": result['replayed'], "holdings": result['holdings']})
+    return result
+
+
+@shared_task
+def roll_up_price_bars():
+    """
+    [Daily Task]
+    Applies the PriceBar retention policy: old raw bars become daily OHLC bars,
+    and daily bars past their retention window are dropped.
+    """
+    result = roll_up_bars()
+    logger.info("Price bars rolled up", extra={"daily_created": result['daily_created'], "raw_deleted": result['raw_deleted']})
+    return result
+
+
+# Alpha Vantage's "compact" output covers the last 100 trading days (~140 calendar days).
+COMPACT_HISTORY_DAYS = 140
+
+
+def fetch_daily_candles(symbol: str, full: bool) -> list:
+    """
+    Daily closes from Alpha Vantage, the whole history when `full`. Free keys
+    get an "Information" message instead of the premium-only full output, so
+    an empty full fetch falls back to the latest 100 trading days.
+    """
+    if full:
+        candles = fetch_benchmark_candles_from_alpha_vantage(symbol, outputsize="full")
+        if candles:
+            return candles
+        logger.info("Full daily history unavailable, using compact output", extra={"symbol": symbol})
+    return fetch_benchmark_candles_from_alpha_vantage(symbol, outputsize="compact")
+
+
+
+@shared_task
+def sync_benchmark_candles(symbols: list = None):
+    """
+    [Daily Task]
+    Stores daily closes for every BENCHMARK_SYMBOLS ticker (or `symbols`),
+    fetching only the dates after the last stored candle. One Alpha Vantage
+    call per symbol; the full history is requested only when the compact
+    window would leave a gap, and compact is stored if full is refused.
+    """
+    results = {}
+    for symbol in symbols or settings.BENCHMARK_SYMBOLS:
+        symbol = symbol.strip().upper()
+        last_date = BenchmarkCandle.objects.filter(symbol=symbol).aggregate(last=Max('date'))['last']
+        if last_date is not None and last_date >= date.today() - timedelta(days=1):
+            results[symbol] = 0
+            continue
+
+        needs_full = last_date is None or last_date < date.today() - timedelta(days=COMPACT_HISTORY_DAYS)
+        candles = fetch_daily_candles(symbol, full=needs_full)
+        new_candles = [
+            BenchmarkCandle(symbol=symbol, date=candle_date, close=_to_price(candle['price']))
+            for candle_date, candle in ((date.fromisoformat(c['date']), c) for c in candles)
+            if last_date is None or candle_date > last_date
+        ]
+        BenchmarkCandle.objects.bulk_create(new_candles, ignore_conflicts=True)
+        results[symbol] = len(new_candles)
+        logger.info("Benchmark candles stored", extra={"symbol": symbol, "count": len(new_candles)})
+    return results
+
+
+@shared_task
+def refresh_risk_model():
+    """
+    [Daily Task]
+    Run once per day after sync_benchmark_candles (`manage.py configure_daily_tasks`
+    installs both beat entries). Rebuilds the covariance
+    model behind the risk endpoint for every stock the portfolio is exposed
+    to and shares it through Redis, so no request pays for the full build.
+    """
+    started = time.perf_counter()
+    exposure, _, _ = current_exposures()
+    model = get_model(list(exposure), rebuild=True)
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+    logger.info("Risk model refreshed", extra={"factors": len(model.stock_ids), "elapsed_ms": elapsed_ms})
+    return {'factors': len(model.stock_ids), 'days': len(model.days), 'elapsed_ms': elapsed_ms}
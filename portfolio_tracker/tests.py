@@ -1,3 +1,1333 @@
-from django.test import TestCase
+import fnmatch
+import io
+from importlib import import_module
+import json
+import re
+import time
+import uuid
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import requests
+import urllib3
+from asgiref.testing import ApplicationCommunicator
+from celery.exceptions import Retry
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django_celery_beat.models import PeriodicTask
+from redis import RedisError
+from rest_framework.test import APIClient
+
+from . import (
+    allocation, consumers, data_fetcher, greeks, http_client, ledger, market_calendar, polling, price_store, quote_cache,
+    rate_limiter, risk, tasks,
+)
+from .admin import DepositAdmin, RealizedGainAdmin, TransactionAdmin
+from .history import build_value_history, lttb
+from .ingestion import apply_fills
+from .json_stream import JsonStreamReader
+from .models import (
+    Stock, Option, Holding, Deposit, Transaction, RealizedGain, PortfolioSnapshot,
+    BenchmarkCandle, PriceBar, AllocationTarget, LedgerTotals, ReplayCheckpoint,
+)
+from .rate_limiter import RateLimitTimeout, TokenBucketRateLimiter
+from .redis_client import get_redis_client
+from .replay import replay_transactions
+from .valuation import value_holdings
+
+
+def query_patterns(queries) -> str:
+    """Collapses literals so repeated N+1 statements group together, most frequent first."""
+    patterns = Counter(
+        re.sub(r"'[^']*'|\b\d+(\.\d+)?\b", '?', query['sql'])
+        for query in queries
+    )
+    return "\n".join(f"{count:>5} x {sql[:300]}" for sql, count in patterns.most_common(10))
+
+
+class SyntheticPortfolioMixin:
+    """
+    Seeds a synthetic portfolio and can grow it in place. Each grow() call
+    adds another STOCKS stocks with OPTIONS_PER_STOCK held contracts each,
+    plus their holdings, transactions, gains, deposits, snapshots and bars.
+    """
+    STOCKS = 12
+    OPTIONS_PER_STOCK = 3
+    SNAPSHOT_DAYS = 40
+
+    def grow(self):
+        batch = getattr(self, '_batch', 0)
+        self._batch = batch + 1
+        stocks = Stock.objects.bulk_create([
+            Stock(symbol=f"S{batch}X{i}", last_price=Decimal(100 + i), previous_close=Decimal(99 + i))
+            for i in range(self.STOCKS)
+        ])
+        options = Option.objects.bulk_create([
+            Option(
+                underlying_stock=stock, strike_price=Decimal(90 + 5 * k), expiration_date=date.today() + timedelta(days=30),
+                option_type='C' if k % 2 else 'P', last_price=Decimal('2.5'), previous_close=Decimal('2.0'),
+            )
+            for stock in stocks for k in range(self.OPTIONS_PER_STOCK)
+        ])
+        instruments = list(stocks) + list(options)
+        Holding.objects.bulk_create([
+            Holding(instrument=instrument, quantity=Decimal(10), cost_basis=Decimal(50)) for instrument in instruments
+        ])
+        start = datetime(2024, 1, 1, tzinfo=dt_timezone.utc) + timedelta(days=batch * self.SNAPSHOT_DAYS)
+        Transaction.objects.bulk_create([
+            Transaction(instrument=instrument, transaction_type='buy', quantity=Decimal(10), price=Decimal(50), date=start)
+            for instrument in instruments
+        ])
+        RealizedGain.objects.bulk_create([
+            RealizedGain(instrument_name=stock.symbol, realized_pnl=Decimal('12.50'), date=start) for stock in stocks
+        ])
+        Deposit.objects.bulk_create([Deposit(amount=Decimal(1000), date=start) for _ in range(self.STOCKS)])
+        PortfolioSnapshot.objects.bulk_create([
+            PortfolioSnapshot(date=start.date() + timedelta(days=d), total_value=Decimal(10000 + d))
+            for d in range(self.SNAPSHOT_DAYS)
+        ])
+        BenchmarkCandle.objects.bulk_create([
+            BenchmarkCandle(symbol='VOO', date=start.date() + timedelta(days=d), close=Decimal(400 + d))
+            for d in range(self.SNAPSHOT_DAYS)
+        ])
+        PriceBar.objects.bulk_create([
+            PriceBar(
+                content_type=ContentType.objects.get_for_model(Stock), object_id=stock.id,
+                timestamp=start - timedelta(days=60), open=1.0, high=1.0, low=1.0, close=1.0,
+            )
+            for stock in stocks
+        ])
+        return stocks, options
+
+    def assertConstantQueries(self, func, budget: int, prepare=None):
+        """
+        Runs `func` once to warm caches, counts its queries, grows the data set
+        and counts again. Fails if the count exceeds `budget` or changes with
+        the row count, printing the most repeated statement patterns.
+        `prepare` runs uncounted before each call, e.g. to give it work to do.
+        """
+        func()
+        counts = []
+        for _ in range(2):
+            if prepare:
+                prepare()
+            with CaptureQueriesContext(connection) as captured:
+                func()
+            counts.append(len(captured))
+            if len(captured) > budget or (len(counts) == 2 and counts[0] != counts[1]):
+                self.fail(
+                    f"{len(captured)} queries (budget {budget}, previous run {counts[0]}) after growing the "
+                    f"portfolio. Most repeated patterns:\n{query_patterns(captured.captured_queries)}"
+                )
+            self.grow()
+
+
+class EndpointQueryBudgetTests(SyntheticPortfolioMixin, TestCase):
+    """Every router endpoint must cost a bounded number of queries, however large the portfolio."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.grow()
+
+    def get(self, url):
+        def request():
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content[:500])
+        return request
+
+    def test_stock_list(self):
+        self.assertConstantQueries(self.get('/api/stocks/'), budget=1)
+
+    def test_option_list(self):
+        self.assertConstantQueries(self.get('/api/options/'), budget=1)
+
+    def test_holding_list(self):
+        self.assertConstantQueries(self.get('/api/holdings/'), budget=4)
+
+    def test_holding_positions(self):
+        self.assertConstantQueries(self.get('/api/holdings/?view=positions'), budget=3)
+
+    def test_option_positions(self):
+        self.assertConstantQueries(self.get('/api/options/?view=positions'), budget=2)
+
+    def test_option_greeks(self):
+        self.assertConstantQueries(self.get('/api/option-greeks/'), budget=2)
+
+    def test_portfolio_risk(self):
+        # Redis is not running under test, so dropping this process's copy makes every counted run a full model build.
+        self.assertConstantQueries(
+            self.get('/api/portfolio-risk/?what_if=S0X1:5000'), budget=9, prepare=lambda: setattr(risk, '_model', None),
+        )
+
+    def target_new_stocks(self):
+        for stock in Stock.objects.filter(allocation_targets=None):
+            AllocationTarget.objects.create(name=stock.symbol, weight=Decimal('0.01')).stocks.add(stock)
+
+    def test_allocation_target_list(self):
+        self.target_new_stocks()
+        self.assertConstantQueries(self.get('/api/allocation-targets/'), budget=2, prepare=self.target_new_stocks)
+
+    def test_rebalance(self):
+        self.target_new_stocks()
+        self.assertConstantQueries(self.get('/api/rebalance/'), budget=7, prepare=self.target_new_stocks)
+
+    def test_rebalance_mean_variance(self):
+        def prepare():
+            self.target_new_stocks()
+            risk._model = None
+        prepare()
+        self.assertConstantQueries(self.get('/api/rebalance/?mode=mean_variance'), budget=10, prepare=prepare)
+
+    def test_deposit_list(self):
+        self.assertConstantQueries(self.get('/api/deposits/'), budget=1)
+
+    def test_transaction_list(self):
+        self.assertConstantQueries(self.get('/api/transactions/'), budget=1)
+
+    def test_transaction_page(self):
+        first = self.client.get('/api/transactions/?page_size=10').json()
+        self.assertConstantQueries(self.get(first['next']), budget=1)
+
+    def test_option_page(self):
+        first = self.client.get('/api/options/?page_size=10').json()
+        self.assertConstantQueries(self.get(first['next']), budget=1)
+
+    def test_transaction_stream(self):
+        def stream():
+            response = self.client.get('/api/transactions/?stream=1')
+            self.assertEqual(response.status_code, 200)
+            b''.join(response.streaming_content)
+        self.assertConstantQueries(stream, budget=1)
+
+    def test_portfolio_history(self):
+        self.assertConstantQueries(self.get('/api/portfolio-history/?from=2024-01-01&points=50'), budget=2)
+
+    def test_portfolio_summary(self):
+        self.assertConstantQueries(self.get('/api/portfolio-summary/'), budget=5)
+
+    def test_benchmark_history(self):
+        self.assertConstantQueries(self.get('/api/benchmark-history/?from=2024-01-01'), budget=1)
+
+    def test_transaction_create(self):
+        def create():
+            response = self.client.post('/api/transactions/', {
+                'transaction_type': 'buy', 'quantity': '1', 'price': '10', 'symbol': 'S0X0',
+            })
+            self.assertEqual(response.status_code, 201, response.content)
+        self.assertConstantQueries(create, budget=14)
+
+    def test_transaction_bulk_create(self):
+        fills = [
+            {'transaction_type': 'buy', 'quantity': '1', 'price': '10', 'symbol': f'S0X{i}'}
+            for i in range(self.STOCKS)
+        ] + [
+            {'transaction_type': 'buy', 'quantity': '1', 'price': '1', 'symbol': 'S0X0',
+             'strike_price': '90', 'expiration_date': (date.today() + timedelta(days=30)).isoformat(), 'option_type': 'P'},
+        ]
+
+        def bulk():
+            response = self.client.post('/api/transactions/bulk/', fills, format='json')
+            self.assertEqual(response.status_code, 201, response.content)
+        self.assertConstantQueries(bulk, budget=16)
+
+
+class TaskQueryBudgetTests(SyntheticPortfolioMixin, TestCase):
+    """Every Celery task must cost a bounded number of queries, however large the portfolio."""
+
+    def setUp(self):
+        self.grow()
+
+    def test_update_stock_price(self):
+        stock_id = Stock.objects.values_list('id', flat=True).first()
+        prices = iter(range(1000, 2000))
+        with mock.patch.object(tasks, 'get_quote', side_effect=lambda *a, **k: {'price': next(prices), 'previous_close': 1}), \
+                mock.patch.object(tasks, 'queue_price_update', return_value=False):
+            self.assertConstantQueries(lambda: tasks.update_stock_price(stock_id), budget=3)
+
+    def test_sync_all_stock_prices(self):
+        with mock.patch.object(tasks.update_stock_price, 'delay'):
+            self.assertConstantQueries(tasks.sync_all_stock_prices, budget=1)
+
+    def test_update_option_prices_for_stock(self):
+        stock = Stock.objects.first()
+        prices = iter(range(1000, 2000))
+
+        def chain(symbol, expirations=None, strikes=None):
+            options = Option.objects.filter(underlying_stock=stock)
+            return {'lastTradePrice': next(prices), 'data': [{
+                'expirationDate': options[0].expiration_date.isoformat(),
+                'options': {
+                    'CALL': [{'strike': float(o.strike_price), 'lastPrice': next(prices)} for o in options if o.option_type == 'C'],
+                    'PUT': [{'strike': float(o.strike_price), 'lastPrice': next(prices)} for o in options if o.option_type == 'P'],
+                },
+            }]}
+
+        def run():
+            with mock.patch.object(tasks, 'fetch_option_chain_from_finnhub_requests', side_effect=chain), \
+                    mock.patch.object(tasks, 'store_quote'), \
+                    mock.patch.object(tasks, 'queue_price_update', return_value=False):
+                tasks.update_option_prices_for_stock(stock.id)
+        # The mocked chain's own reads are part of the count.
+        self.assertConstantQueries(run, budget=8)
+
+    def test_price_poll_plan(self):
+        # The scheduler tick itself only touches Redis; building its plan is what reads the database.
+        with mock.patch.object(polling, 'subscribed_symbols', return_value={'S0X0'}):
+            self.assertConstantQueries(lambda: polling.build_plan('regular'), budget=7)
+
+    def test_sync_all_option_prices(self):
+        with mock.patch.object(tasks.update_option_prices_for_stock, 'delay'):
+            self.assertConstantQueries(tasks.sync_all_option_prices, budget=1)
+
+    def reset_previous_closes(self):
+        Stock.objects.update(previous_close=None)
+        Option.objects.update(previous_close=None)
+
+    def test_roll_previous_close_prices(self):
+        self.assertConstantQueries(tasks.roll_previous_close_prices, budget=4, prepare=self.reset_previous_closes)
+
+    def test_snapshot_option_prices_as_previous_close(self):
+        self.assertConstantQueries(
+            tasks.snapshot_option_prices_as_previous_close, budget=4, prepare=self.reset_previous_closes
+        )
+
+    def test_create_daily_portfolio_snapshot(self):
+        self.assertConstantQueries(tasks.create_daily_portfolio_snapshot, budget=8)
+
+    def test_flush_price_broadcasts(self):
+        def run():
+            batch = [{'symbol': symbol, 'price': 1.0} for symbol in Stock.objects.values_list('symbol', flat=True)]
+            with mock.patch.object(tasks, 'flush_price_updates', return_value=batch):
+                tasks.flush_price_broadcasts()
+        # Only the query building the mocked batch; publishing touches Redis, not the database.
+        self.assertConstantQueries(run, budget=1)
+
+    def test_replay_transaction_log(self):
+        # A stray gain row makes every run reconcile the ledger's realized P&L.
+        def drift():
+            RealizedGain.objects.create(instrument_name='DRIFT', realized_pnl=Decimal('1.00'), date=datetime.now(dt_timezone.utc))
+        self.assertConstantQueries(tasks.replay_transaction_log, budget=14, prepare=drift)
+
+    def test_roll_up_price_bars(self):
+        # Each run needs an expired raw bar to roll up, the warm-up consumes the seeded ones.
+        def stale_bar():
+            PriceBar.objects.create(
+                content_type=ContentType.objects.get_for_model(Stock), object_id=Stock.objects.values_list('id', flat=True).first(),
+                timestamp=datetime.now(dt_timezone.utc) - timedelta(days=90), open=1.0, high=1.0, low=1.0, close=1.0,
+            )
+        self.assertConstantQueries(tasks.roll_up_price_bars, budget=7, prepare=stale_bar)
+
+    def test_sync_benchmark_candles(self):
+        candles = [{'date': (date.today() - timedelta(days=d)).isoformat(), 'price': 400.0} for d in range(100, 0, -1)]
+        with mock.patch.object(tasks, 'fetch_benchmark_candles_from_alpha_vantage', return_value=candles):
+            self.assertConstantQueries(lambda: tasks.sync_benchmark_candles(symbols=['VOO']), budget=2)
+
+
+class RiskTests(TestCase):
+
+    def test_non_finite_what_if_amount_is_rejected(self):
+        Stock.objects.create(symbol='AAA', last_price=Decimal('10'))
+        for amount in ('nan', 'inf', '-inf'):
+            response = APIClient().get(f'/api/portfolio-risk/?what_if=AAA:{amount}')
+            self.assertEqual(response.status_code, 400, amount)
+
+    def model(self, benchmark_history=True):
+        rng = np.random.default_rng(7)
+        benchmark = rng.normal(0, 0.01, 250)
+        returns = np.column_stack([0.8 * benchmark + rng.normal(0, 0.01, 250) for _ in range(3)])
+        returns[:30, 2] = np.nan  # listed later than the others
+        if not benchmark_history:
+            benchmark[:] = np.nan
+        days = [date(2024, 1, 1) + timedelta(days=i) for i in range(251)]
+        return risk.RiskModel(days[-1], days, [11, 12, 13], ['A', 'B', 'C'], returns, benchmark)
+
+    def test_covariance_uses_each_pairs_common_days(self):
+        model = self.model()
+        self.assertAlmostEqual(model.covariance[0, 1], np.cov(model.returns[:, 0], model.returns[:, 1])[0, 1])
+        self.assertAlmostEqual(model.covariance[0, 2], np.cov(model.returns[30:, 0], model.returns[30:, 2])[0, 1])
+        self.assertAlmostEqual(model.covariance[2, 3], np.cov(model.returns[30:, 2], model.benchmark_returns[30:])[0, 1])
+
+    @mock.patch.object(settings, 'RISK_CONFIDENCE_LEVELS', [0.95])
+    def test_var_figures(self):
+        model = self.model()
+        weights = np.array([10000.0, -4000.0])
+        summary = risk.RiskReport(model, {11: 10000.0, 12: -4000.0}, 6000.0, horizon_days=4).summary()
+        sigma = np.sqrt(weights @ np.cov(model.returns[:, :2], rowvar=False) @ weights) * 2
+        level = summary['var'][0]
+        self.assertAlmostEqual(summary['volatility'], sigma)
+        self.assertAlmostEqual(level['parametric_var'], 1.6448536269514722 * sigma)
+        losses = -(model.returns[:, :2] @ weights) * 2
+        self.assertAlmostEqual(level['historical_var'], np.quantile(losses, 0.95))
+        self.assertAlmostEqual(level['historical_cvar'], losses[losses >= np.quantile(losses, 0.95)].mean())
+
+    def test_what_if_matches_a_full_recompute(self):
+        model = self.model()
+        exposure = {11: 10000.0, 12: -4000.0}
+        report = risk.RiskReport(model, exposure, 6000.0, horizon_days=2)
+        for stock_id, change in ((12, 3000.0), (13, 5000.0), (11, -10000.0)):
+            changed = {**exposure, stock_id: exposure.get(stock_id, 0.0) + change}
+            full = risk.RiskReport(model, changed, 6000.0 + change, horizon_days=2).summary()
+            quick = report.what_if(stock_id, change)
+            for key, value in quick.items():
+                if key == 'var':
+                    for a, b in zip(value, full['var']):
+                        np.testing.assert_allclose(list(a.values()), list(b.values()), rtol=1e-9, err_msg=stock_id)
+                elif value is None:
+                    self.assertIsNone(full[key], f'{stock_id} {key}')
+                else:
+                    np.testing.assert_allclose(value, full[key], rtol=1e-9, err_msg=f'{stock_id} {key}')
+
+    def test_no_benchmark_history_reports_no_beta(self):
+        report = risk.RiskReport(self.model(benchmark_history=False), {11: 10000.0, 12: -4000.0}, 6000.0)
+        summary = report.summary()
+        self.assertIsNone(summary['beta'])
+        self.assertIsNone(summary['dollar_beta'])
+        self.assertEqual([factor['beta'] for factor in summary['factors']], [None, None])
+        self.assertGreater(summary['volatility'], 0)
+        what_if = report.what_if(13, 5000.0)
+        self.assertIsNone(what_if['beta'])
+        self.assertIsNone(what_if['dollar_beta'])
+
+
+class DailyScheduleTests(TestCase):
+
+    def test_daily_entries_are_installed_once(self):
+        call_command('configure_daily_tasks', stdout=io.StringIO())
+        call_command('configure_daily_tasks', stdout=io.StringIO())
+        entries = PeriodicTask.objects.filter(enabled=True).select_related('crontab')
+        self.assertEqual(sorted(entry.task.rsplit('.', 1)[1] for entry in entries),
+                         ['refresh_risk_model', 'roll_up_price_bars', 'sync_benchmark_candles'])
+        self.assertEqual({entry.crontab.day_of_week for entry in entries}, {'1-5'})
+
+
+class RebalanceTests(TestCase):
+    """Hand-computed rebalances of a tiny portfolio: stocks at round prices, no options."""
+
+    def stock(self, symbol, price, shares=0):
+        stock = Stock.objects.create(symbol=symbol, last_price=Decimal(price), previous_close=Decimal(price))
+        if shares:
+            Holding.objects.create(instrument=stock, quantity=Decimal(shares), cost_basis=Decimal(price))
+        return stock
+
+    def target(self, name, weight, *stocks):
+        target = AllocationTarget.objects.create(name=name, weight=Decimal(weight))
+        target.stocks.set(stocks)
+        return target
+
+    def trades(self, result):
+        return {(t['instrument_name'], t['side']): t['quantity'] for t in result['trades']}
+
+    def test_underweight_group_is_never_sold(self):
+        # V = 5000 A + 1000 B + 4000 untargeted C = 10,000 with no cash. Both targets are
+        # underweight (A 5000 < 6000, B 1000 < 3000), so funding B by selling A would only
+        # trade one shortfall for another.
+        self.target('A', '0.6', self.stock('A', 100, 50))
+        self.target('B', '0.3', self.stock('B', 100, 10))
+        self.stock('C', 100, 40)
+        result = allocation.rebalance(cash_buffer=0)
+        self.assertEqual(result['trades'], [])
+        self.assertEqual([t['planned_value'] for t in result['targets']], [5000.0, 1000.0])
+
+    def test_rebalance_rejects_non_finite_parameters(self):
+        self.target('A', '0.5', self.stock('A', 100, 10))
+        client = APIClient()
+        for query in ('mode=mean_variance&risk_aversion=nan', 'mode=mean_variance&risk_aversion=inf',
+                      'cash_buffer=nan', 'band=-inf', 'max_weight=inf'):
+            self.assertEqual(client.get(f'/api/rebalance/?{query}').status_code, 400, query)
+
+
+class OptionChainSyncTests(TestCase):
+
+    def test_one_chain_update_per_underlying(self):
+        stocks = [Stock.objects.create(symbol=symbol) for symbol in ('AAPL', 'MSFT')]
+        Option.objects.bulk_create(
+            Option(underlying_stock=stock, strike_price=Decimal(100 + i), expiration_date=date(2024, 6, 21),
+                   option_type='C')
+            for stock in stocks for i in range(3)
+        )
+        with mock.patch.object(tasks.update_option_prices_for_stock, 'delay') as delay:
+            tasks.sync_all_option_prices()
+        self.assertCountEqual([c.args[0] for c in delay.call_args_list], [stock.id for stock in stocks])
+
+
+class FinnhubFetcherTests(TestCase):
+    """The fetchers return None on any failure, including the rate limiter's Redis being down."""
+
+    @mock.patch.object(settings, 'FINNHUB_API_TOKEN', 'test-token')
+    def test_redis_outage_returns_none(self):
+        with mock.patch.object(data_fetcher.finnhub_rate_limiter, 'try_acquire', side_effect=RedisError('down')), \
+                mock.patch.object(data_fetcher, 'get_json') as get_json, \
+                mock.patch.object(data_fetcher, 'stream_json') as stream_json:
+            self.assertIsNone(data_fetcher.fetch_stock_data_from_finnhub('AAPL'))
+            self.assertIsNone(data_fetcher.fetch_option_chain_from_finnhub_requests('AAPL'))
+        get_json.assert_not_called()
+        stream_json.assert_not_called()
+
+
+class HttpClientRetryTests(TestCase):
+    """Provider retries must neither bypass the Finnhub rate limiter nor sleep unbounded."""
+
+    def response(self, status_code, retry_after):
+        return urllib3.HTTPResponse(status=status_code, headers={'Retry-After': retry_after}, preload_content=False)
+
+    def test_429_is_never_retried_in_urllib3(self):
+        retry = http_client.get_session().get_adapter('https://finnhub.io').max_retries
+        self.assertFalse(retry.is_retry('GET', 429, has_retry_after=True))
+        self.assertTrue(retry.is_retry('GET', 503, has_retry_after=True))
+
+    def test_retry_after_is_capped(self):
+        retry = http_client.get_session().get_adapter('https://finnhub.io').max_retries
+        self.assertEqual(retry.get_retry_after(self.response(503, '3600')), settings.HTTP_CLIENT_BACKOFF_MAX)
+
+    def test_429_raises_rate_limit_timeout(self):
+        response = requests.Response()
+        response.status_code, response.headers['Retry-After'] = 429, '2'
+        response.raw = self.response(429, '2')
+        with mock.patch.object(http_client.get_session(), 'get', return_value=response):
+            with self.assertRaises(RateLimitTimeout) as raised:
+                http_client.get_json('https://finnhub.io/api/v1/quote', provider='finnhub')
+        self.assertEqual(raised.exception.retry_after, 2.0)
+
+
+class FakeRedis:
+    """Just enough of redis.Redis for the quote cache and polling presence. Expiry is recorded, not applied."""
+
+    def __init__(self):
+        self.data, self.hashes, self.ttls = {}, {}, {}
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def execute(self):
+        return []
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, nx=False, px=None, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value.encode() if isinstance(value, str) else value
+        return True
+
+    def exists(self, key):
+        return int(key in self.data)
+
+    def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None or self.hashes.pop(key, None) is not None for key in keys)
+
+    def hincrby(self, key, field, amount):
+        fields = self.hashes.setdefault(key, {})
+        fields[field] = fields.get(field, 0) + amount
+        return fields[field]
+
+    def hset(self, key, mapping):
+        self.hashes.setdefault(key, {}).update(mapping)
+
+    def hkeys(self, key):
+        return [field.encode() for field in self.hashes.get(key, {})]
+
+    def expire(self, key, seconds):
+        self.ttls[key] = seconds
+
+    def scan_iter(self, match):
+        return [key for key in list(self.data) + list(self.hashes) if fnmatch.fnmatchcase(key, match)]
+
+    def eval(self, script, numkeys, key, token):
+        # Only the quote cache's compare-and-delete lock release.
+        if self.data.get(key) == token.encode():
+            return self.delete(key)
+        return 0
+
+
+@mock.patch.object(settings, 'QUOTE_CACHE_FOLLOWER_WAIT', 0.05)
+@mock.patch.object(settings, 'QUOTE_CACHE_POLL_INTERVAL', 0.01)
+class QuoteCacheTests(TestCase):
+    """get_quote calls Finnhub once per symbol; concurrent callers share or wait for that result."""
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = mock.patch.object(quote_cache, 'get_redis_client', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_leader_fetches_once_and_caches(self):
+        with mock.patch.object(quote_cache, 'fetch_stock_data_from_finnhub',
+                               return_value={'price': 10.0, 'previous_close': 9.0}) as fetch:
+            self.assertEqual(quote_cache.get_quote('aapl'), {'price': 10.0, 'previous_close': 9.0})
+            self.assertEqual(quote_cache.get_quote('AAPL'), {'price': 10.0, 'previous_close': 9.0})
+        fetch.assert_called_once_with('AAPL')
+        self.assertFalse(self.redis.exists(quote_cache._lock_key('AAPL')))
+        self.assertEqual(self.redis.hashes[quote_cache.STATS_KEY], {'misses': 1, 'hits': 1})
+
+    def test_follower_takes_the_leaders_result(self):
+        self.redis.set(quote_cache._lock_key('AAPL'), 'leader')
+
+        def leader_finishes(seconds):
+            quote_cache.store_quote('AAPL', 11.0, 9.0)
+        with mock.patch.object(quote_cache, 'fetch_stock_data_from_finnhub') as fetch, \
+                mock.patch.object(quote_cache.time, 'sleep', side_effect=leader_finishes):
+            self.assertEqual(quote_cache.get_quote('AAPL'), {'price': 11.0, 'previous_close': 9.0})
+        fetch.assert_not_called()
+
+    def test_follower_rereads_when_the_lock_is_released_after_its_read(self):
+        self.redis.set(quote_cache._lock_key('AAPL'), 'leader')
+        real_read = quote_cache._read
+        reads = []
+
+        def read_then_leader_finishes(client, symbol):
+            cached = real_read(client, symbol)
+            reads.append(cached)
+            if len(reads) == 2:
+                # The follower's poll missed; the leader stores and releases before the lock check.
+                quote_cache.store_quote('AAPL', 11.0, 9.0)
+                self.redis.delete(quote_cache._lock_key('AAPL'))
+            return cached
+        with mock.patch.object(quote_cache, 'fetch_stock_data_from_finnhub') as fetch, \
+                mock.patch.object(quote_cache, '_read', side_effect=read_then_leader_finishes), \
+                mock.patch.object(quote_cache.time, 'sleep'):
+            self.assertEqual(quote_cache.get_quote('AAPL'), {'price': 11.0, 'previous_close': 9.0})
+        fetch.assert_not_called()
+
+    def test_follower_gives_up_instead_of_blocking(self):
+        self.redis.set(quote_cache._lock_key('AAPL'), 'leader')
+        with mock.patch.object(quote_cache, 'fetch_stock_data_from_finnhub') as fetch:
+            with self.assertRaises(quote_cache.QuotePending):
+                quote_cache.get_quote('AAPL')
+        fetch.assert_not_called()
+
+    def test_new_symbol_from_a_fill_is_priced_through_the_task(self):
+        with mock.patch.object(tasks.update_stock_price, 'delay') as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = APIClient().post('/api/transactions/', {
+                'transaction_type': 'buy', 'quantity': '1', 'price': '10', 'symbol': 'NEW',
+            })
+        self.assertEqual(response.status_code, 201, response.content)
+        delay.assert_called_once_with(Stock.objects.get(symbol='NEW').id)
+
+    def test_broker_outage_after_commit_does_not_fail_the_fill(self):
+        with mock.patch.object(tasks.update_stock_price, 'delay', side_effect=ConnectionError('broker down')), \
+                self.assertLogs('portfolio_tracker.ingestion', 'WARNING'), self.captureOnCommitCallbacks(execute=True):
+            response = APIClient().post('/api/transactions/', {
+                'transaction_type': 'buy', 'quantity': '1', 'price': '10', 'symbol': 'NEW',
+            })
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_update_stock_price_requeues_while_pending(self):
+        stock = Stock.objects.create(symbol='AAPL')
+        with mock.patch.object(tasks, 'get_quote', side_effect=quote_cache.QuotePending('AAPL', 2.0)), \
+                mock.patch.object(tasks.update_stock_price, 'retry', side_effect=Retry) as retry:
+            with self.assertRaises(Retry):
+                tasks.update_stock_price(stock.id)
+        retry.assert_called_once_with(countdown=2.0, max_retries=None)
+
+
+class BenchmarkCandleSyncTests(TestCase):
+
+    def test_refused_full_history_falls_back_to_compact(self):
+        compact = [{'date': (date.today() - timedelta(days=d)).isoformat(), 'price': 400.0} for d in range(5, 0, -1)]
+        outputs = {'full': [], 'compact': compact}
+        with mock.patch.object(tasks, 'fetch_benchmark_candles_from_alpha_vantage',
+                               side_effect=lambda symbol, outputsize: outputs[outputsize]) as fetch:
+            self.assertEqual(tasks.sync_benchmark_candles(symbols=['VOO']), {'VOO': 5})
+        self.assertEqual([c.kwargs['outputsize'] for c in fetch.call_args_list], ['full', 'compact'])
+        self.assertEqual(BenchmarkCandle.objects.filter(symbol='VOO').count(), 5)
+
+
+class StockPriceUpdateTests(TestCase):
+
+    def test_unchanged_quote_writes_nothing(self):
+        stock = Stock.objects.create(symbol='AAPL', last_price=Decimal('100.12'), previous_close=Decimal('99.5'))
+        with mock.patch.object(tasks, 'get_quote', return_value={'price': 100.12, 'previous_close': 99.5}), \
+                mock.patch.object(tasks, 'queue_price_update') as queue, \
+                mock.patch.object(Stock, 'save') as save:
+            tasks.update_stock_price(stock.id)
+        save.assert_not_called()
+        queue.assert_not_called()
+
+    def test_changed_quote_is_stored_at_column_precision(self):
+        stock = Stock.objects.create(symbol='AAPL', last_price=Decimal('100.12'), previous_close=Decimal('99.5'))
+        with mock.patch.object(tasks, 'get_quote', return_value={'price': 100.123456, 'previous_close': 99.5}), \
+                mock.patch.object(tasks, 'queue_price_update', return_value=False) as queue:
+            tasks.update_stock_price(stock.id)
+        stock.refresh_from_db()
+        self.assertEqual(stock.last_price, Decimal('100.1235'))
+        queue.assert_called_once_with('AAPL', 100.1235)
+
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+@mock.patch.object(settings, 'WEBSOCKET_MAX_SYMBOLS', 3)
+class PriceUpdateConsumerTests(TestCase):
+
+    def setUp(self):
+        for patcher in (mock.patch.object(consumers, 'held_symbols', return_value={'AAPL'}),
+                        mock.patch.object(consumers.WEBSOCKET_CLIENTS, 'set'),
+                        mock.patch.object(consumers, '_keep_presence_alive', new=mock.AsyncMock())):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    # channels.testing needs daphne, which is not a dependency; speak the ASGI websocket protocol directly.
+    async def connect(self):
+        communicator = ApplicationCommunicator(
+            consumers.PriceUpdateConsumer.as_asgi(), {'type': 'websocket', 'path': '/ws/prices/', 'headers': []},
+        )
+        await communicator.send_input({'type': 'websocket.connect'})
+        self.assertEqual((await communicator.receive_output())['type'], 'websocket.accept')
+        self.assertEqual(await self.receive(communicator), {'type': 'subscriptions', 'data': ['AAPL']})
+        return communicator
+
+    async def send(self, communicator, content):
+        await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps(content)})
+
+    async def receive(self, communicator):
+        return json.loads((await communicator.receive_output())['text'])
+
+    async def disconnect(self, communicator):
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait()
+
+    async def test_subscriptions_past_the_cap_are_refused(self):
+        with mock.patch.object(consumers, 'track_subscribers') as track:
+            communicator = await self.connect()
+            await self.send(communicator, {'action': 'subscribe', 'symbols': ['MSFT', 'TSLA', 'NVDA']})
+            self.assertEqual((await self.receive(communicator))['type'], 'error')
+            await self.send(communicator, {'action': 'subscribe', 'symbols': ['MSFT', 'TSLA']})
+            self.assertEqual(await self.receive(communicator),
+                             {'type': 'subscriptions', 'data': ['AAPL', 'MSFT', 'TSLA']})
+            await self.disconnect(communicator)
+        self.assertEqual([c.args[1] for c in track.call_args_list], [1, 1, -1])
+
+    async def test_redis_outage_does_not_drop_the_socket(self):
+        with mock.patch.object(consumers, 'track_subscribers', side_effect=RedisError('down')):
+            communicator = await self.connect()
+            await self.send(communicator, {'action': 'subscribe', 'symbols': ['MSFT']})
+            self.assertEqual(await self.receive(communicator), {'type': 'subscriptions', 'data': ['AAPL', 'MSFT']})
+            await self.disconnect(communicator)
+
+class LedgerTotalsTests(TestCase):
+    """Every write path keeps LedgerTotals equal to a recomputation from the raw tables."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.admin_request = RequestFactory().post('/admin/')
+
+    def fill(self, transaction_type, quantity, price, **option):
+        response = self.client.post('/api/transactions/', {
+            'transaction_type': transaction_type, 'quantity': quantity, 'price': price, 'symbol': 'AAPL', **option,
+        })
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def assertLedgerMatches(self):
+        self.assertEqual(ledger.verify_totals(), {})
+
+    def test_api_writes(self):
+        deposit = self.client.post('/api/deposits/', {'amount': '10000'}).json()
+        self.client.patch(f"/api/deposits/{deposit['id']}/", {'amount': '12000'})
+        self.client.post('/api/deposits/', {'amount': '500'})
+        self.fill('buy', '10', '100.333')
+        self.fill('buy', '3', '101.1')
+        self.fill('sell', '4', '120.07')
+        expiration = (date.today() + timedelta(days=30)).isoformat()
+        self.fill('buy', '2', '3.15', strike_price='100', expiration_date=expiration, option_type='C')
+        self.fill('sell', '1', '4.2', strike_price='100', expiration_date=expiration, option_type='C')
+        self.assertLedgerMatches()
+        self.assertEqual(ledger.get_totals().total_deposits, Decimal('12500'))
+
+    def test_admin_writes(self):
+        deposits = DepositAdmin(Deposit, admin.site)
+        deposit = Deposit(amount=Decimal('1000'))
+        deposits.save_model(self.admin_request, deposit, None, change=False)
+        deposit.amount = Decimal('1500')
+        deposits.save_model(self.admin_request, deposit, None, change=True)
+        gains = RealizedGainAdmin(RealizedGain, admin.site)
+        gain = RealizedGain(instrument_name='AAPL', realized_pnl=Decimal('12.34'))
+        gains.save_model(self.admin_request, gain, None, change=False)
+        gains.delete_queryset(self.admin_request, RealizedGain.objects.all())
+        transactions = TransactionAdmin(Transaction, admin.site)
+        trade = Transaction(instrument=Stock.objects.create(symbol='AAPL'), transaction_type='buy',
+                            quantity=Decimal('2'), price=Decimal('50'))
+        with mock.patch.object(tasks.replay_transaction_log, 'delay'):
+            transactions.save_model(self.admin_request, trade, None, change=False)
+        self.assertLedgerMatches()
+        self.assertEqual(ledger.get_totals().free_cash, Decimal('1400'))
+
+    def test_ledger_totals_are_read_only_in_admin(self):
+        totals_admin = admin.site._registry[LedgerTotals]
+        self.assertFalse(totals_admin.has_change_permission(self.admin_request))
+        self.assertFalse(totals_admin.has_delete_permission(self.admin_request))
+
+    def test_backfill_command_books_its_transactions(self):
+        Holding.objects.create(instrument=Stock.objects.create(symbol='AAPL'), quantity=Decimal('3'), cost_basis=Decimal('10'))
+        call_command('backfill', stdout=io.StringIO())
+        self.assertLedgerMatches()
+        self.assertEqual(ledger.get_totals().total_buy_cost, Decimal('30'))
+
+
+class FillIngestionTests(TestCase):
+    """apply_fills in one batch must give exactly what the same fills give one request at a time."""
+
+    FILLS = [
+        ('buy', '3000', '100.3333'), ('buy', '7000', '101.17'), ('sell', '4000', '120.07'),
+        ('buy', '11000', '99.99'), ('sell', '9000', '98.015'), ('buy', '3', '100'), ('sell', '2000', '101.4999'),
+    ]
+
+    def fills(self):
+        return [
+            {'transaction_type': side, 'quantity': Decimal(quantity), 'price': Decimal(price), 'symbol': 'AAPL'}
+            for side, quantity, price in self.FILLS
+        ]
+
+    def state(self):
+        return (
+            list(Holding.objects.values_list('quantity', 'cost_basis')),
+            list(RealizedGain.objects.order_by('id').values_list('realized_pnl', flat=True)),
+            ledger.get_totals().total_realized_pnl,
+        )
+
+    def test_batch_matches_sequential_fills(self):
+        with transaction.atomic():
+            apply_fills(self.fills())
+            batch = self.state()
+            transaction.set_rollback(True)
+        for fill in self.fills():
+            apply_fills([fill])
+        self.assertEqual(batch, self.state())
+
+    def test_ledger_realized_pnl_matches_gain_rows(self):
+        apply_fills(self.fills())
+        total = RealizedGain.objects.aggregate(total=Sum('realized_pnl'))['total']
+        self.assertEqual(ledger.get_totals().total_realized_pnl, total)
+
+
+class ReplayTests(TestCase):
+    """Replaying the Transaction log reproduces exactly the state the fills wrote."""
+
+    def setUp(self):
+        start = datetime(2024, 1, 2, 15, tzinfo=dt_timezone.utc)
+        expiration = date(2024, 6, 21)
+        fills = []
+        for i, (side, quantity, price) in enumerate(FillIngestionTests.FILLS * 3):
+            fills.append({'transaction_type': side, 'quantity': Decimal(quantity), 'price': Decimal(price),
+                          'symbol': 'AAPL', 'date': start + timedelta(days=i)})
+            fills.append({'transaction_type': 'buy' if i % 3 else 'sell' if i else 'buy', 'quantity': Decimal(2),
+                          'price': Decimal('3.1') + i, 'symbol': 'MSFT', 'strike_price': Decimal(400),
+                          'expiration_date': expiration, 'option_type': 'C', 'date': start + timedelta(days=i, hours=1)})
+        apply_fills(fills)
+        self.expected = self.state()
+
+    def state(self):
+        return (
+            sorted(Holding.objects.values_list('content_type_id', 'object_id', 'quantity', 'cost_basis')),
+            sorted(RealizedGain.objects.values_list('instrument_name', 'realized_pnl', 'date')),
+            ledger.verify_totals(),
+        )
+
+    def test_full_replay_matches_fills(self):
+        Holding.objects.all().delete()
+        replay_transactions()
+        self.assertEqual(self.state(), self.expected)
+
+    @mock.patch.object(settings, 'REPLAY_CHECKPOINT_INTERVAL', 5)
+    def test_replay_resumed_from_a_checkpoint_matches_fills(self):
+        self.assertGreater(replay_transactions()['checkpoints_saved'], 2)
+        since = Transaction.objects.order_by('date')[20].date
+        result = replay_transactions(since)
+        self.assertIsNotNone(result['resumed_from'])
+        self.assertLess(result['replayed'], result['transactions'])
+        self.assertEqual(self.state(), self.expected)
+
+    @mock.patch.object(settings, 'REPLAY_CHECKPOINT_INTERVAL', 5)
+    def test_resume_replaces_gains_dated_before_their_sell(self):
+        replay_transactions()
+        since = Transaction.objects.order_by('date')[20].date
+        checkpoint = ReplayCheckpoint.objects.filter(as_of__lte=since).order_by('-as_of').first()
+        # A gain whose sell is replayed but which is stamped a moment before the checkpoint.
+        gain = RealizedGain.objects.filter(transaction__date__gte=checkpoint.as_of).order_by('date').first()
+        gain.date = checkpoint.as_of - timedelta(seconds=1)
+        gain.save()
+        result = replay_transactions(since)
+        self.assertEqual(result['resumed_from'], checkpoint.as_of.isoformat())
+        self.assertEqual(self.state(), self.expected)
+
+    @mock.patch.object(settings, 'REPLAY_CHECKPOINT_INTERVAL', 5)
+    def test_unlinked_gains_force_a_full_replay(self):
+        self.assertFalse(RealizedGain.objects.filter(transaction__isnull=True).exists())
+        replay_transactions()
+        RealizedGain.objects.filter(id=RealizedGain.objects.order_by('-date').first().id).update(transaction=None)
+        result = replay_transactions(Transaction.objects.order_by('date')[20].date)
+        self.assertIsNone(result['resumed_from'])
+        self.assertEqual(self.state(), self.expected)
+        self.assertFalse(RealizedGain.objects.filter(transaction__isnull=True).exists())
+
+    def test_empty_bulk_post_writes_nothing(self):
+        response = APIClient().post('/api/transactions/bulk/', [], format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()['created'], 0)
+
+
+class SnapshotBackfillTests(TestCase):
+
+    def test_fetched_closes_are_stored_as_daily_bars(self):
+        stock = Stock.objects.create(symbol='AAPL')
+        start = date.today() - timedelta(days=4)
+        Transaction.objects.create(instrument=stock, transaction_type='buy', quantity=Decimal(2), price=Decimal(90),
+                                   date=datetime.combine(start, datetime.min.time(), tzinfo=dt_timezone.utc))
+        closes = [{'date': (start + timedelta(days=d)).isoformat(), 'price': 100.0 + d} for d in range(5)]
+        with mock.patch.object(tasks, 'fetch_benchmark_candles_from_alpha_vantage', return_value=closes):
+            call_command('backfill_snapshots', '--fetch-missing', stdout=io.StringIO())
+        self.assertFalse(BenchmarkCandle.objects.exists())
+        self.assertEqual(PriceBar.objects.filter(interval=PriceBar.DAILY, object_id=stock.id).count(), 5)
+        self.assertEqual(
+            list(PortfolioSnapshot.objects.order_by('date').values_list('total_value', flat=True)),
+            [Decimal(2 * (100 + d)) for d in range(5)],
+        )
+
+    def test_bars_count_toward_their_local_day(self):
+        stock = Stock.objects.create(symbol='AAPL')
+        stock_ct = ContentType.objects.get_for_model(Stock)
+        day = date(2024, 3, 1)
+        with timezone.override('America/New_York'):
+            Transaction.objects.create(instrument=stock, transaction_type='buy', quantity=Decimal(2), price=Decimal(90),
+                                       date=timezone.make_aware(datetime(2024, 3, 1, 10, 0)))
+            # 23:30 New York is already March 2 in UTC; 00:30 on March 2 is outside the range.
+            PriceBar.objects.bulk_create([
+                PriceBar(content_type=stock_ct, object_id=stock.id, timestamp=timezone.make_aware(timestamp),
+                         open=close, high=close, low=close, close=close)
+                for timestamp, close in ((datetime(2024, 3, 1, 23, 30), 110.0), (datetime(2024, 3, 2, 0, 30), 999.0))
+            ])
+            days, values = build_value_history(day, day)
+        self.assertEqual((days, values.tolist()), ([day], [220.0]))
+
+
+    @mock.patch.object(settings, 'BENCHMARK_SYMBOLS', ['AAPL'])
+    def test_migration_moves_stock_candles_without_losing_closes(self):
+        migration = import_module('portfolio_tracker.migrations.0013_move_stock_closes_to_price_bars')
+        aapl, _ = Stock.objects.create(symbol='AAPL'), Stock.objects.create(symbol='VOO')
+        stock_ct = ContentType.objects.get_for_model(Stock)
+        PriceBar.objects.create(content_type=stock_ct, object_id=aapl.id, interval=PriceBar.DAILY,
+                                timestamp=datetime(2024, 1, 2, tzinfo=dt_timezone.utc), open=99, high=99, low=99, close=99)
+        BenchmarkCandle.objects.bulk_create([
+            BenchmarkCandle(symbol='AAPL', date=date(2024, 1, 2), close=Decimal(100)),
+            BenchmarkCandle(symbol='AAPL', date=date(2024, 1, 3), close=Decimal(101)),
+            BenchmarkCandle(symbol='VOO', date=date(2024, 1, 3), close=Decimal(400)),
+        ])
+
+        migration.move_stock_closes(django_apps, None)
+
+        # Settings do not change what moves; the candle whose day already had a bar stays put.
+        self.assertEqual(sorted(BenchmarkCandle.objects.values_list('symbol', 'date')),
+                         [('AAPL', date(2024, 1, 2)), ('VOO', date(2024, 1, 3))])
+        self.assertEqual(
+            list(PriceBar.objects.filter(object_id=aapl.id).order_by('timestamp').values_list('close', flat=True)),
+            [99.0, 101.0],
+        )
+
+class PriceBarRecordingTests(TestCase):
+    """Price history is written where prices are stored, whether or not the broadcast runs."""
+
+    def bars(self, stock):
+        return list(PriceBar.objects.filter(object_id=stock.id, content_type=ContentType.objects.get_for_model(Stock))
+                    .values_list('close', flat=True))
+
+    def test_quote_update_records_a_bar(self):
+        stock = Stock.objects.create(symbol='AAPL', previous_close=Decimal(99))
+        with mock.patch.object(tasks, 'get_quote', return_value={'price': 101.5, 'previous_close': 99.0}), \
+                mock.patch.object(tasks, 'queue_price_update', side_effect=RedisError('down')):
+            tasks.update_stock_price(stock.id)
+        self.assertEqual(self.bars(stock), [101.5])
+
+    def test_chain_underlying_price_records_a_bar(self):
+        stock = Stock.objects.create(symbol='AAPL', last_price=Decimal(100))
+        with mock.patch.object(tasks, 'queue_price_update', return_value=False):
+            self.assertTrue(tasks._update_underlying_from_chain(stock, {'lastTradePrice': 102.25}, timezone.now()))
+        self.assertEqual(self.bars(stock), [102.25])
+
+    def test_roll_up_merges_into_an_existing_daily_bar(self):
+        stock = Stock.objects.create(symbol='AAPL')
+        other = Stock.objects.create(symbol='MSFT')
+        ct = ContentType.objects.get_for_model(Stock)
+        now = datetime(2024, 6, 3, 12, tzinfo=dt_timezone.utc)
+        day = datetime(2024, 3, 1, tzinfo=dt_timezone.utc)
+        PriceBar.objects.create(content_type=ct, object_id=stock.id, interval=PriceBar.DAILY, timestamp=day,
+                                open=100, high=100, low=100, close=100)
+        for hour, price in [(14, 95), (15, 105), (20, 102)]:
+            PriceBar.objects.create(content_type=ct, object_id=stock.id, timestamp=day.replace(hour=hour),
+                                    open=price, high=price, low=price, close=price)
+        for offset in range(3):
+            PriceBar.objects.create(content_type=ct, object_id=other.id, timestamp=day + timedelta(days=offset),
+                                    open=50, high=50, low=50, close=50)
+
+        with mock.patch.object(price_store, 'ROLL_UP_BATCH_SIZE', 1):
+            result = price_store.roll_up_bars(now)
+
+        self.assertEqual(result['raw_deleted'], 6)
+        self.assertFalse(PriceBar.objects.filter(interval=PriceBar.RAW).exists())
+        merged = PriceBar.objects.get(object_id=stock.id, interval=PriceBar.DAILY)
+        self.assertEqual((merged.open, merged.high, merged.low, merged.close), (100, 105, 95, 102))
+        self.assertEqual(PriceBar.objects.filter(object_id=other.id, interval=PriceBar.DAILY).count(), 3)
+
+
+class PortfolioHistoryTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        start = date(2024, 1, 1)
+        # A noisy series with one sharp spike, so the downsampled shape has something to keep.
+        self.values = [10000 + (d % 7) * 10 + (5000 if d == 123 else 0) for d in range(365)]
+        PortfolioSnapshot.objects.bulk_create([
+            PortfolioSnapshot(date=start + timedelta(days=d), total_value=Decimal(v)) for d, v in enumerate(self.values)
+        ])
+
+    def test_downsampling_keeps_endpoints_extremes_and_size(self):
+        rows = self.client.get('/api/portfolio-history/?from=2024-01-01&to=2024-12-30&points=50').json()
+        self.assertEqual(len(rows), 50)
+        self.assertEqual(rows[0]['date'], '2024-01-01')
+        self.assertEqual(rows[-1]['date'], '2024-12-30')
+        self.assertIn(f'{max(self.values)}.0000', [row['value'] for row in rows])
+        self.assertEqual([row['date'] for row in rows], sorted(row['date'] for row in rows))
+
+    def test_short_range_is_not_downsampled(self):
+        rows = self.client.get('/api/portfolio-history/?from=2024-01-01&to=2024-01-10&points=50').json()
+        self.assertEqual(len(rows), 10)
+
+    def test_lttb_indices(self):
+        x = np.arange(1000, dtype=float)
+        y = np.sin(x / 50)
+        selected = lttb(x, y, 100)
+        self.assertEqual(len(selected), 100)
+        self.assertEqual((selected[0], selected[-1]), (0, 999))
+        self.assertTrue(np.all(np.diff(selected) > 0))
+        self.assertEqual(list(lttb(x[:10], y[:10], 100)), list(range(10)))
+
+    def test_unchanged_history_is_not_modified(self):
+        url = '/api/portfolio-history/?from=2024-01-01&points=50'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_bad_dates_are_rejected(self):
+        response = self.client.get('/api/portfolio-history/?from=bad')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'from/to must be YYYY-MM-DD dates.'})
+        snapshot_id = PortfolioSnapshot.objects.values_list('id', flat=True).first()
+        response = self.client.get(f'/api/portfolio-history/{snapshot_id}/?from=bad')
+        self.assertEqual(response.status_code, 200, response.content)
+
+
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        stock = Stock.objects.create(symbol='AAPL')
+        # Three timestamps shared by many rows, so pages split inside runs of equal dates.
+        when = [datetime(2024, 1, 2 + i % 3, tzinfo=dt_timezone.utc) for i in range(47)]
+        Transaction.objects.bulk_create([
+            Transaction(instrument=stock, transaction_type='buy', quantity=Decimal(1), price=Decimal(i), date=when[i])
+            for i in range(47)
+        ])
+        Option.objects.bulk_create([
+            Option(underlying_stock=stock, strike_price=Decimal(100 + i % 2), expiration_date=date(2024, 6, 21),
+                   option_type='C' if i % 4 < 2 else 'P')
+            for i in range(4)
+        ] + [
+            Option(underlying_stock=Stock.objects.create(symbol=f'S{i}'), strike_price=Decimal(100),
+                   expiration_date=date(2024, 6, 21), option_type='C')
+            for i in range(5)
+        ])
+
+    def walk(self, url):
+        ids, pages = [], 0
+        while url:
+            body = self.client.get(url).json()
+            ids += [row['id'] for row in body['results']]
+            url, pages = body['next'], pages + 1
+        return ids, pages
+
+    def test_cursors_return_every_row_once_when_keys_tie(self):
+        for url, queryset in (('/api/transactions/?page_size=4', Transaction.objects.order_by('date', 'id')),
+                              ('/api/options/?page_size=2', Option.objects.order_by('expiration_date', 'strike_price', 'id'))):
+            ids, pages = self.walk(url)
+            self.assertEqual(ids, list(queryset.values_list('id', flat=True)), url)
+            self.assertEqual(pages, -(-queryset.count() // int(url.rsplit('=', 1)[1])), url)
+
+    def test_stream_matches_the_unstreamed_list(self):
+        for url in ('/api/transactions/', '/api/options/', '/api/deposits/'):
+            response = self.client.get(f'{url}?stream=1')
+            self.assertTrue(response.streaming)
+            streamed = json.loads(b''.join(response.streaming_content))
+            self.assertEqual(sorted(streamed, key=lambda row: row['id']),
+                             sorted(self.client.get(url).json(), key=lambda row: row['id']), url)
+
+    @mock.patch.object(settings, 'STREAMING_CHUNK_SIZE', 10)
+    async def test_asgi_stream_is_async_and_matches_the_list(self):
+        response = await self.async_client.get('/api/transactions/?stream=1')
+        self.assertTrue(response.is_async)
+        streamed = json.loads(b''.join([chunk async for chunk in response.streaming_content]))
+        expected = (await self.async_client.get('/api/transactions/')).json()
+        self.assertEqual(len(streamed), 47)
+        self.assertEqual(sorted(streamed, key=lambda row: row['id']), sorted(expected, key=lambda row: row['id']))
+
+
+@mock.patch.object(settings, 'WEBSOCKET_PRESENCE_TTL', 90)
+class SubscriberPresenceTests(TestCase):
+    """Each web process's subscriber counts live in their own expiring hash."""
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        for patcher in (mock.patch.object(polling, 'get_redis_client', return_value=self.redis),
+                        mock.patch.object(polling, '_subscribers', Counter())):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_counts_are_per_process_and_expire(self):
+        with mock.patch.object(polling, 'PROCESS_ID', 'web-1'):
+            polling.track_subscribers(['AAPL', 'MSFT'], 1)
+        with mock.patch.object(polling, 'PROCESS_ID', 'web-2'), \
+                mock.patch.object(polling, '_subscribers', Counter()):
+            polling.track_subscribers(['TSLA'], 1)
+        self.assertEqual(polling.subscribed_symbols(), {'AAPL', 'MSFT', 'TSLA'})
+        self.assertEqual(self.redis.ttls[f"{polling.SUBSCRIBERS_KEY}:web-1"], 90)
+
+        # web-2 died without disconnecting: once its TTL lapses it no longer boosts TSLA.
+        self.redis.delete(f"{polling.SUBSCRIBERS_KEY}:web-2")
+        self.assertEqual(polling.subscribed_symbols(), {'AAPL', 'MSFT'})
+
+    def test_unsubscribing_drops_the_symbol(self):
+        polling.track_subscribers(['AAPL'], 1)
+        polling.track_subscribers(['AAPL'], 1)
+        polling.track_subscribers(['AAPL'], -1)
+        self.assertEqual(polling.subscribed_symbols(), {'AAPL'})
+        polling.track_subscribers(['AAPL'], -1)
+        self.assertEqual(polling.subscribed_symbols(), set())
+
+
+class TokenBucketTests(TestCase):
+
+    def setUp(self):
+        self.limiter = TokenBucketRateLimiter('test', [(2, 1)])
+
+    def test_acquire_sleeps_until_a_token_is_free(self):
+        with mock.patch.object(self.limiter, 'try_acquire', side_effect=[0.25, 0.0]), \
+                mock.patch.object(rate_limiter.time, 'sleep') as sleep:
+            self.limiter.acquire(timeout=1)
+        sleep.assert_called_once_with(0.25)
+
+    def test_acquire_gives_up_instead_of_waiting_past_the_timeout(self):
+        with mock.patch.object(self.limiter, 'try_acquire', return_value=5.0), \
+                mock.patch.object(rate_limiter.time, 'sleep') as sleep:
+            with self.assertRaises(RateLimitTimeout) as raised:
+                self.limiter.acquire(timeout=1)
+        self.assertEqual(raised.exception.retry_after, 5.0)
+        sleep.assert_not_called()
+
+    def redis_limiter(self, limits):
+        # The Lua script needs a real Redis; skip where none is running.
+        client = get_redis_client()
+        try:
+            client.ping()
+        except RedisError:
+            self.skipTest("Redis is not reachable")
+        limiter = TokenBucketRateLimiter(f'test-{uuid.uuid4().hex}', limits)
+        self.addCleanup(client.delete, *limiter.keys)
+        return limiter
+
+    def test_bucket_refills_at_its_rate(self):
+        limiter = self.redis_limiter([(2, 0.2)])
+        self.assertEqual([limiter.try_acquire(), limiter.try_acquire()], [0, 0])
+        wait = limiter.try_acquire()
+        self.assertTrue(0 < wait <= 0.1, wait)
+        time.sleep(wait + 0.02)
+        self.assertEqual(limiter.try_acquire(), 0)
+
+    def test_tightest_bucket_wins(self):
+        limiter = self.redis_limiter([(10, 1), (1, 60)])
+        self.assertEqual(limiter.try_acquire(), 0)
+        self.assertGreater(limiter.try_acquire(), 1)
+
+
+class PreviousCloseRolloverTests(TestCase):
+
+    @mock.patch.object(settings, 'PREVIOUS_CLOSE_ROLLOVER_CHUNK_SIZE', 2)
+    def test_rolls_priced_stocks_and_unexpired_options(self):
+        stocks = [Stock.objects.create(symbol=f'S{i}', last_price=Decimal(10 + i), previous_close=Decimal(9))
+                  for i in range(5)]
+        Stock.objects.create(symbol='NOPRICE', previous_close=Decimal(7))
+        Stock.objects.create(symbol='ROLLED', last_price=Decimal(5), previous_close=Decimal(5))
+        live, expired = Option.objects.bulk_create(
+            Option(underlying_stock=stocks[0], strike_price=Decimal(100), expiration_date=expiration, option_type='C',
+                   last_price=Decimal('2.5'), previous_close=Decimal(2))
+            for expiration in (date.today() + timedelta(days=30), date.today() - timedelta(days=1))
+        )
+
+        result = tasks.roll_previous_close_prices()
+
+        self.assertEqual((result['stocks'], result['options']), (5, 1))
+        self.assertEqual(
+            list(Stock.objects.order_by('id').values_list('previous_close', flat=True)),
+            [Decimal(10 + i) for i in range(5)] + [Decimal(7), Decimal(5)],
+        )
+        self.assertEqual(Option.objects.get(id=live.id).previous_close, Decimal('2.5'))
+        self.assertEqual(Option.objects.get(id=expired.id).previous_close, Decimal(2))
+        self.assertEqual(tasks.roll_previous_close_prices()['stocks'], 0)
+
+
+class ValuationTests(TestCase):
+
+    def test_figures_per_position_and_totals(self):
+        stock = Stock.objects.create(symbol='AAPL', last_price=Decimal(60), previous_close=Decimal(55))
+        unpriced = Stock.objects.create(symbol='NEW')
+        option = Option.objects.create(underlying_stock=stock, strike_price=Decimal(50), expiration_date=date(2030, 1, 18),
+                                       option_type='C', last_price=Decimal(2))
+        Holding.objects.create(instrument=stock, quantity=Decimal(10), cost_basis=Decimal(50))
+        Holding.objects.create(instrument=option, quantity=Decimal(2), cost_basis=Decimal('1.5'))
+        Holding.objects.create(instrument=unpriced, quantity=Decimal(3), cost_basis=Decimal(20))
+
+        valuation = value_holdings()
+        rows = valuation.rows()
+
+        self.assertEqual([row['instrument_name'] for row in rows], ['AAPL', str(option), 'NEW'])
+        fields = ('market_value', 'cost', 'unrealized_pnl', 'day_pnl', 'day_change')
+        self.assertEqual([tuple(row[f] for f in fields) for row in rows], [
+            (600.0, 500.0, 100.0, 50.0, 5.0),
+            # Options count 100 shares per contract; no previous close means no day P&L.
+            (400.0, 300.0, 100.0, 0.0, None),
+            # No price yet: the position is worth nothing rather than its cost.
+            (0.0, 60.0, 0.0, 0.0, None),
+        ])
+        self.assertAlmostEqual(rows[0]['day_change_percent'], 5 / 55 * 100)
+        self.assertEqual(valuation.totals(),
+                         {'market_value': 1000.0, 'cost': 860.0, 'unrealized_pnl': 200.0, 'day_pnl': 50.0})
+
+
+class MarketCalendarTests(TestCase):
+
+    def test_holidays(self):
+        self.assertEqual(sorted(market_calendar.holidays(2024)), [
+            date(2024, 1, 1), date(2024, 1, 15), date(2024, 2, 19), date(2024, 3, 29), date(2024, 5, 27),
+            date(2024, 6, 19), date(2024, 7, 4), date(2024, 9, 2), date(2024, 11, 28), date(2024, 12, 25),
+        ])
+        # A Saturday July 4 is observed on the Friday; a Saturday New Year's Day is not observed at all.
+        self.assertIn(date(2026, 7, 3), market_calendar.holidays(2026))
+        self.assertNotIn(date(2021, 12, 31), market_calendar.holidays(2021))
+        self.assertNotIn(date(2022, 12, 30), market_calendar.holidays(2022))
+        self.assertTrue(market_calendar.is_trading_day(date(2021, 12, 31)))
+
+    def test_early_closes(self):
+        self.assertEqual(market_calendar.early_closes(2024), {date(2024, 7, 3), date(2024, 11, 29), date(2024, 12, 24)})
+        # July 3, 2026 is the observed Independence Day, not a half day.
+        self.assertNotIn(date(2026, 7, 3), market_calendar.early_closes(2026))
+
+    def test_sessions(self):
+        at = lambda *args: datetime(*args, tzinfo=market_calendar.EASTERN)
+        self.assertEqual(market_calendar.session_at(at(2024, 7, 5, 3, 59)), market_calendar.CLOSED)
+        self.assertEqual(market_calendar.session_at(at(2024, 7, 5, 4, 0)), market_calendar.PRE_MARKET)
+        self.assertEqual(market_calendar.session_at(at(2024, 7, 5, 15, 59)), market_calendar.REGULAR)
+        self.assertEqual(market_calendar.session_at(at(2024, 7, 5, 16, 0)), market_calendar.AFTER_HOURS)
+        self.assertEqual(market_calendar.session_at(at(2024, 7, 4, 12, 0)), market_calendar.CLOSED)
+        self.assertEqual(market_calendar.session_at(at(2024, 11, 29, 13, 30)), market_calendar.AFTER_HOURS)
+        self.assertEqual(market_calendar.session_at(at(2024, 11, 29, 17, 0)), market_calendar.CLOSED)
+        # Thursday evening before Good Friday: next quotes on Monday's pre-market.
+        self.assertEqual(market_calendar.next_session_start(at(2024, 3, 28, 21, 0)), at(2024, 4, 1, 4, 0))
+
+    @mock.patch.object(settings, 'MARKET_EXTRA_CLOSURES', ['2025-01-09'])
+    def test_extra_closures(self):
+        self.assertFalse(market_calendar.is_trading_day(date(2025, 1, 9)))
+        self.assertIsNone(market_calendar.session_bounds(date(2025, 1, 9)))
+
+
+class JsonStreamReaderTests(TestCase):
+    DOCUMENT = {
+        'meta': {'symbol': 'AAPL', 'note': 'caf\u00e9 \u20ac', 'empty': {}, 'none': []},
+        'data': [{'strike': 12.5e3, 'bid': -0.25, 'ok': True, 'tag': None}, 7, [1, [2, 3]], '\u2603'],
+        'count': 1234567,
+    }
+
+    def walk(self, reader):
+        # Rebuilds the document through members() for objects and items() for top-level arrays.
+        if reader.peek() == '{':
+            return {key: self.walk(reader) for key in reader.members()}
+        if reader.peek() == '[':
+            return list(reader.items())
+        return reader.value()
+
+    def test_any_chunk_split_reads_the_same_document(self):
+        raw = json.dumps(self.DOCUMENT, ensure_ascii=False).encode()
+        for size in (1, 2, 3, 5, 8, 64):
+            chunks = [raw[i:i + size] for i in range(0, len(raw), size)]
+            self.assertEqual(self.walk(JsonStreamReader(chunks)), self.DOCUMENT, size)
+
+    def test_truncated_input_raises(self):
+        with self.assertRaises(ValueError):
+            list(JsonStreamReader([b'[1, 2', b'.5']).items())
+
+
+class GreeksTests(TestCase):
+    RATE, DIVIDEND = 0.04, 0.01
+
+    def contracts(self):
+        spot, strike, years, sigma, is_call = np.meshgrid(
+            [100.0], [70.0, 95.0, 100.0, 110.0, 140.0], [0.1, 0.5, 2.0], [0.15, 0.4, 0.9], [True, False],
+        )
+        return spot.ravel(), strike.ravel(), years.ravel(), sigma.ravel(), is_call.ravel()
+
+    def test_implied_volatility_round_trips(self):
+        spot, strike, years, sigma, is_call = self.contracts()
+        price = greeks.bs_price(spot, strike, years, self.RATE, self.DIVIDEND, sigma, is_call)
+        solved = greeks.implied_volatility(price, spot, strike, years, self.RATE, self.DIVIDEND, is_call)
+        # Far from the money the time value is below the price tolerance and pins nothing down,
+        # so only contracts with a usable vega must recover their volatility; all must reprice.
+        usable = greeks.greeks(spot, strike, years, self.RATE, self.DIVIDEND, sigma, is_call)['vega'] > 1e-4
+        self.assertGreater(usable.sum(), 60)
+        np.testing.assert_allclose(solved[usable], sigma[usable], rtol=1e-4)
+        repriced = greeks.bs_price(spot, strike, years, self.RATE, self.DIVIDEND, solved, is_call)
+        np.testing.assert_allclose(repriced, price, rtol=1e-6, atol=1e-6)
+
+    def test_prices_outside_the_no_arbitrage_bounds_have_no_volatility(self):
+        one = lambda value: np.array([value])
+        for price in (0.0, 150.0, np.nan):
+            solved = greeks.implied_volatility(one(price), one(100.0), one(100.0), one(0.5), self.RATE, self.DIVIDEND,
+                                               one(True))
+            self.assertTrue(np.isnan(solved[0]), price)
+
+    def test_greeks_match_finite_differences(self):
+        spot, strike, years, sigma, is_call = self.contracts()
+        r, q = self.RATE, self.DIVIDEND
+        price = lambda s=spot, t=years, rate=r, v=sigma: greeks.bs_price(s, strike, t, rate, q, v, is_call)
+        delta = lambda s: greeks.greeks(s, strike, years, r, q, sigma, is_call)['delta']
+        h = 1e-3
+        expected = {
+            'delta': (price(s=spot + h) - price(s=spot - h)) / (2 * h),
+            'gamma': (delta(spot + h) - delta(spot - h)) / (2 * h),
+            'vega': (price(v=sigma + h) - price(v=sigma - h)) / (2 * h) / 100,
+            'theta': -(price(t=years + h) - price(t=years - h)) / (2 * h) / 365,
+            'rho': (price(rate=r + h) - price(rate=r - h)) / (2 * h) / 100,
+        }
+        computed = greeks.greeks(spot, strike, years, r, q, sigma, is_call)
+        for name, values in expected.items():
+            np.testing.assert_allclose(computed[name], values, rtol=1e-3, atol=1e-6, err_msg=name)
+
+    @override_settings(GREEKS_CACHE_SECONDS=60)
+    def test_cached_result_is_a_copy_with_a_fresh_as_of(self):
+        first = datetime(2024, 6, 3, 15, tzinfo=dt_timezone.utc)
+        second = first + timedelta(seconds=30)
+        with mock.patch.object(greeks, '_last_result', (None, None)), \
+                mock.patch.object(greeks.time, 'time', return_value=1_717_426_800), \
+                mock.patch.object(greeks.timezone, 'now', side_effect=[first, second]):
+            solved = greeks.portfolio_greeks()
+            solved['totals'] = None
+            cached = greeks.portfolio_greeks()
+        self.assertEqual(cached['as_of'], second.isoformat())
+        self.assertEqual(cached['computed_at'], first.isoformat())
+        self.assertEqual(cached['totals']['positions'], 0)
@@ -12,6 +12,7 @@ router.register(r'portfolio-history', views.PortfolioHistoryViewSet, basename='p
 # --- NEW ENDPOINTS REGISTERED HERE ---
 router.register(r'deposits', views.DepositViewSet, basename='deposit')
 router.register(r'transactions', views.TransactionViewSet, basename='transaction')
+router.register(r'allocation-targets', views.AllocationTargetViewSet)
 
 urlpatterns = [
     # The router now automatically handles all URL patterns for the ViewSets
@@ -20,5 +21,8 @@ urlpatterns = [
     # Add the new path for the summary data view
     path('portfolio-summary/', views.portfolio_summary_view, name='portfolio-summary'),
     path('benchmark-history/', views.benchmark_history_view, name='benchmark-history'),
+    path('option-greeks/', views.option_greeks_view, name='option-greeks'),
+    path('portfolio-risk/', views.portfolio_risk_view, name='portfolio-risk'),
+    path('rebalance/', views.rebalance_view, name='rebalance'),
 ]
 
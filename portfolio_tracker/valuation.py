@@ -0,0 +1,198 @@
+# portfolio_tracker/valuation.py
+from typing import List
+
+import numpy as np
+from django.contrib.contenttypes.models import ContentType
+
+from .models import Stock, Option, Holding
+
+# One listed equity option contract covers 100 shares.
+OPTION_CONTRACT_MULTIPLIER = 100
+
+
+def to_array(values) -> np.ndarray:
+    return np.array([np.nan if v is None else float(v) for v in values], dtype=float)
+
+
+def to_list(array: np.ndarray) -> list:
+    """Plain floats for JSON, with None where the array has NaN or inf."""
+    return [v if np.isfinite(v) else None for v in array.tolist()]
+
+
+class PortfolioValuation:
+    """
+    Valuation of a set of holdings. Every per-position figure is a NumPy array
+    aligned with `positions`; positions without a last price are worth 0 and
+    contribute nothing to P&L, positions without a previous close have no day P&L.
+    """
+
+    def __init__(self, positions: List[dict], quantity, cost_basis, last_price, previous_close, multiplier):
+        self.positions = positions
+        self.quantity = quantity
+        self.cost_basis = cost_basis
+        self.last_price = last_price
+        self.previous_close = previous_close
+        self.multiplier = multiplier
+
+        has_price = ~np.isnan(last_price)
+        has_previous = has_price & ~np.isnan(previous_close)
+        self.cost = quantity * cost_basis * multiplier
+        self.market_value = np.where(has_price, quantity * np.nan_to_num(last_price) * multiplier, 0.0)
+        self.unrealized_pnl = np.where(has_price, self.market_value - self.cost, 0.0)
+        self.day_pnl = np.where(
+            has_previous,
+            quantity * (np.nan_to_num(last_price) - np.nan_to_num(previous_close)) * multiplier,
+            0.0,
+        )
+
+    @property
+    def total_market_value(self) -> float:
+        return float(self.market_value.sum())
+
+    @property
+    def total_cost(self) -> float:
+        return float(self.cost.sum())
+
+    @property
+    def total_unrealized_pnl(self) -> float:
+        return float(self.unrealized_pnl.sum())
+
+    @property
+    def total_day_pnl(self) -> float:
+        return float(self.day_pnl.sum())
+
+    def rows(self) -> List[dict]:
+        """
+        Per-position dicts ready for a Response. day_change is the per-unit
+        price move since the previous close, day_pnl the position's share of it.
+        """
+        day_change = self.last_price - self.previous_close
+        with np.errstate(divide='ignore', invalid='ignore'):
+            day_change_percent = day_change / self.previous_close * 100
+        columns = {
+            'quantity': to_list(self.quantity),
+            'cost_basis': to_list(self.cost_basis),
+            'last_price': to_list(self.last_price),
+            'previous_close': to_list(self.previous_close),
+            'day_change': to_list(day_change),
+            'day_change_percent': to_list(day_change_percent),
+            'market_value': to_list(self.market_value),
+            'cost': to_list(self.cost),
+            'unrealized_pnl': to_list(self.unrealized_pnl),
+            'day_pnl': to_list(self.day_pnl),
+        }
+        return [
+            {**position, **{name: values[i] for name, values in columns.items()}}
+            for i, position in enumerate(self.positions)
+        ]
+
+    def totals(self) -> dict:
+        return {
+            'market_value': self.total_market_value,
+            'cost': self.total_cost,
+            'unrealized_pnl': self.total_unrealized_pnl,
+            'day_pnl': self.total_day_pnl,
+        }
+
+
+def value_holdings(holdings=None) -> PortfolioValuation:
+    """
+    Values `holdings` (default: every Holding) without touching the
+    GenericForeignKey: one query for the holdings and one price query per
+    instrument type, however many positions there are.
+    """
+    if holdings is None:
+        holdings = Holding.objects.all()
+    content_types = ContentType.objects.get_for_models(Stock, Option)
+    stock_ct, option_ct = content_types[Stock].id, content_types[Option].id
+
+    rows = list(holdings.order_by('id').values_list('id', 'content_type_id', 'object_id', 'quantity', 'cost_basis'))
+    stock_ids = [object_id for _, ct, object_id, _, _ in rows if ct == stock_ct]
+    option_ids = [object_id for _, ct, object_id, _, _ in rows if ct == option_ct]
+
+    prices = {}
+    if stock_ids:
+        for pk, symbol, last, previous in Stock.objects.filter(id__in=stock_ids).values_list(
+            'id', 'symbol', 'last_price', 'previous_close'
+        ):
+            prices[(stock_ct, pk)] = ('stock', symbol, last, previous, 1)
+    if option_ids:
+        for pk, symbol, expiration, strike, option_type, last, previous in Option.objects.filter(
+            id__in=option_ids
+        ).values_list(
+            'id', 'underlying_stock__symbol', 'expiration_date', 'strike_price', 'option_type',
+            'last_price', 'previous_close',
+        ):
+            name = Option.format_name(symbol, expiration, strike, option_type)
+            prices[(option_ct, pk)] = ('option', name, last, previous, OPTION_CONTRACT_MULTIPLIER)
+
+    positions, last_prices, previous_closes, multipliers = [], [], [], []
+    for holding_id, ct, object_id, _, _ in rows:
+        instrument_type, name, last, previous, multiplier = prices.get((ct, object_id), (None, None, None, None, 1))
+        positions.append({
+            'holding_id': holding_id,
+            'instrument_type': instrument_type,
+            'object_id': object_id,
+            'instrument_name': name,
+        })
+        last_prices.append(last)
+        previous_closes.append(previous)
+        multipliers.append(multiplier)
+
+    return PortfolioValuation(
+        positions,
+        quantity=to_array(row[3] for row in rows),
+        cost_basis=to_array(row[4] for row in rows),
+        last_price=to_array(last_prices),
+        previous_close=to_array(previous_closes),
+        multiplier=np.array(multipliers, dtype=float),
+    )
+
+
+def option_rows(options=None) -> List[dict]:
+    """
+    Denormalized rows for `options` (default: every Option) with their
+    underlying symbol, prices, day change and, for held contracts, the
+    position's quantity, cost and P&L. Two queries: the contracts through
+    values() and the option holdings; no model instances are built.
+    """
+    if options is None:
+        options = Option.objects.all()
+    option_ct = ContentType.objects.get_for_model(Option).id
+
+    contracts = list(options.values_list(
+        'id', 'underlying_stock_id', 'underlying_stock__symbol', 'expiration_date', 'strike_price',
+        'option_type', 'last_price', 'previous_close',
+    ))
+    held = {}
+    for object_id, quantity, cost_basis in Holding.objects.filter(content_type_id=option_ct).values_list(
+        'object_id', 'quantity', 'cost_basis'
+    ):
+        # Several holdings of one contract fold into one quantity-weighted position.
+        total_quantity, total_cost = held.get(object_id, (0, 0))
+        held[object_id] = (total_quantity + quantity, total_cost + quantity * cost_basis)
+
+    positions, quantities, cost_bases = [], [], []
+    for pk, underlying_id, symbol, expiration, strike, option_type, _, _ in contracts:
+        quantity, cost = held.get(pk, (0, 0))
+        positions.append({
+            'id': pk,
+            'instrument_type': 'option',
+            'instrument_name': Option.format_name(symbol, expiration, strike, option_type),
+            'underlying_stock': underlying_id,
+            'underlying_symbol': symbol,
+            'expiration_date': expiration,
+            'strike_price': float(strike),
+            'option_type': option_type,
+        })
+        quantities.append(quantity)
+        cost_bases.append(cost / quantity if quantity else 0)
+
+    return PortfolioValuation(
+        positions,
+        quantity=to_array(quantities),
+        cost_basis=to_array(cost_bases),
+        last_price=to_array(row[6] for row in contracts),
+        previous_close=to_array(row[7] for row in contracts),
+        multiplier=np.full(len(contracts), OPTION_CONTRACT_MULTIPLIER, dtype=float),
+    ).rows()
@@ -1,149 +1,335 @@
+import hashlib
+import hmac
+import math
 from datetime import date, timedelta
-from decimal import Decimal
-from django.forms import DecimalField
+import numpy as np
 from rest_framework import viewsets, status
-from rest_framework.decorators import api_view
+from rest_framework.decorators import action, api_view
 from rest_framework.response import Response
 
-from .data_fetcher import fetch_benchmark_candles_from_alpha_vantage
 from .models import (
-    PortfolioSnapshot, Stock, Option, Holding, Deposit, Transaction, RealizedGain
+    PortfolioSnapshot, Stock, Option, Holding, Deposit, Transaction, BenchmarkCandle,
+    AllocationTarget,
 )
 from .serializers import (
     PortfolioSnapshotSerializer, StockSerializer, OptionSerializer, HoldingSerializer,
-    DepositSerializer, TransactionSerializer, RealizedGainSerializer
+    DepositSerializer, TransactionSerializer, AllocationTargetSerializer,
 )
+from . import ledger
+from .allocation import RebalanceError, rebalance
+from .history import lttb
+from .ingestion import FillError, apply_fills
+from .pagination import DateKeysetPagination, OptionKeysetPagination, StreamingListMixin
+from . import metrics
+from .greeks import portfolio_greeks
+from .risk import portfolio_risk
+from .tasks import replay_transaction_log
+from .valuation import option_rows, value_holdings
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
-from django.db.models import Sum, F, DecimalField, Case, When, Value
+from django.db import transaction
+from django.db.models import Count, Max
+from django.http import HttpResponse
+from redis import RedisError
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 
 class StockViewSet(viewsets.ModelViewSet):
     queryset = Stock.objects.all()
     serializer_class = StockSerializer
 
-class OptionViewSet(viewsets.ModelViewSet):
-    queryset = Option.objects.all()
+class OptionViewSet(StreamingListMixin, viewsets.ModelViewSet):
+    # instrument_name is built from the underlying's symbol
+    queryset = Option.objects.select_related('underlying_stock')
     serializer_class = OptionSerializer
+    pagination_class = OptionKeysetPagination
+
+    def list(self, request, *args, **kwargs):
+        """?view=positions returns denormalized rows with held quantity and P&L (see valuation.option_rows)."""
+        if request.query_params.get('view') == 'positions':
+            return Response(option_rows(self.filter_queryset(self.get_queryset())))
+        return super().list(request, *args, **kwargs)
 
 class HoldingViewSet(viewsets.ModelViewSet):
     queryset = Holding.objects.all()
     serializer_class = HoldingSerializer
 
+    def list(self, request, *args, **kwargs):
+        """
+        ?view=positions returns one denormalized row per holding (instrument
+        name and type, prices, market value, day change and P&L) built from
+        values() queries, one per instrument type, instead of serializers.
+        """
+        if request.query_params.get('view') == 'positions':
+            return Response(value_holdings(self.filter_queryset(self.get_queryset())).rows())
+        return super().list(request, *args, **kwargs)
+
 class PortfolioHistoryViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Daily portfolio values. ?from= / ?to= (YYYY-MM-DD) pick the range, which
+    defaults to the last 30 days; ?points=N downsamples longer ranges to N
+    shape-preserving points (LTTB). Responses carry an ETag and Last-Modified
+    derived from the newest snapshot in range, so unchanged charts get a 304.
+    """
     serializer_class = PortfolioSnapshotSerializer
+
     def get_queryset(self):
-        thirty_days_ago = date.today() - timedelta(days=30)
-        return PortfolioSnapshot.objects.filter(date__gte=thirty_days_ago)
+        # The range is applied in list(); a snapshot is fetched by id whatever its date.
+        return PortfolioSnapshot.objects.all()
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.get_queryset()
+        params = request.query_params
+        try:
+            start = date.fromisoformat(params['from']) if params.get('from') else None
+            end = date.fromisoformat(params['to']) if params.get('to') else None
+        except ValueError:
+            return Response({"error": "from/to must be YYYY-MM-DD dates."}, status=status.HTTP_400_BAD_REQUEST)
+        if start is None and end is None:
+            start = date.today() - timedelta(days=30)
+        if start:
+            queryset = queryset.filter(date__gte=start)
+        if end:
+            queryset = queryset.filter(date__lte=end)
+        try:
+            points = int(request.query_params['points']) if request.query_params.get('points') else None
+        except ValueError:
+            return Response({"error": "points must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+        if points is not None and points < 3:
+            return Response({"error": "points must be at least 3."}, status=status.HTTP_400_BAD_REQUEST)
+
+        state = queryset.aggregate(count=Count('id'), last_modified=Max('updated_at'))
+        etag = quote_etag(hashlib.md5(
+            f"{state['count']}:{state['last_modified']}:{request.query_params.urlencode()}".encode()
+        ).hexdigest())
+        last_modified = int(state['last_modified'].timestamp()) if state['last_modified'] else None
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+
+        rows = list(queryset.order_by('date').values_list('date', 'total_value'))
+        if points is not None and len(rows) > points:
+            x = np.array([row[0].toordinal() for row in rows], dtype=float)
+            y = np.array([float(row[1]) for row in rows])
+            rows = [rows[i] for i in lttb(x, y, points)]
+
+        response = Response([
+            {'date': snapshot_date.isoformat(), 'value': str(total_value)} for snapshot_date, total_value in rows
+        ])
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
 
 # --- NEW VIEWSETS AND VIEWS ---
 
-class DepositViewSet(viewsets.ModelViewSet):
+class AllocationTargetViewSet(viewsets.ModelViewSet):
+    # symbols are prefetched so listing targets costs two queries
+    queryset = AllocationTarget.objects.prefetch_related('stocks')
+    serializer_class = AllocationTargetSerializer
+
+class DepositViewSet(StreamingListMixin, viewsets.ModelViewSet):
     queryset = Deposit.objects.all()
     serializer_class = DepositSerializer
+    pagination_class = DateKeysetPagination
+
+    # Every write also adjusts the ledger totals inside the same database transaction.
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            deposit = serializer.save()
+            ledger.record_deposit(deposit.amount)
 
-class TransactionViewSet(viewsets.ModelViewSet):
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            previous_amount = Deposit.objects.select_for_update().get(pk=serializer.instance.pk).amount
+            deposit = serializer.save()
+            ledger.record_deposit(deposit.amount - previous_amount)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+            ledger.record_deposit(instance.amount, sign=-1)
+
+class TransactionViewSet(StreamingListMixin, viewsets.ModelViewSet):
     queryset = Transaction.objects.all()
     serializer_class = TransactionSerializer
+    pagination_class = DateKeysetPagination
+
+    # Edits and deletes rewrite history, so holdings and realized gains are
+    # rebuilt by replaying the log from the earliest affected date.
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            is_option = instance.content_type_id == ContentType.objects.get_for_model(Option).id
+            instance.delete()
+            ledger.record_trade(instance.transaction_type, instance.quantity, instance.price, is_option, sign=-1)
+            since = instance.date.isoformat()
+            transaction.on_commit(lambda: replay_transaction_log.delay(since=since))
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            previous = Transaction.objects.select_for_update().get(pk=serializer.instance.pk)
+            is_option = previous.content_type_id == ContentType.objects.get_for_model(Option).id
+            ledger.record_trade(previous.transaction_type, previous.quantity, previous.price, is_option, sign=-1)
+            updated = serializer.save()
+            ledger.record_trade(updated.transaction_type, updated.quantity, updated.price, is_option)
+            since = min(previous.date, updated.date).isoformat()
+            transaction.on_commit(lambda: replay_transaction_log.delay(since=since))
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        data = serializer.validated_data
-
-        underlying_stock, _ = Stock.objects.get_or_create(symbol=data['symbol'].upper())
-        is_option = all(k in data and data[k] is not None for k in ['strike_price', 'expiration_date', 'option_type'])
-
-        if is_option:
-            instrument, _ = Option.objects.get_or_create(
-                underlying_stock=underlying_stock,
-                strike_price=data['strike_price'],
-                expiration_date=data['expiration_date'],
-                option_type=data['option_type'].upper()
-            )
-        else:
-            instrument = underlying_stock
-        
-        ctype = ContentType.objects.get_for_model(instrument)
-        quantity = data['quantity']
-        price = data['price']
-
-        if data['transaction_type'] == 'buy':
-            holding, created = Holding.objects.get_or_create(
-                content_type=ctype, object_id=instrument.id,
-                defaults={'quantity': 0, 'cost_basis': 0}
-            )
-            new_quantity = holding.quantity + quantity
-            new_total_cost = (holding.quantity * holding.cost_basis) + (quantity * price)
-            holding.cost_basis = new_total_cost / new_quantity
-            holding.quantity = new_quantity
-            holding.save()
-
-        elif data['transaction_type'] == 'sell':
-            try:
-                holding = Holding.objects.get(content_type=ctype, object_id=instrument.id)
-            except Holding.DoesNotExist:
-                return Response({"error": "No holding found to sell."}, status=status.HTTP_400_BAD_REQUEST)
-            
-            if quantity > holding.quantity:
-                return Response({"error": f"Cannot sell more than you own. You have {holding.quantity}."}, status=status.HTTP_400_BAD_REQUEST)
-
-            cost_of_sold_shares = holding.cost_basis * quantity
-            sale_proceeds = price * quantity
-            gain_or_loss = sale_proceeds - cost_of_sold_shares
-            RealizedGain.objects.create(instrument_name=str(instrument), realized_pnl=gain_or_loss)
-
-            holding.quantity -= quantity
-            if holding.quantity <= 0:
-                holding.delete()
-            else:
-                holding.save()
-
-        Transaction.objects.create(instrument=instrument, transaction_type=data['transaction_type'], quantity=quantity, price=price)
+        try:
+            apply_fills([serializer.validated_data])
+        except FillError as e:
+            return Response({"error": e.message}, status=status.HTTP_400_BAD_REQUEST)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        POST /transactions/bulk/ with a list of fills, e.g. a day's executions.
+        The fills are validated together and applied in order in a single
+        database transaction; if any fill fails, none are recorded.
+        """
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        try:
+            created = apply_fills(serializer.validated_data)
+        except FillError as e:
+            return Response({"error": e.message, "index": e.index}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(
+            {"created": len(created), "transactions": self.get_serializer(created, many=True).data},
+            status=status.HTTP_201_CREATED,
+        )
+
 @api_view(['GET'])
 def portfolio_summary_view(request):
     """
-    Provides a summary of total deposits, total realized gains, and free cash.
+    Provides a summary of total deposits, total realized gains, free cash and
+    the current market value and P&L of all holdings. The cash figures come
+    from the incrementally maintained LedgerTotals row, so the cost does not
+    grow with trade history.
     """
-    total_deposits = Deposit.objects.aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
-    total_realized_gains = RealizedGain.objects.aggregate(total=Sum('realized_pnl'))['total'] or Decimal('0.00')
-
-    # --- CORRECTED FREE CASH CALCULATION ---
-    # Get the ContentType for the Option model
-    option_content_type = ContentType.objects.get_for_model(Option)
-
-    # Calculate total cost of buys with a conditional multiplier for options
-    total_buy_cost = Transaction.objects.filter(transaction_type='buy').aggregate(
-        total=Sum(
-            Case(
-                When(content_type=option_content_type, then=(F('price') * F('quantity') * Value(100))),
-                default=(F('price') * F('quantity')),
-                output_field=DecimalField()
-            )
-        )
-    )['total'] or Decimal('0.00')
-
-    # Calculate total proceeds from sells with a conditional multiplier for options
-    total_sell_proceeds = Transaction.objects.filter(transaction_type='sell').aggregate(
-        total=Sum(
-            Case(
-                When(content_type=option_content_type, then=(F('price') * F('quantity') * Value(100))),
-                default=(F('price') * F('quantity')),
-                output_field=DecimalField()
-            )
-        )
-    )['total'] or Decimal('0.00')
+    totals = ledger.get_totals()
+
+    valuation = value_holdings()
 
-    # Calculate free cash
-    free_cash = total_deposits - total_buy_cost + total_sell_proceeds
-    
     return Response({
-        "total_deposits": total_deposits,
-        "total_realized_gains": total_realized_gains,
-        "free_cash": free_cash,
+        "total_deposits": totals.total_deposits,
+        "total_realized_gains": totals.total_realized_pnl,
+        "free_cash": totals.free_cash,
+        "market_value": valuation.total_market_value,
+        "unrealized_pnl": valuation.total_unrealized_pnl,
+        "day_pnl": valuation.total_day_pnl,
     })
 
 @api_view(['GET'])
 def benchmark_history_view(request):
-    benchmark_data = fetch_benchmark_candles_from_alpha_vantage('VOO')
-    return Response(benchmark_data)
\ No newline at end of file
+    """
+    Daily benchmark closes from the BenchmarkCandle table, kept current by the
+    sync_benchmark_candles task. Accepts ?symbol= (default: the first
+    BENCHMARK_SYMBOLS entry) and optional ?from= / ?to= ISO dates.
+    """
+    symbol = request.query_params.get('symbol', settings.BENCHMARK_SYMBOLS[0]).strip().upper()
+    candles = BenchmarkCandle.objects.filter(symbol=symbol)
+    try:
+        if request.query_params.get('from'):
+            candles = candles.filter(date__gte=date.fromisoformat(request.query_params['from']))
+        if request.query_params.get('to'):
+            candles = candles.filter(date__lte=date.fromisoformat(request.query_params['to']))
+    except ValueError:
+        return Response({"error": "from/to must be YYYY-MM-DD dates."}, status=status.HTTP_400_BAD_REQUEST)
+
+    benchmark_data = [
+        {'date': candle_date.isoformat(), 'price': float(close)}
+        for candle_date, close in candles.order_by('date').values_list('date', 'close')
+    ]
+    return Response(benchmark_data)
+
+@api_view(['GET'])
+def option_greeks_view(request):
+    """
+    Implied volatility and Greeks of every held option, with delta-, gamma-,
+    theta- and vega-dollars per position, per underlying and in total
+    (see portfolio_tracker/greeks.py).
+    """
+    return Response(portfolio_greeks())
+
+def _finite_float(text: str) -> float:
+    # float() also accepts "nan" and "inf", which no calculation here can use and JSON cannot carry.
+    value = float(text)
+    if not math.isfinite(value):
+        raise ValueError(f"{text!r} is not a finite number")
+    return value
+
+@api_view(['GET'])
+def portfolio_risk_view(request):
+    """
+    Historical risk of the current holdings: parametric and historical VaR
+    and CVaR, beta to RISK_BENCHMARK_SYMBOL and max drawdown, plus each
+    factor's share (see portfolio_tracker/risk.py). ?horizon= sets the VaR
+    horizon in trading days (default 1); ?what_if=SYMBOL:AMOUNT adds the same
+    figures after changing that stock's exposure by AMOUNT dollars.
+    """
+    try:
+        horizon = int(request.query_params.get('horizon', 1))
+        what_if = None
+        if request.query_params.get('what_if'):
+            symbol, amount = request.query_params['what_if'].split(':')
+            amount = _finite_float(amount)
+    except ValueError:
+        return Response({"error": "horizon must be an integer and what_if SYMBOL:AMOUNT."}, status=status.HTTP_400_BAD_REQUEST)
+    if horizon < 1:
+        return Response({"error": "horizon must be at least 1."}, status=status.HTTP_400_BAD_REQUEST)
+    if request.query_params.get('what_if'):
+        stock_id = Stock.objects.filter(symbol=symbol.strip().upper()).values_list('id', flat=True).first()
+        if stock_id is None:
+            return Response({"error": f"Unknown stock {symbol}."}, status=status.HTTP_400_BAD_REQUEST)
+        what_if = (stock_id, amount)
+    return Response(portfolio_risk(horizon_days=horizon, what_if=what_if))
+
+@api_view(['GET'])
+def rebalance_view(request):
+    """
+    Trades that move the portfolio to its allocation targets, in whole shares
+    and contracts (see portfolio_tracker/allocation.py). Nothing is executed.
+    ?mode=mean_variance re-weights the targets' groups by a long-only
+    mean-variance optimum (?risk_aversion=, ?max_weight=); ?no_sell=true
+    only buys; ?cash_buffer= is the fraction of value kept in cash; ?band=
+    leaves groups within that weight of target alone.
+    """
+    params = request.query_params
+    mode = params.get('mode', 'targets')
+    if mode not in ('targets', 'mean_variance'):
+        return Response({"error": "mode must be targets or mean_variance."}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        numbers = {
+            name: _finite_float(params[name]) for name in ('cash_buffer', 'band', 'risk_aversion', 'max_weight')
+            if params.get(name)
+        }
+    except ValueError:
+        return Response({"error": "cash_buffer, band, risk_aversion and max_weight must be numbers."},
+                        status=status.HTTP_400_BAD_REQUEST)
+    if any(not 0 <= numbers.get(name, 0) <= 1 for name in ('cash_buffer', 'band', 'max_weight')) \
+            or numbers.get('risk_aversion', 0) < 0:
+        return Response({"error": "cash_buffer, band and max_weight are fractions; risk_aversion is not negative."},
+                        status=status.HTTP_400_BAD_REQUEST)
+    try:
+        return Response(rebalance(mode=mode, no_sell=params.get('no_sell', '').lower() in ('1', 'true'), **numbers))
+    except RebalanceError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+def metrics_view(request):
+    """
+    GET /metrics in the Prometheus text format, aggregated over every web,
+    worker and beat process. Guarded by METRICS_AUTH_TOKEN when it is set.
+    """
+    token = settings.METRICS_AUTH_TOKEN
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+        return HttpResponse("Unauthorized\n", status=401, content_type='text/plain')
+    try:
+        body = metrics.render()
+    except RedisError as e:
+        return HttpResponse(f"Metrics store unavailable: {e}\n", status=503, content_type='text/plain')
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')